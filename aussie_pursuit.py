@@ -1,20 +1,36 @@
 # Distributed under the Apache License, Version 2.0.
 # See accompanying NOTICE file for details.
 
-import argparse
+from __future__ import annotations
+
+import csv
+import json
 import logging
-import statistics
-import sys
+import numpy as np
+import os
+import time
 
-from iracingdataapi.client import irDataClient
+from pathlib import Path
+from typing import TYPE_CHECKING
 
+from core import instrumentation
+from core.clients import ClientMain
 from core.objects import Driver
 
+if TYPE_CHECKING:
+    from iracingdataapi.client import irDataClient
+
 _logger = logging.getLogger('log')
 
+# Race is always 0
+# -1 is expected to be a warmup practice session, while black flags are entered
+# -2 is Qualification
+# -3 is the initial practice
+_simsession_numbers = [-3, -2]
+
 
 class DriverLaps(Driver):
-    __slots__ = ["lap_times_s", "_car_class", "_ai",
+    __slots__ = ["_car_class", "_ai", "_lap_count",
                  "_average_lap_time_s", "_hold_time_s"]
 
     def __init__(self, cust_id: int, name: str, car_number: int, car_class: str, ai: bool):
@@ -25,7 +41,7 @@ class DriverLaps(Driver):
             self._name += "*"
         self._car_number = car_number
         self._car_class = car_class
-        self.lap_times_s = list()
+        self._lap_count = 0
         self._average_lap_time_s = None
         self._hold_time_s = None
 
@@ -34,162 +50,388 @@ class DriverLaps(Driver):
     @property
     def car_class(self): return self._car_class
 
+    @property
+    def lap_count(self): return self._lap_count
+
     @property
     def average_lap_time_s(self): return self._average_lap_time_s
 
     @property
     def hold_time_s(self): return self._hold_time_s
 
-    @staticmethod
-    def valid_lap_time(fastest_s: float, test_lap_s: float) -> bool:
-        return test_lap_s < (fastest_s * 1.07)
+    def calculate_hold_time(self, estimated_race_time_s: float, num_laps: int) -> None:
+        if self._average_lap_time_s is None:
+            self._hold_time_s = None
+            return
+        my_estimated_race_time_s = self._average_lap_time_s * num_laps
+        self._hold_time_s = estimated_race_time_s - my_estimated_race_time_s
+
+
+def best_lap_averages(drivers: np.ndarray, lap_times_s: np.ndarray, num_drivers: int,
+                      num_laps: int = 3, max_ratio: float = 1.07) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Average the fastest laps of every driver, in one grouped pass over all the laps
+    Laps must be within max_ratio (ex. 107%) of a driver's fastest lap, or they don't count
+    :param drivers: the index (0 to num_drivers) of the driver of each lap
+    :param lap_times_s: the time of each lap
+    :param num_laps: the number of fastest laps to average
+    :return: the average lap time of each driver (nan without any laps), and how many laps were averaged
+    """
+    if len(drivers) == 0:
+        return np.full(num_drivers, np.nan), np.zeros(num_drivers, dtype=np.int64)
+    order = np.lexsort((lap_times_s, drivers))  # By driver, fastest first
+    drivers = drivers[order]
+    lap_times_s = lap_times_s[order]
+    starts = np.flatnonzero(np.r_[True, drivers[1:] != drivers[:-1]])
+    counts = np.diff(np.r_[starts, len(drivers)])
+    rank = np.arange(len(drivers)) - np.repeat(starts, counts)
+    fastest_s = np.repeat(lap_times_s[starts], counts)
+    averaged = (rank < num_laps) & (lap_times_s < fastest_s * max_ratio)
+    num_averaged = np.bincount(drivers[averaged], minlength=num_drivers)
+    total_s = np.bincount(drivers[averaged], weights=lap_times_s[averaged], minlength=num_drivers)
+    with np.errstate(invalid="ignore"):
+        return total_s / num_averaged, num_averaged
 
-    def calculate_average_lap_time(self):
+
+class HoldTimes:
+    """
+    Aussie Pursuit hold times of a session, updated as its practice and qualifying laps come in
+    Every valid lap is kept in one array (with the index of its driver in another), laps we have not seen are
+    appended, and every driver's average is calculated again, together, when there are new ones
+    """
+    __slots__ = ["_subsession_id", "_num_laps", "_average_laps", "_max_ratio", "_ai_offset_s",
+                 "drivers", "_indexes", "_seen", "_lap_drivers", "_lap_times_s", "_slowest_driver"]
+
+    def __init__(self, subsession_id: int, num_laps: int,
+                 average_laps: int = 3, max_ratio: float = 1.07, ai_offset_s: float = 2):
         """
-        Calculate the fastest average lap time using the fastest 3 laps, if 3 laps are provided
-        Laps must be within 107% of the fastest laps, or they don't count
-        :return: None
+        :param subsession_id: the session, with its practice and qualifying
+        :param num_laps: race laps to calculate for
+        :param average_laps: number of a driver's fastest laps averaged into their expected lap time
+        :param max_ratio: laps slower than this ratio of a driver's fastest lap are not averaged (ex. 1.07 for 107%)
+        :param ai_offset_s: a driver without any laps is expected to be this much faster than the fastest bot in
+                            their car class
         """
-        _logger.info("Calculating average lap time for " + self.name + "...")
-        laps = list()  # list of laps we will average into a time for our hold calculation
-        laps.append(self.lap_times_s[0])
-        if len(self.lap_times_s) >= 2:
-            if self.valid_lap_time(self.lap_times_s[0], self.lap_times_s[1]):
-                laps.append(self.lap_times_s[1])
-            else:
-                _logger.info("Ignoring lap 2, as it was too slow (> 107% of the fastest lap)")
-        if len(self.lap_times_s) >= 3:
-            if self.valid_lap_time(self.lap_times_s[0], self.lap_times_s[2]):
-                laps.append(self.lap_times_s[2])
-            else:
-                _logger.info("Ignoring lap 3, as it was too slow (> 107% of the fastest lap)")
-        self._average_lap_time_s = statistics.mean(laps)
-        _logger.info("The average lap time for " + self.name + " is " + str(self._average_lap_time_s) + "s.")
+        self._subsession_id = subsession_id
+        self._num_laps = num_laps
+        self._average_laps = average_laps
+        self._max_ratio = max_ratio
+        self._ai_offset_s = ai_offset_s
+        self.drivers = dict()  # cust_id -> DriverLaps
+        self._indexes = dict()  # cust_id -> index of the driver in the lap arrays
+        self._seen = set()  # (simsession number, cust_id, lap number)
+        self._lap_drivers = np.empty(0, dtype=np.int64)
+        self._lap_times_s = np.empty(0, dtype=np.float64)
+        self._slowest_driver = None
 
-    def calculate_hold_time(self, estimated_race_time_s: float, num_laps: int) -> None:
-        my_estimated_race_time_s = self._average_lap_time_s * num_laps
-        self._hold_time_s = estimated_race_time_s - my_estimated_race_time_s
+    @property
+    def slowest_driver(self) -> DriverLaps | None: return self._slowest_driver
 
-    def use_fastest_ai_average_lap_time(self, drivers: dict):
+    @property
+    def estimated_race_time_s(self) -> float | None:
+        if self._slowest_driver is None:
+            return None
+        return self._slowest_driver.average_lap_time_s * self._num_laps
+
+    def add_drivers(self, ir_subsession: dict) -> int:
         """
-        If a driver has not set a valid lap time,
-        Get the fastest average lap time from the fastest AI driver for their car class, and take off 2s
-        :param drivers: all the drivers in the session
-        :return: None
+        Figure out what cars are driven by whom
+        :return: the number of drivers added, or whose car class we now know
         """
-        if self.is_ai():
-            _logger.error("Cannot use_fastest_ai_average_lap_time on an ai driver.")
-            return
-        _logger.info(self.name + " did not set any valid laps.")
-        _logger.info("Using the fastest average lap time from a bot in the " + self.car_class + ".")
-        fastest_bot = None
-        self._average_lap_time_s = 1000
-        for driver in drivers.values():
-            if driver.is_ai() and driver.car_class == self.car_class:
-                if driver.average_lap_time_s < self._average_lap_time_s:
-                    fastest_bot = driver
-                    self._average_lap_time_s = driver.average_lap_time_s
-        _logger.info("Bot " + fastest_bot.name +
-                     " had the fastest average lap time of " + str(fastest_bot.average_lap_time_s))
-        # Human driver is expected to go 2s faster than the fastest bot
-        self._average_lap_time_s -= 2
-        _logger.info("Setting " + self.name + "'s average lap time to " + str(self._average_lap_time_s))
-
-
-def calculate_black_flags(username: str, password: str, subsession_id: int, num_laps: int):
-    idc = irDataClient(username, password)
-
-    # Race is always 0
-    # -1 is expected to be a warmup practice session, while black flags are entered
-    # -2 is Qualification
-    # -3 is the initial practice
-    simsession_numbers = [-3, -2]
-    drivers = dict()
-    # Figure out what cars were driven by whom
-    ir_subsession = idc.result(subsession_id=subsession_id)["session_results"]
-
-    for ir_event in ir_subsession:
-        if ir_event["simsession_number"] in simsession_numbers:
-            for result in ir_event["results"]:
-                driver = DriverLaps(result["cust_id"],
-                                    result["display_name"],
-                                    result["livery"]["car_number"],
-                                    result["car_class_short_name"],
-                                    result["ai"])
-                drivers[driver.cust_id] = driver
-
-    for simsession_number in simsession_numbers:
-        all_laps = idc.result_lap_chart_data(subsession_id=subsession_id, simsession_number=simsession_number)
-        if all_laps is None:
-            _logger.info("Could not find simsession_number " + str(simsession_number))
-            continue
+        num_added = 0
+        for ir_event in ir_subsession["session_results"]:
+            if ir_event["simsession_number"] in _simsession_numbers:
+                for result in ir_event["results"]:
+                    driver = self.drivers.get(result["cust_id"])
+                    if driver is not None:
+                        if driver.car_class is None:  # Added from the lap chart, while the session was running
+                            driver._car_class = result["car_class_short_name"]
+                            num_added += 1
+                        continue
+                    driver = DriverLaps(result["cust_id"],
+                                        result["display_name"],
+                                        result["livery"]["car_number"],
+                                        result["car_class_short_name"],
+                                        result["ai"])
+                    self._add_driver(driver)
+                    num_added += 1
+        return num_added
 
+    def add_lap_drivers(self, all_laps: list) -> int:
+        """
+        Figure out who is driving from a lap chart, while the session is running and has no results yet
+        Their car class is not in the lap chart, so it is unknown until the results are
+        :return: the number of drivers added
+        """
+        num_added = 0
+        for lap in all_laps:
+            if lap["cust_id"] in self.drivers:
+                continue
+            self._add_driver(DriverLaps(lap["cust_id"], lap["display_name"], lap["car_number"], None,
+                                        lap.get("ai", False)))
+            num_added += 1
+        return num_added
+
+    def _add_driver(self, driver: DriverLaps):
+        self.drivers[driver.cust_id] = driver
+        self._indexes[driver.cust_id] = len(self._indexes)
+
+    def add_laps(self, simsession_number: int, all_laps: list) -> int:
+        """
+        :param all_laps: the lap chart of a simsession, laps already added are skipped
+        :return: the number of valid laps added
+        """
+        drivers = []
+        lap_times = []
         for lap in all_laps:
-            lap_time_s = lap["lap_time"] * 0.0001
-            if lap_time_s <= 0:
+            key = (simsession_number, lap["cust_id"], lap["lap_number"])
+            if key in self._seen or lap["cust_id"] not in self.drivers:
+                continue  # Laps of drivers we do not know yet are added once we do
+            self._seen.add(key)
+            if lap["lap_time"] <= 0:
                 continue  # Skip invalid laps
-            drivers[lap["cust_id"]].lap_times_s.append(lap_time_s)
-
-    # Sort our lap times
-    for driver in drivers.values():
-        driver.lap_times_s.sort()
-        _logger.info(driver.name + " : " + str(driver.lap_times_s))
-
-    # Calculate the average lap time of each driver
-    # Find the slowest average lap time and multiply by the number of laps we want
-    slowest_driver = None
-    slowest_average_lap_time_s = 0
-    for cust_id, driver in drivers.items():
-        if len(driver.lap_times_s) > 0:
-            driver.calculate_average_lap_time()
-            if slowest_average_lap_time_s < driver.average_lap_time_s:
-                slowest_driver = driver
-                slowest_average_lap_time_s = driver.average_lap_time_s
-    slowest_race_time_s = slowest_average_lap_time_s * num_laps
-    # This is our estimate of how long the race should last
-    _logger.info("\n")
-    _logger.info("The slowest driver is " + slowest_driver.name +
-                 ", with an average lap time of " + str(slowest_driver.average_lap_time_s))
-    _logger.info("A " + str(num_laps) + " lap race is expected to run for " + str(slowest_race_time_s) + "s.\n\n")
-
-    for cust_id, driver in drivers.items():
-        if len(driver.lap_times_s) == 0:
-            driver.use_fastest_ai_average_lap_time(drivers)
-        driver.calculate_hold_time(slowest_race_time_s, num_laps)
-        _logger.info(driver.name + " is averaging " +
-                     str(driver.average_lap_time_s) + "s laps and should be held for " +
-                     str(driver.hold_time_s) + " seconds.\n")
+            drivers.append(self._indexes[lap["cust_id"]])
+            lap_times.append(lap["lap_time"])
+        if drivers:
+            self._lap_drivers = np.concatenate([self._lap_drivers, np.array(drivers, dtype=np.int64)])
+            self._lap_times_s = np.concatenate([self._lap_times_s, np.array(lap_times, dtype=np.float64) * 0.0001])
+        return len(drivers)
+
+    def calculate(self) -> bool:
+        """
+        Calculate the average lap time of every driver, then every hold time
+        :return: if any hold time changed
+        """
+        averages, num_averaged = best_lap_averages(self._lap_drivers, self._lap_times_s, len(self._indexes),
+                                                   self._average_laps, self._max_ratio)
+        lap_counts = np.bincount(self._lap_drivers, minlength=len(self._indexes))
+        for cust_id, idx in self._indexes.items():
+            driver = self.drivers[cust_id]
+            driver._lap_count = int(lap_counts[idx])
+            driver._average_lap_time_s = float(averages[idx]) if num_averaged[idx] else None
+
+        # Drivers without any laps are expected to be a bit faster than the fastest bot in their car class
+        fastest_ai = dict()  # car class -> the bot with the fastest average lap time
+        # Until the session has results, drivers from its lap chart have no car class to compare within
+        for driver in self.drivers.values():
+            if driver.is_ai() and driver.average_lap_time_s is not None and driver.car_class is not None:
+                bot = fastest_ai.get(driver.car_class)
+                if bot is None or driver.average_lap_time_s < bot.average_lap_time_s:
+                    fastest_ai[driver.car_class] = driver
+        for driver in self.drivers.values():
+            if driver.lap_count == 0 and not driver.is_ai() and driver.car_class is not None:
+                bot = fastest_ai.get(driver.car_class)
+                if bot is not None:
+                    driver._average_lap_time_s = bot.average_lap_time_s - self._ai_offset_s
+
+        # Find the slowest average lap time and multiply by the number of laps we want
+        # This is our estimate of how long the race should last
+        estimated_race_time_s = self.estimated_race_time_s
+        timed = [driver for driver in self.drivers.values() if driver.average_lap_time_s is not None]
+        self._slowest_driver = max(timed, key=lambda d: d.average_lap_time_s) if timed else None
+        if self._slowest_driver is None:
+            return False
+        if estimated_race_time_s != self.estimated_race_time_s:
+            _logger.info(f"The slowest driver is {self._slowest_driver.name}, with an average lap time of "
+                         f"{self._slowest_driver.average_lap_time_s}")
+            _logger.info(f"A {self._num_laps} lap race is expected to run for {self.estimated_race_time_s}s.")
+
+        updated = False
+        for driver in self.drivers.values():
+            hold_time_s = driver.hold_time_s
+            driver.calculate_hold_time(self.estimated_race_time_s, self._num_laps)
+            updated |= hold_time_s != driver.hold_time_s
+        return updated
+
+    def update(self, idc: irDataClient) -> bool:
+        """
+        Pull the session's laps, adding new ones
+        :return: if any hold time changed
+        """
+        # Practice, qualifying and the race are one subsession, which has no results until the race is over
+        running = False
+        with instrumentation.span("aussie.roster"):
+            try:
+                num_added = self.add_drivers(idc.result(subsession_id=self._subsession_id))
+            except RuntimeError as e:
+                # irDataClient has no error of its own for a result that is not ready, so say what it was
+                _logger.info(f"No results for subsession {self._subsession_id} yet, taking it as running: {e}")
+                running = True
+                num_added = 0
+        num_laps = 0
+        for simsession_number in _simsession_numbers:
+            with instrumentation.span("aussie.laps", simsession=simsession_number):
+                all_laps = idc.result_lap_chart_data(subsession_id=self._subsession_id,
+                                                     simsession_number=simsession_number)
+            if all_laps is None:
+                _logger.info("Could not find simsession_number " + str(simsession_number))
+                continue
+            if running:
+                num_added += self.add_lap_drivers(all_laps)
+            num_laps += self.add_laps(simsession_number, all_laps)
+        if not num_laps and not num_added:
+            return False
+        return self.calculate()
+
+    def table(self) -> list[dict]:
+        """ :return: {"name", "car_number", "car_class", "average_lap_time_s", "hold_time_s"}, in release order """
+        rows = [{"cust_id": driver.cust_id,
+                 "name": driver.name,
+                 "car_number": driver.car_number,
+                 "car_class": driver.car_class,
+                 "laps": driver.lap_count,
+                 "average_lap_time_s": driver.average_lap_time_s,
+                 "hold_time_s": driver.hold_time_s} for driver in self.drivers.values()]
+        rows.sort(key=lambda row: (row["hold_time_s"] is None, row["hold_time_s"] or 0))
+        return rows
+
+
+def write_hold_times(table: list[dict], filename: Path):
+    """
+    Write a HoldTimes table as csv (.csv) or json (.json), replacing filename only once it is completely written,
+    so anything watching it (ex. race control) never reads a partial file
+    """
+    filename.parent.mkdir(exist_ok=True, parents=True)
+    tmp_filename = filename.with_name(filename.name + ".tmp")
+    with open(tmp_filename, 'w', newline='', encoding="utf-8") as fp:
+        if filename.suffix == ".json":
+            json.dump(table, fp, ensure_ascii=False, indent=2)
+        else:
+            writer = csv.writer(fp)
+            writer.writerow(["Name", "Car number", "Car class", "Laps", "Average lap time (s)", "Hold time (s)"])
+            for row in table:
+                writer.writerow([row["name"], row["car_number"], row["car_class"], row["laps"],
+                                 "" if row["average_lap_time_s"] is None else f"{row['average_lap_time_s']:.3f}",
+                                 "" if row["hold_time_s"] is None else f"{row['hold_time_s']:.1f}"])
+    os.replace(tmp_filename, filename)
+    return filename
+
+
+def calculate_black_flags(idc: irDataClient, hold_times: HoldTimes) -> HoldTimes:
+    hold_times.update(idc)
+    for row in hold_times.table():
+        _logger.info(f"{row['name']} is averaging {row['average_lap_time_s']}s laps and should be held for "
+                     f"{row['hold_time_s']} seconds.")
+    return hold_times
+
+
+class AussiePursuitMain(ClientMain):
+    __slots__ = ["_subsession_id", "_num_laps", "_average_laps", "_max_ratio", "_ai_offset_s",
+                 "_live", "_poll_interval_s", "_output"]
+
+    def __init__(self, log_filename: str):
+        self._subsession_id = None
+        self._num_laps = 20
+        self._average_laps = 3
+        self._max_ratio = 1.07
+        self._ai_offset_s = 2
+        self._live = False
+        self._poll_interval_s = 5
+        self._output = None
+        super().__init__(log_filename)
+
+    def add_args(self, parser):
+        super().add_args(parser)
+        parser.add_argument(
+            "-s", "--session",
+            required=True,
+            type=int,
+            help="Session id to monitor."
+        )
+        parser.add_argument(
+            "-l", "--laps",
+            default=20,
+            type=int,
+            help="Number of race laps to calculate for."
+        )
+        parser.add_argument(
+            "-avg", "--average_laps",
+            default=3,
+            type=int,
+            help="Number of a driver's fastest laps to average."
+        )
+        parser.add_argument(
+            "-ratio", "--max_lap_ratio",
+            default=1.07,
+            type=float,
+            help="Laps slower than this ratio of a driver's fastest lap are not averaged (1.07 is 107%%)."
+        )
+        parser.add_argument(
+            "-aio", "--ai_offset",
+            default=2,
+            type=float,
+            help="Seconds a driver without any laps is expected to be faster than the fastest bot in their class."
+        )
+        parser.add_argument(
+            "-live", "--live",
+            action="store_true",
+            help="Keep pulling practice and qualifying laps, publishing hold times every time they change"
+        )
+        parser.add_argument(
+            "-poll", "--poll_interval",
+            default=5,
+            type=float,
+            help="Seconds between pulls of new laps when live"
+        )
+        parser.add_argument(
+            "-o", "--output",
+            default=None,
+            type=Path,
+            help="Publish hold times to this file (.csv or .json), default is ./results/Aussie Pursuit <session>.csv"
+        )
+
+    def process_args(self, args):
+        super().process_args(args)
+        self._subsession_id = args.session
+        self._num_laps = args.laps
+        self._average_laps = args.average_laps
+        self._max_ratio = args.max_lap_ratio
+        self._ai_offset_s = args.ai_offset
+        self._live = args.live
+        self._poll_interval_s = args.poll_interval
+        self._output = args.output or Path(f"./results/Aussie Pursuit {self._subsession_id}.csv")
+
+    def run(self, polls: int = None):
+        """
+        Calculate and publish hold times, once, or every time they change when live
+        :param polls: stop after this many polls when live, default is to keep polling until interrupted
+        """
+        hold_times = HoldTimes(self._subsession_id, self._num_laps,
+                               self._average_laps, self._max_ratio, self._ai_offset_s)
+        if not self._live:
+            calculate_black_flags(self.idc, hold_times)
+            write_hold_times(hold_times.table(), self._output)
+            return
+
+        from iracingdataapi.exceptions import AccessTokenInvalid
+
+        poll = 0
+        while polls is None or poll < polls:
+            if poll > 0:
+                # Each poll has its own summary, and what is recorded does not grow poll after poll
+                instrumentation.flush()
+                time.sleep(self._poll_interval_s)
+            poll += 1
+            try:
+                with instrumentation.span("aussie.poll"):
+                    try:
+                        updated = hold_times.update(self.idc)
+                    except AccessTokenInvalid:
+                        _logger.info("iRacing access token expired, authenticating again")
+                        updated = hold_times.update(self.authenticate())
+            except KeyboardInterrupt:
+                raise
+            except Exception as e:
+                _logger.error(f"Unable to pull laps, will try again: {e}")
+                continue
+            if updated:
+                write_hold_times(hold_times.table(), self._output)
+                _logger.info(f"Published hold times to {self._output}")
+
+
+def main():
+    AussiePursuitMain(log_filename="aussie_pursuit.log").run()
 
 
 if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s', filename="ams.log", filemode="w")
-    logging.getLogger('ams').setLevel(logging.INFO)
-    logging.getLogger().addHandler(logging.StreamHandler(sys.stdout))
-
-    parser = argparse.ArgumentParser(description="Pull league results and rack and stack them for presentation")
-    parser.add_argument(
-        "username",
-        type=str,
-        help="iracing user name."
-    )
-    parser.add_argument(
-        "password",
-        type=str,
-        help="iracing password."
-    )
-    parser.add_argument(
-        "-s", "--session",
-        default=None,
-        type=str,
-        help="Session id to monitor."
-    )
-    parser.add_argument(
-        "-l", "--laps",
-        default=20,
-        type=int,
-        help="Number of race laps to calculate for."
-    )
-    opts = parser.parse_args()
-
-    calculate_black_flags(opts.username, opts.password, 65859026, opts.laps)
-    # calculate_black_flags(opts.username, opts.password, "64508370", opts.laps)
+    main()
@@ -0,0 +1,354 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+import argparse
+import hashlib
+import json
+import logging
+import numpy as np
+import os
+
+from pathlib import Path
+
+from core import instrumentation
+from core.objects import LeagueResult
+from core.ratings import SeasonLoader
+
+_logger = logging.getLogger('log')
+
+# The columns of each table, every row is keyed by archive season (and race, and cust_id)
+_tables = {
+    "drivers": {
+        "season": np.int32,
+        "cust_id": np.int64,
+        "car_number": np.int32,
+        "group": np.int16,  # Index into the season's groups
+        "race_starts": np.int32,
+        "earned_points": np.float64,
+        "drop_points": np.float64,
+        "wins": np.int32,
+        "poles": np.int32,
+        "incidents": np.int32,
+        "laps_complete": np.int32,
+        "laps_lead": np.int32,
+        "mu": np.float64,
+        "sigma": np.float64,
+    },
+    "results": {
+        "season": np.int32,
+        "race": np.int16,
+        "cust_id": np.int64,
+        "start_position": np.int16,
+        "finish_position": np.int16,
+        "points": np.float64,
+        "win": np.bool_,  # Of the driver's group
+        "pole_position": np.bool_,
+        "fastest_lap": np.bool_,
+        "most_laps_lead": np.bool_,
+        "incidents": np.int16,
+        "laps_completed": np.int16,
+        "laps_lead": np.int16,
+        "clean_laps": np.int16,
+        "fastest_lap_time": np.int64,  # 1/10000 of a second
+        "interval": np.int64,
+        "mu": np.float64,
+        "sigma": np.float64,
+    },
+    "laps": {
+        "season": np.int32,
+        "race": np.int16,
+        "cust_id": np.int64,
+        "number": np.int16,
+        "position": np.int16,
+        "clean": np.bool_,
+        "time": np.int64,
+        "session_time": np.int64,
+    },
+}
+
+
+def season_content_stamp(season_filename: Path) -> str:
+    """ Only changes when what is in a season file changes, unlike its size and time (ex. when it is scored again) """
+    return hashlib.sha256(season_filename.read_bytes()).hexdigest()
+
+
+def _driver_rows(season: int, lg: LeagueResult, groups: list):
+    for cust_id, d in lg.drivers.items():
+        yield (season, cust_id, d.car_number or 0, groups.index(str(d.group)), d.total_race_starts,
+               d.earned_points, d.drop_points, d._total_wins, d._total_pole_positions, d._total_incidents,
+               d._total_laps_complete, d._total_lead_a_lap, d._mu, d._sigma)
+
+
+def _result_rows(season: int, lg: LeagueResult):
+    for number, race in lg.races.items():
+        winners = {stats.winning_driver for stats in race.stats.values() if stats is not None}
+        for cust_id, r in race.grid.items():
+            yield (season, number, cust_id, r.start_position, r.finish_position, r.points,
+                   cust_id in winners, r.pole_position, r.fastest_lap, r._most_laps_lead, r._incidents, r._laps_completed,
+                   r._laps_lead, r._clean_laps, r._fastest_lap_time or 0, r.interval or 0, r._mu, r._sigma)
+
+
+def _lap_rows(season: int, lg: LeagueResult):
+    for number, race in lg.races.items():
+        for cust_id, r in race.grid.items():
+            for lap in r.laps:
+                yield (season, number, cust_id, lap.number or 0, lap.position or 0, lap.clean,
+                       lap.time or 0, lap.session_time or 0)
+
+
+class SeasonArchive:
+    """
+    Every scored season in one directory of flat tables (drivers, results and laps) with a column per file,
+    read through memory maps so a query only touches the rows it asks for
+    Tables are only appended to, a season that is archived again (ex. after its next race) supersedes its old rows,
+    which compact removes, once there are enough of them
+    """
+    __slots__ = ["_directory", "_compact_ratio", "_manifest", "_columns", "_indexes"]
+
+    def __init__(self, directory: Path = Path("./archive"), compact_ratio: float = 0.5):
+        """
+        :param compact_ratio: compact once more than this share of the rows are of superseded seasons
+        """
+        self._directory = directory
+        self._compact_ratio = compact_ratio
+        self._manifest = {"seasons": [], "names": {}, "rows": {table: 0 for table in _tables}}
+        self._columns = dict()  # (table, column) -> memory map
+        self._indexes = dict()  # table -> (cust_ids in order, row order)
+        manifest_filename = directory / "manifest.json"
+        if manifest_filename.exists():
+            with open(manifest_filename, 'r', encoding="utf-8") as fp:
+                self._manifest = json.load(fp)
+
+    def _column_filename(self, table: str, column: str) -> Path:
+        return self._directory / table / f"{column}.bin"
+
+    def _save_manifest(self):
+        # Rows past what the manifest counts (ex. from an interrupted append) are ignored, then overwritten
+        tmp_filename = self._directory / "manifest.json.tmp"
+        with open(tmp_filename, 'w', encoding="utf-8") as fp:
+            json.dump(self._manifest, fp, ensure_ascii=False)
+        os.replace(tmp_filename, self._directory / "manifest.json")
+
+    def num_rows(self, table: str) -> int:
+        return self._manifest["rows"][table]
+
+    def seasons(self, superseded: bool = False) -> list[dict]:
+        """ :return: {"id", "league", "season", "races": [{"number", "date", "track", "subsession_id"}], ...} """
+        return [s for s in self._manifest["seasons"] if superseded or not s["superseded"]]
+
+    def season(self, season_id: int) -> dict:
+        return self._manifest["seasons"][season_id]
+
+    def find_season(self, league: str, season: str) -> dict | None:
+        for s in self._manifest["seasons"]:
+            if s["league"] == league and s["season"] == season and not s["superseded"]:
+                return s
+        return None
+
+    def name(self, cust_id: int) -> str:
+        return self._manifest["names"].get(str(cust_id))
+
+    def _append(self, table: str, rows) -> int:
+        columns = list(_tables[table].items())
+        values = [[] for _ in columns]
+        for row in rows:
+            for column, value in zip(values, row):
+                column.append(value)
+        num_rows = self._manifest["rows"][table]
+        (self._directory / table).mkdir(exist_ok=True, parents=True)
+        for (column, dtype), column_values in zip(columns, values):
+            filename = self._column_filename(table, column)
+            size = num_rows * np.dtype(dtype).itemsize
+            with open(filename, 'ab') as fp:
+                if fp.tell() != size:
+                    fp.truncate(size)
+                    fp.seek(size)
+                fp.write(np.array(column_values, dtype=dtype).tobytes())
+        return len(values[0])
+
+    @instrumentation.timed("archive.add_season")
+    def add_season(self, league: str, season: str, lg: LeagueResult, stamp: str = None) -> dict:
+        """
+        Append a scored season, superseding any rows already archived for it
+        :param stamp: identifies this version of the season (ex. season_content_stamp of its results file), if the
+                      archived season has the same stamp nothing is appended
+        :return: the archived season
+        """
+        archived = self.find_season(league, season)
+        if archived is not None and stamp is not None and archived["stamp"] == stamp:
+            return archived
+
+        season_id = len(self._manifest["seasons"])
+        groups = sorted({str(driver.group) for driver in lg.drivers.values()})
+        entry = {"id": season_id,
+                 "league": league,
+                 "season": season,
+                 "stamp": stamp,
+                 "superseded": False,
+                 "groups": groups,
+                 "races": [{"number": number, "date": race.date, "track": race.track,
+                            "subsession_id": race.subsession_id} for number, race in lg.races.items()],
+                 "rows": {}}
+        entry["rows"]["drivers"] = self._append("drivers", _driver_rows(season_id, lg, groups))
+        entry["rows"]["results"] = self._append("results", _result_rows(season_id, lg))
+        entry["rows"]["laps"] = self._append("laps", _lap_rows(season_id, lg))
+        for table, num_rows in entry["rows"].items():
+            self._manifest["rows"][table] += num_rows
+        for cust_id, member in lg.members.items():
+            self._manifest["names"][str(cust_id)] = member.name
+        for cust_id, driver in lg.drivers.items():
+            self._manifest["names"][str(cust_id)] = driver.name
+        if archived is not None:
+            archived["superseded"] = True
+        self._manifest["seasons"].append(entry)
+        self._save_manifest()
+        self._columns.clear()
+        self._indexes.clear()
+        _logger.info(f"Archived {league} {season} as season {season_id}: " +
+                     ", ".join(f"{n} {table}" for table, n in entry["rows"].items()))
+        if self.superseded_ratio() > self._compact_ratio:
+            self.compact()
+        return entry
+
+    def superseded_ratio(self) -> float:
+        """ :return: the share of rows that are of superseded seasons """
+        num_rows = sum(self._manifest["rows"].values())
+        if num_rows == 0:
+            return 0.0
+        superseded = sum(n for s in self._manifest["seasons"] if s["superseded"] for n in s["rows"].values())
+        return superseded / num_rows
+
+    def add_season_file(self, season_filename: Path, league: str = None, season: str = None) -> dict:
+        """
+        Archive a season written by score_league, ./results/<league> <season>.json
+        The league and season names come from the configuration score_league wrote next to it, if not given
+        """
+        if league is None or season is None:
+            cfg_filename = season_filename.parent.parent / "configs" / f"{season_filename.stem}.cfg.json"
+            if cfg_filename.exists():
+                with open(cfg_filename, 'r', encoding="utf-8") as fp:
+                    cfg = json.load(fp)
+                league = league or cfg.get("Name")
+                season = season or cfg.get("Season")
+        league = league or season_filename.stem
+        season = season or ""
+        stamp = season_content_stamp(season_filename)
+        archived = self.find_season(league, season)
+        if archived is not None and archived["stamp"] == stamp:
+            return archived
+        lg = SeasonLoader(laps=True).load(season_filename)
+        return self.add_season(league, season, lg, stamp)
+
+    def column(self, table: str, column: str) -> np.ndarray:
+        """ A read only, memory mapped, column of a table, do not hold on to it past a compact (ex. copy its rows) """
+        key = (table, column)
+        if key not in self._columns:
+            num_rows = self._manifest["rows"][table]
+            dtype = _tables[table][column]
+            if num_rows == 0:
+                self._columns[key] = np.empty(0, dtype=dtype)
+            else:
+                self._columns[key] = np.memmap(self._column_filename(table, column), dtype=dtype, mode='r',
+                                               shape=(num_rows,))
+        return self._columns[key]
+
+    def _active_rows(self, table: str) -> np.ndarray:
+        superseded = [s["id"] for s in self._manifest["seasons"] if s["superseded"]]
+        if not superseded:
+            return np.arange(self.num_rows(table))
+        return np.flatnonzero(~np.isin(self.column(table, "season"), superseded))
+
+    def _index(self, table: str):
+        """ Rows of a table (of seasons that are not superseded) sorted by cust_id """
+        if table not in self._indexes:
+            rows = self._active_rows(table)
+            cust_ids = self.column(table, "cust_id")[rows]
+            order = np.argsort(cust_ids, kind="stable")
+            self._indexes[table] = (cust_ids[order], rows[order])
+        return self._indexes[table]
+
+    def _select(self, table: str, rows: np.ndarray, columns: list = None) -> dict:
+        names = columns if columns is not None else list(_tables[table].keys())
+        return {name: self.column(table, name)[rows] for name in names}
+
+    def driver_rows(self, table: str, cust_id: int) -> np.ndarray:
+        """ Rows of a table for a driver, in the order they were archived """
+        cust_ids, rows = self._index(table)
+        start, stop = np.searchsorted(cust_ids, [cust_id, cust_id + 1])
+        return rows[start:stop]
+
+    def driver(self, cust_id: int, columns: list = None) -> dict:
+        """ Season totals of a driver, across every league, as column name -> values """
+        return self._select("drivers", self.driver_rows("drivers", cust_id), columns)
+
+    def driver_results(self, cust_id: int, columns: list = None) -> dict:
+        """ Every result of a driver, across every league, as column name -> values """
+        return self._select("results", self.driver_rows("results", cust_id), columns)
+
+    def driver_laps(self, cust_id: int, columns: list = None) -> dict:
+        """ Every lap of a driver, across every league, as column name -> values """
+        return self._select("laps", self.driver_rows("laps", cust_id), columns)
+
+    def season_results(self, league: str, season: str, race: int = None, columns: list = None) -> dict:
+        """ The results of a season (or one of its races), as column name -> values """
+        archived = self.find_season(league, season)
+        if archived is None:
+            return self._select("results", np.empty(0, dtype=np.int64), columns)
+        # A season's rows are contiguous
+        start = sum(s["rows"]["results"] for s in self._manifest["seasons"][:archived["id"]])
+        rows = np.arange(start, start + archived["rows"]["results"])
+        if race is not None:
+            rows = rows[self.column("results", "race")[rows] == race]
+        return self._select("results", rows, columns)
+
+    @instrumentation.timed("archive.compact")
+    def compact(self):
+        """ Rewrite every table without the rows of superseded seasons, which renumbers the seasons """
+        seasons = self.seasons()
+        old_ids = np.full(len(self._manifest["seasons"]), -1, dtype=np.int32)
+        for new_id, s in enumerate(seasons):
+            old_ids[s["id"]] = new_id
+        tables = dict()
+        for table, columns in _tables.items():
+            rows = self._active_rows(table)
+            tables[table] = {column: np.array(self.column(table, column)[rows]) for column in columns}
+            tables[table]["season"] = old_ids[tables[table]["season"]]
+
+        # Windows will not replace a file that is memory mapped, so drop our maps (and indexes over them) first
+        opened = list(self._columns.keys())
+        self._columns.clear()
+        self._indexes.clear()
+        for table, data in tables.items():
+            for column, values in data.items():
+                tmp_filename = self._column_filename(table, column).with_suffix(".tmp")
+                values.tofile(tmp_filename)
+                os.replace(tmp_filename, self._column_filename(table, column))
+            self._manifest["rows"][table] = len(data["season"])
+        for new_id, s in enumerate(seasons):
+            s["id"] = new_id
+        self._manifest["seasons"] = seasons
+        self._save_manifest()
+        for table, column in opened:
+            self.column(table, column)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser(description="Archive scored seasons for historical analysis")
+    parser.add_argument("seasons", nargs='*', type=Path, help="Season files, default is every ./results/*.json")
+    parser.add_argument("-a", "--archive", default=Path("./archive"), type=Path, help="Archive directory.")
+    parser.add_argument("-c", "--compact", action="store_true", help="Remove superseded rows from the archive.")
+    opts = parser.parse_args()
+
+    archive = SeasonArchive(opts.archive)
+    for season_filename in opts.seasons or sorted(Path("./results").glob("*.json")):
+        archive.add_season_file(season_filename)
+    if opts.compact:
+        archive.compact()
+    print(f"{len(archive.seasons())} seasons, " +
+          ", ".join(f"{archive.num_rows(table)} {table}" for table in _tables))
+
+
+if __name__ == "__main__":
+    main()
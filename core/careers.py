@@ -0,0 +1,218 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+import argparse
+import json
+import logging
+import numpy as np
+import os
+
+from pathlib import Path
+
+from core import instrumentation
+from core.archive import SeasonArchive
+from core.objects import LeagueResult
+from core.ratings import season_stamp
+
+_logger = logging.getLogger('log')
+
+
+def _season_key(season: dict) -> str:
+    # Not by archive id, which compact renumbers
+    return f"{season['league']}/{season['season']}:{season['stamp']}"
+
+
+class DriverCareers:
+    """
+    Career statistics of every archived driver, across every league, precomputed so looking a driver up is a
+    dictionary lookup (ex. for a chat bot)
+    Careers are kept next to the archive, in careers.json, and a refresh only recomputes the drivers of seasons that
+    were archived (or superseded) since the last one
+    """
+    __slots__ = ["_directory", "_archive", "_filename", "_stamp", "_seasons", "_careers", "_races"]
+
+    def __init__(self, directory: Path = Path("./archive")):
+        """
+        :param directory: the SeasonArchive directory
+        """
+        self._directory = directory
+        self._archive = SeasonArchive(directory)
+        self._filename = directory / "careers.json"
+        self._stamp = None
+        self._seasons = dict()  # season key -> cust_ids, of the archived seasons the careers include
+        self._careers = dict()  # cust_id -> career
+        self._races = dict()  # archive season id -> race number -> race
+        self._load()
+
+    def __contains__(self, cust_id: int):
+        self._load()
+        return cust_id in self._careers
+
+    def __len__(self):
+        self._load()
+        return len(self._careers)
+
+    def _load(self):
+        """ (Re)load the careers, if another process (ex. score_league) wrote them since we last looked """
+        if not self._filename.exists():
+            return
+        stamp = season_stamp(self._filename)
+        if stamp == self._stamp:
+            return
+        with open(self._filename, 'r', encoding="utf-8") as fp:
+            src = json.load(fp)
+        self._seasons = src["seasons"]
+        self._careers = {int(cust_id): career for cust_id, career in src["careers"].items()}
+        self._stamp = stamp
+
+    def _save(self):
+        self._directory.mkdir(exist_ok=True, parents=True)
+        tmp_filename = self._filename.with_suffix(".json.tmp")
+        with open(tmp_filename, 'w', encoding="utf-8") as fp:
+            json.dump({"seasons": self._seasons, "careers": self._careers}, fp, ensure_ascii=False)
+        os.replace(tmp_filename, self._filename)
+        self._stamp = season_stamp(self._filename)
+
+    def driver(self, cust_id: int) -> dict | None:
+        """
+        :return: {"cust_id", "name", "leagues", "seasons", "starts", "wins", "poles", "fastest_laps", "laps",
+                  "laps_lead", "incidents", "incidents_per_lap", "average_finish", "best_finish", "first_race",
+                  "last_race", "mu", "sigma", "leagues_stats": {league: {...}},
+                  "trajectory": [[date, league, season, race, mu, sigma], ...] after each race, oldest first}
+                 None if the driver has not raced in any archived season
+        """
+        self._load()
+        return self._careers.get(cust_id)
+
+    def find(self, name: str) -> list[tuple[int, str]]:
+        """ :return: (cust_id, name) of drivers whose name contains name, ignoring case """
+        self._load()
+        name = name.lower()
+        return [(cust_id, career["name"]) for cust_id, career in self._careers.items()
+                if name in career["name"].lower()]
+
+    def add_season(self, league: str, season: str, lg: LeagueResult, stamp: str = None) -> int:
+        """
+        Archive a scored season and refresh the careers of its drivers
+        :return: the number of careers refreshed
+        """
+        self._archive.add_season(league, season, lg, stamp)
+        return self.refresh()
+
+    @instrumentation.timed("careers.refresh")
+    def refresh(self) -> int:
+        """
+        Bring careers up to date with the archive
+        :return: the number of careers refreshed
+        """
+        self._load()
+        self._archive = SeasonArchive(self._directory)  # Someone else may have added to it
+        self._races.clear()
+        active = {_season_key(season): season for season in self._archive.seasons()}
+        removed = [key for key in self._seasons if key not in active]
+        added = [key for key in active if key not in self._seasons]
+        if not removed and not added:
+            return 0
+
+        cust_ids = set()
+        for key in removed:
+            cust_ids.update(self._seasons.pop(key))
+        seasons = self._archive.column("drivers", "season")
+        for key in added:
+            rows = np.flatnonzero(seasons == active[key]["id"])
+            drivers = self._archive.column("drivers", "cust_id")[rows].tolist()
+            self._seasons[key] = drivers
+            cust_ids.update(drivers)
+
+        for cust_id in cust_ids:
+            career = self._career(cust_id)
+            if career is None:
+                self._careers.pop(cust_id, None)
+            else:
+                self._careers[cust_id] = career
+        self._save()
+        _logger.info(f"Refreshed {len(cust_ids)} careers, {len(added)} seasons added, {len(removed)} removed")
+        return len(cust_ids)
+
+    def _race(self, season_id: int, number: int) -> dict:
+        if season_id not in self._races:
+            self._races[season_id] = {race["number"]: race for race in self._archive.season(season_id)["races"]}
+        return self._races[season_id][number]
+
+    def _career(self, cust_id: int) -> dict | None:
+        columns = ["season", "race", "finish_position", "win", "pole_position", "fastest_lap", "incidents",
+                   "laps_completed", "laps_lead", "mu", "sigma"]
+        results = {column: values.tolist() for column, values in self._archive.driver_results(cust_id, columns).items()}
+        if not results["season"]:
+            return None
+
+        # A race scored by more than one configuration (ex. overall and by class) only counts once
+        races = dict()
+        for row in zip(*results.values()):
+            r = dict(zip(columns, row))
+            season = self._archive.season(r["season"])
+            race = self._race(r["season"], r["race"])
+            key = race["subsession_id"] or (r["season"], r["race"])
+            if key in races:
+                for flag in ("win", "pole_position", "fastest_lap"):
+                    races[key][flag] = races[key][flag] or r[flag]
+                continue
+            races[key] = {**r, "league": season["league"], "season": season["season"], "date": race["date"]}
+        races = sorted(races.values(), key=lambda r: r["date"])
+
+        def stats(rs: list) -> dict:
+            laps = sum(r["laps_completed"] for r in rs)
+            incidents = sum(r["incidents"] for r in rs)
+            finishes = [r["finish_position"] for r in rs if r["finish_position"] > 0]
+            return {"seasons": len({(r["league"], r["season"]) for r in rs}),
+                    "starts": len(rs),
+                    "wins": sum(r["win"] for r in rs),
+                    "poles": sum(r["pole_position"] for r in rs),
+                    "fastest_laps": sum(r["fastest_lap"] for r in rs),
+                    "laps": laps,
+                    "laps_lead": sum(r["laps_lead"] for r in rs),
+                    "incidents": incidents,
+                    "incidents_per_lap": incidents / laps if laps else None,
+                    "average_finish": sum(finishes) / len(finishes) if finishes else None,
+                    "best_finish": min(finishes) if finishes else None}
+
+        leagues = dict()
+        for r in races:
+            leagues.setdefault(r["league"], []).append(r)
+        return {"cust_id": cust_id,
+                "name": self._archive.name(cust_id) or str(cust_id),
+                "leagues": list(leagues.keys()),
+                **stats(races),
+                "first_race": races[0]["date"],
+                "last_race": races[-1]["date"],
+                "mu": races[-1]["mu"],
+                "sigma": races[-1]["sigma"],
+                "leagues_stats": {league: stats(rs) for league, rs in leagues.items()},
+                "trajectory": [[r["date"], r["league"], r["season"], r["race"], r["mu"], r["sigma"]] for r in races]}
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser(description="Look up the careers of drivers across every archived league")
+    parser.add_argument("drivers", nargs='*', help="iRacing customer ids, or (part of) names")
+    parser.add_argument("-a", "--archive", default=Path("./archive"), type=Path, help="Archive directory.")
+    parser.add_argument("-r", "--refresh", action="store_true", help="Bring careers up to date with the archive.")
+    opts = parser.parse_args()
+
+    careers = DriverCareers(opts.archive)
+    if opts.refresh:
+        careers.refresh()
+    for driver in opts.drivers:
+        cust_ids = [int(driver)] if driver.isdigit() else [cust_id for cust_id, name in careers.find(driver)]
+        for cust_id in cust_ids:
+            career = careers.driver(cust_id)
+            if career is None:
+                print(f"{cust_id} has not raced in any archived season")
+                continue
+            career = {key: value for key, value in career.items() if key != "trajectory"}
+            print(json.dumps(career, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
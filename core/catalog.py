@@ -0,0 +1,78 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+import json
+import logging
+import os
+
+from pathlib import Path
+
+from core import instrumentation
+
+_logger = logging.getLogger('log')
+
+
+class LeagueCatalog:
+    """
+    The seasons of leagues, and the sessions of those seasons, kept in a directory between runs
+    A refresh pulls a league's season list, and only pulls sessions of the seasons that could have changed:
+    seasons we have not seen before, and active seasons (which are still running races)
+    So it is cheap to refresh every time a league is used (ex. every poll of a long running process)
+    """
+    __slots__ = ["_directory", "_leagues"]
+
+    def __init__(self, directory: Path = Path("./catalog")):
+        """
+        :param directory: where each league is kept, as <league id>.json, None to keep leagues in memory only
+        """
+        self._directory = directory
+        self._leagues = dict()  # league id -> {"seasons": [ir season], "sessions": {season id: [ir session]}}
+
+    def _filename(self, league_id: int) -> Path:
+        return self._directory / f"{league_id}.json"
+
+    def _load(self, league_id: int) -> dict:
+        if league_id not in self._leagues:
+            league = {"seasons": [], "sessions": {}}
+            if self._directory is not None and self._filename(league_id).exists():
+                with open(self._filename(league_id), 'r', encoding="utf-8") as fp:
+                    league = json.load(fp)
+                # json keys are strings
+                league["sessions"] = {int(k): v for k, v in league["sessions"].items()}
+            self._leagues[league_id] = league
+        return self._leagues[league_id]
+
+    def _save(self, league_id: int):
+        if self._directory is None:
+            return
+        self._directory.mkdir(exist_ok=True, parents=True)
+        # Write to a temporary file first, so an interrupted run never leaves a partial league behind
+        tmp_filename = self._filename(league_id).with_suffix(".json.tmp")
+        with open(tmp_filename, 'w', encoding="utf-8") as fp:
+            json.dump(self._leagues[league_id], fp, ensure_ascii=False)
+        os.replace(tmp_filename, self._filename(league_id))
+
+    def refresh(self, idc, league_id: int) -> dict:
+        """
+        Bring a league up to date with iRacing
+        :return: the league, {"seasons": [ir season], "sessions": {season id: [ir session]}}
+        """
+        league = self._load(league_id)
+        was_active = {s["season_id"] for s in league["seasons"] if s.get("active", True)}
+        ir_seasons = idc.league_seasons(league_id, True)["seasons"]
+        sessions = dict()
+        num_pulled = 0
+        for ir_season in ir_seasons:
+            season_id = ir_season["season_id"]
+            changed = season_id not in league["sessions"] or season_id in was_active or ir_season.get("active", True)
+            instrumentation.cache("catalog.sessions", not changed)
+            if changed:
+                sessions[season_id] = idc.league_season_sessions(league_id, season_id, False)["sessions"]
+                num_pulled += 1
+            else:
+                sessions[season_id] = league["sessions"][season_id]
+        _logger.info(f"League {league_id} has {len(ir_seasons)} seasons, pulled sessions of {num_pulled}")
+        league["seasons"] = ir_seasons
+        league["sessions"] = sessions  # Seasons that are no longer listed are dropped
+        self._save(league_id)
+        return league
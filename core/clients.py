@@ -5,18 +5,21 @@ import base64
 import hashlib
 import json
 import logging
+import os
 import requests
 import urllib.parse
 
-from iracingdataapi.client import irDataClient
 from pathlib import Path
 
+from core import instrumentation
 from core.garage61 import Garage61Client
 from core.objects import Main
 from core.credentials import data_credentials, google_credentials
 
 
 _logger = logging.getLogger('log')
+# What we authenticate to a stand-in server (see --ir_base_url) with, instead of iRacing credentials
+_standin_access_token = "stand-in"
 
 
 def _request_password_limited_token(username: str, password: str, client_id: str, client_secret: str):
@@ -70,14 +73,118 @@ def _request_password_limited_token(username: str, password: str, client_id: str
         raise SystemError("Unsupported Content-Type")
 
 
+def data_client(access_token: str, base_url: str = None, record_dir: Path = None):
+    """
+    An iRacing Data API client
+    :param base_url: use this Data API base url instead of iRacing (ex. a core.standin server)
+    :param record_dir: record every response to this directory, for replay with core.standin
+    """
+    # iracingdataapi builds all its models on import, so wait until we need a client
+    from iracingdataapi.client import irDataClient
+    from core.standin import RecordingDataClient
+    if record_dir:
+        idc = RecordingDataClient(record_dir, access_token=access_token)
+    else:
+        idc = irDataClient(access_token=access_token)
+    if base_url:
+        idc.base_url = base_url.rstrip("/")
+    return idc
+
+
+class CachingDataClient:
+    """
+    An irDataClient that keeps the results, lap charts and members it pulls in memory
+    The results of a completed subsession do not change, so a long running process only pulls what is new,
+    everything else (league rosters, seasons and sessions) goes straight to the client
+    """
+    __slots__ = ["client", "_results", "_lap_charts", "_members"]
+
+    def __init__(self, client):
+        self.client = client
+        self._results = dict()  # (subsession id, licenses) -> result
+        self._lap_charts = dict()  # (subsession id, simsession number) -> laps
+        self._members = dict()  # (cust id, licenses) -> member
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    @staticmethod
+    def _cached(cache: dict, name: str, key, fetch):
+        hit = key in cache
+        instrumentation.cache(name, hit)
+        if not hit:
+            cache[key] = fetch()
+        return cache[key]
+
+    def result(self, subsession_id: int, include_licenses: bool = False):
+        return self._cached(self._results, "iracing.results", (subsession_id, include_licenses),
+                            lambda: self.client.result(subsession_id, include_licenses))
+
+    def result_lap_chart_data(self, subsession_id: int, simsession_number: int = 0):
+        return self._cached(self._lap_charts, "iracing.lap_charts", (subsession_id, simsession_number),
+                            lambda: self.client.result_lap_chart_data(subsession_id, simsession_number))
+
+    def member(self, cust_id: int, include_licenses: bool = False):
+        return self._cached(self._members, "iracing.members", (cust_id, include_licenses),
+                            lambda: self.client.member(cust_id, include_licenses))
+
+
+class CheckpointDataClient:
+    """
+    An irDataClient that writes the results and lap charts of each subsession to disk as they arrive
+    If a pull is interrupted (ex. an expired token or an iRacing error), the next one reads everything it already
+    pulled from these checkpoints and resumes from the first missing subsession
+    The results of a completed subsession do not change, so checkpoints are kept, and shared by every league
+    """
+    __slots__ = ["client", "_directory"]
+
+    def __init__(self, client, directory: Path = Path("./checkpoints")):
+        """
+        :param directory: checkpoints are written to directory/<subsession id>/
+        """
+        self.client = client
+        self._directory = directory
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _checkpointed(self, subsession_id: int, name: str, fetch):
+        filename = self._directory / str(subsession_id) / f"{name}.json"
+        hit = filename.exists()
+        instrumentation.cache("checkpoint.subsessions", hit)
+        if hit:
+            with open(filename, 'r', encoding="utf-8") as fp:
+                return json.load(fp)
+        data = fetch()
+        if data is None:
+            return data  # Nothing came back (ex. a subsession that is not ready yet), ask again next time
+        filename.parent.mkdir(exist_ok=True, parents=True)
+        # Write to a temporary file first, so an interrupted run never leaves a partial checkpoint behind
+        tmp_filename = filename.with_suffix(".json.tmp")
+        with open(tmp_filename, 'w', encoding="utf-8") as fp:
+            json.dump(data, fp, ensure_ascii=False)
+        os.replace(tmp_filename, filename)
+        return data
+
+    def result(self, subsession_id: int, include_licenses: bool = False):
+        return self._checkpointed(subsession_id, "result_licenses" if include_licenses else "result",
+                                  lambda: self.client.result(subsession_id, include_licenses))
+
+    def result_lap_chart_data(self, subsession_id: int, simsession_number: int = 0):
+        return self._checkpointed(subsession_id, f"lap_chart_{simsession_number}",
+                                  lambda: self.client.result_lap_chart_data(subsession_id, simsession_number))
+
+
 class ClientMain(Main):
-    __slots__ = ["_idc", "_g61", "_credentials", "_google_credentials"]
+    __slots__ = ["_idc", "_g61", "_credentials", "_google_credentials", "_ir_base_url", "_record_dir"]
 
     def __init__(self, log_filename: str):
         self._idc = None
         self._g61 = None
         self._credentials = None
         self._google_credentials = None
+        self._ir_base_url = None
+        self._record_dir = None
         super().__init__(log_filename)
 
     def add_args(self, parser):
@@ -94,15 +201,30 @@ class ClientMain(Main):
             type=Path,
             help="Credentials file for connecting to google sheets."
         )
+        parser.add_argument(
+            "-irurl", "--ir_base_url",
+            default=None,
+            type=str,
+            help="Use this iRacing Data API base url instead of iRacing (ex. a core.standin server)."
+        )
+        parser.add_argument(
+            "-rec", "--record_dir",
+            default=None,
+            type=Path,
+            help="Record iRacing Data API responses to this directory, for replay with core.standin."
+        )
 
     def process_args(self, args):
         super().process_args(args)
+        self._ir_base_url = args.ir_base_url
+        self._record_dir = args.record_dir
         if args.credentials.exists():
             with open(args.credentials, 'r') as file:
                 self._credentials = json.load(file)
         else:
             self._credentials = data_credentials()
-        if self._credentials is None or len(self._credentials) == 0:
+        # A stand-in server does not need credentials
+        if (self._credentials is None or len(self._credentials) == 0) and not self._ir_base_url:
             _logger.fatal("Could not find any data credentials")
             raise IOError(f"Unable to find data credentials")
 
@@ -117,13 +239,24 @@ class ClientMain(Main):
     @property
     def idc(self):
         if not self._idc:
-            access_token = _request_password_limited_token(username=self._credentials["username"],
-                                                           password=self._credentials["password"],
-                                                           client_id=self._credentials["client_id"],
-                                                           client_secret=self._credentials["client_secret"])
-            self._idc = irDataClient(access_token=access_token)
+            if self._ir_base_url:
+                # A stand-in server only checks we send it this token
+                access_token = _standin_access_token
+            else:
+                with instrumentation.span("auth.iracing"):
+                    access_token = _request_password_limited_token(username=self._credentials["username"],
+                                                                   password=self._credentials["password"],
+                                                                   client_id=self._credentials["client_id"],
+                                                                   client_secret=self._credentials["client_secret"])
+            self._idc = data_client(access_token, self._ir_base_url, self._record_dir)
+            instrumentation.instrument_session(self._idc.session, "iracing")
         return self._idc
 
+    def authenticate(self):
+        """ Drop our iRacing client (ex. when its access token expires), the next idc is a new, authenticated, one """
+        self._idc = None
+        return self.idc
+
     @property
     def g61(self):
         if not self._g61:
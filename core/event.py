@@ -1,20 +1,25 @@
 # Distributed under the Apache License, Version 2.0.
 # See accompanying NOTICE file for details.
 
-import dataframe_image as dfi
+from __future__ import annotations
+
 import json
 import logging
-import pandas as pd
+import os
 import pickle
 import sys
 import time
 
+from collections import OrderedDict
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-from iracingdataapi.client import irDataClient
-
+from core import instrumentation
 from core.markdown import *
-from core.objects import Event, EventTeam
+from core.objects import Event, EventResult, EventTeam
+
+if TYPE_CHECKING:
+    from iracingdataapi.client import irDataClient
 
 _logger = logging.getLogger('log')
 
@@ -30,126 +35,219 @@ def list_events(idc: irDataClient, year: int):
                 print(f"\t{season['season_name']}")
 
 
-def pull_event(idc: irDataClient, series_name: str, year: int, detailed_team: bool = False, log: bool = False) -> Event:
-
+def _write_json(data, filename: Path):
+    # Write to a temporary file first, so an interrupted pull never leaves a partial record behind
+    tmp_filename = filename.with_name(filename.name + ".tmp")
+    with open(tmp_filename, 'w') as fp:
+        json.dump(data, fp)
+    os.replace(tmp_filename, filename)
+
+
+class _SplitResults(OrderedDict):
+    """
+    The results of an event's splits, each built from its record the first time it is asked for
+    """
+    __slots__ = ["_build"]
+
+    def __init__(self, splits: list, build):
+        """
+        :param splits: split numbers, in order
+        :param build: called with a split number, to build its EventResult
+        """
+        super().__init__((split, None) for split in splits)
+        self._build = build
+
+    def __getitem__(self, split: int):
+        result = super().__getitem__(split)
+        if result is None:
+            result = self._build(split)
+            super().__setitem__(split, result)
+        return result
+
+    def get(self, split: int, default=None):
+        return self[split] if split in self else default
+
+    def values(self):
+        return [self[split] for split in self]
+
+    def items(self):
+        return [(split, self[split]) for split in self]
+
+
+def _pull_team(idc: irDataClient, ir_team_result: dict, teams_directory: Path) -> dict:
+    """
+    If they crash and quit before all scheduled drivers drove a lap, they will not be in the driver list
+    So we also pull the official team member list, which can be very long...
+    So we cache team members to a separate file, so we don't have to pull as much
+    """
+    team_filename = teams_directory / f"{ir_team_result['team_id']}.json"
+    instrumentation.cache("event.teams", team_filename.exists())
+    if team_filename.exists():
+        with open(team_filename) as fp:
+            return json.load(fp)
+    time.sleep(0.01)  # So many calls makes iracing mad...
+    _logger.info(f"Pulling team members for {ir_team_result['display_name']}")
+    ir_team = idc.team(ir_team_result["team_id"])
+    ir_team = {k: ir_team[k] for k in ["owner_id", "roster"] if k in ir_team}
+    ir_team["display_name"] = ir_team_result['display_name']
+    for ir_member in ir_team.get("roster", []):
+        ir_member.pop("helmet", None)
+    _write_json(ir_team, team_filename)
+    return ir_team
+
+
+def pull_event_splits(idc: irDataClient, series_name: str, year: int, detailed_team: bool = False) -> dict | None:
+    """
+    Pull every split of an event, writing each to its own record as soon as it is pulled
+    Splits (and teams) that already have a record are not pulled again, so an interrupted pull picks up where it stopped
+    A split without a race has an empty record (<subsession id>.no_race.json), so it is not pulled again either
+    :return: {"season": the event's season, "splits": [(sof, subsession_id)] of splits with a race, by sof},
+             None if the event could not be found
+    """
     event_ir_directory = Path(f"./events/{year}_{series_name}_iR")
+    splits_directory = event_ir_directory / "splits"
     teams_directory = event_ir_directory / "teams"
+    splits_directory.mkdir(exist_ok=True, parents=True)
     teams_directory.mkdir(exist_ok=True, parents=True)
 
     # Find the event
-    ir_series_stats = idc.series_stats()
-    event_season = None
-    for ir_series in ir_series_stats:
-        if ir_series["series_name"] == series_name:
-            for season in ir_series["seasons"]:
-                if season["season_year"] == year:
-                    event_season = season
-                    break
-    if event_season is None:
-        _logger.error(f"Unable to find series: {series_name} in year {year}")
-        return None
-
-    # Grab all the event data we need from iracing, cache for quicker rerunning
-    ir_races = idc.result_season_results(event_season["season_id"], 5)
-    event_splits_filename = event_ir_directory / "splits.json"
-    if not event_splits_filename.exists():
-        _logger.info(f"Pulling {series_name} data from iracing...")
-        splits = []
-        for ir_result in ir_races["results_list"]:
+    season_filename = event_ir_directory / "season.json"
+    instrumentation.cache("event.season", season_filename.exists())
+    if season_filename.exists():
+        with open(season_filename) as fp:
+            season = json.load(fp)
+    else:
+        event_season = None
+        for ir_series in idc.series_stats():
+            if ir_series["series_name"] == series_name:
+                for ir_season in ir_series["seasons"]:
+                    if ir_season["season_year"] == year:
+                        event_season = ir_season
+                        break
+        if event_season is None:
+            _logger.error(f"Unable to find series: {series_name} in year {year}")
+            return None
+        ir_races = idc.result_season_results(event_season["season_id"], 5)
+        season = {"season": event_season, "results_list": ir_races["results_list"]}
+        _write_json(season, season_filename)
+
+    # Splits pulled into one splits.json, before splits had their own records
+    legacy_splits_filename = event_ir_directory / "splits.json"
+    if legacy_splits_filename.exists():
+        with open(legacy_splits_filename) as fp:
+            for sof, ir_result, ir_race_results in json.load(fp):
+                split_filename = splits_directory / f"{ir_result['subsession_id']}.json"
+                if not split_filename.exists():
+                    _write_json({"result": ir_result, "race": ir_race_results}, split_filename)
+
+    # Pull each split, strongest first
+    splits = []
+    ir_results = sorted(season["results_list"], key=lambda r: r["event_strength_of_field"], reverse=True)
+    for ir_result in ir_results:
+        subsession_id = ir_result["subsession_id"]
+        split_filename = splits_directory / f"{subsession_id}.json"
+        no_race_filename = splits_directory / f"{subsession_id}.no_race.json"
+        instrumentation.cache("event.splits", split_filename.exists() or no_race_filename.exists())
+        if no_race_filename.exists():
+            continue
+        if not split_filename.exists():
+            _logger.info(f"Pulling {series_name} split {len(splits) + 1} from iracing...")
             # Get the event race result
-            ir_subsession = idc.result(subsession_id=ir_result["subsession_id"])["session_results"]
+            ir_subsession = idc.result(subsession_id=subsession_id)["session_results"]
             ir_race_results = None
             for ir_event in ir_subsession:
                 if ir_event["simsession_type"] == 6:
                     ir_race_results = ir_event
             if ir_race_results is None:
-                _logger.error("Session " + ir_result["subsession_id"] + " did not have a race.")
+                _logger.error(f"Session {subsession_id} did not have a race.")
+                # Recorded, so it is not pulled again
+                _write_json({"result": ir_result, "race": None}, no_race_filename)
                 continue
-            splits.append((ir_result["event_strength_of_field"], ir_result, ir_race_results))
-        # Sort splits by sof
-        splits.sort(key=lambda tup: tup[0], reverse=True)
-        with open(event_splits_filename, 'w') as fp:
-            json.dump(splits, fp, indent=2)
-    else:
-        with open(event_splits_filename) as fp:
-            splits = json.load(fp)
+            if detailed_team:
+                for ir_team_result in ir_race_results["results"]:
+                    if "driver_results" in ir_team_result:
+                        _pull_team(idc, ir_team_result, teams_directory)
+            _write_json({"result": ir_result, "race": ir_race_results}, split_filename)
+        splits.append((ir_result["event_strength_of_field"], subsession_id))
+    return {"season": season["season"], "splits": splits}
+
+
+def _build_split_result(split: int, subsession_id: int, event_ir_directory: Path,
+                        idc: irDataClient, detailed_team: bool, log: bool) -> EventResult:
+    with open(event_ir_directory / "splits" / f"{subsession_id}.json") as fp:
+        record = json.load(fp)
+    ir_result = record["result"]
+    ir_race_results = record["race"]
+
+    num_teams = len(ir_race_results["results"])
+    _logger.info(f"Reading results for split {split} that had {num_teams} teams")
+    result = EventResult(ir_result["event_strength_of_field"], ir_result["subsession_id"])
+
+    for car_class in ir_result["car_classes"]:
+        result.add_category(car_class["short_name"], car_class["strength_of_field"])
+    if log:
+        _logger.info(f"SOF: {result.sof}")
+    for ir_team_result in ir_race_results["results"]:
+        result.count_cars_and_laps(ir_team_result["car_class_short_name"], ir_team_result["laps_complete"])
+        team = result.add_team(ir_team_result["team_id"] if "team_id" in ir_team_result else ir_team_result["cust_id"],
+                               ir_team_result["car_class_short_name"],
+                               ir_team_result["display_name"],
+                               ir_team_result["car_name"],
+                               int(ir_team_result["livery"]["car_number"]))
+        team._reason_out = ir_team_result["reason_out"]
+        team._finish_position = ir_team_result["finish_position"]+1
+        team._finish_position_in_class = ir_team_result["finish_position_in_class"]+1
+        team._total_laps_complete = ir_team_result["laps_complete"]
+        team._total_incidents = ir_team_result["incidents"]
 
-    event = Event(series_name, year)
-    event._is_multiclass = len(event_season["car_classes"]) > 1
-    event._num_splits = len(splits)
-    _logger.info(f"There were {len(splits)} splits.")
-
-    split = 0
-    for sof, ir_result, ir_race_results in splits:
-        split += 1
-        num_teams = len(ir_race_results["results"])
-        _logger.info(f"Pulling results for split {split} that had {num_teams} teams")
-        result = event.add_result(split, ir_result["event_strength_of_field"], ir_result["subsession_id"])
-
-        for car_class in ir_result["car_classes"]:
-            result.add_category(car_class["short_name"], car_class["strength_of_field"])
         if log:
-            _logger.info(f"SOF: {result.sof}")
-        for ir_team_result in ir_race_results["results"]:
-            result.count_cars_and_laps(ir_team_result["car_class_short_name"], ir_team_result["laps_complete"])
-            team = result.add_team(ir_team_result["team_id"] if "team_id" in ir_team_result else ir_team_result["cust_id"],
-                                   ir_team_result["car_class_short_name"],
-                                   ir_team_result["display_name"],
-                                   ir_team_result["car_name"],
-                                   int(ir_team_result["livery"]["car_number"]))
-            team._reason_out = ir_team_result["reason_out"]
-            team._finish_position = ir_team_result["finish_position"]+1
-            team._finish_position_in_class = ir_team_result["finish_position_in_class"]+1
-            team._total_laps_complete = ir_team_result["laps_complete"]
-            team._total_incidents = ir_team_result["incidents"]
-
+            _logger.info(f"\tTeam: {team.name}, Class: {team.category}, Car: {team.car}")
+        # Add team members
+        ir_team_members = ir_team_result["driver_results"] if "driver_results" in ir_team_result \
+            else [ir_team_result]
+        # Only drivers that have driven laps are listed here,
+        for ir_team_member in ir_team_members:
+            driver = team.add_driver(ir_team_member["cust_id"], ir_team_member["display_name"])
+            driver._old_irating = ir_team_member["oldi_rating"]
+            driver._new_irating = ir_team_member["newi_rating"]
+            # if irating is < 0, pretty sure that means that car Did Not Start
+            driver._total_laps_complete = ir_team_member["laps_complete"]
+            driver._total_lead_a_lap = ir_team_member["laps_lead"]
+            driver._total_incidents = ir_team_member["incidents"]
             if log:
-                _logger.info(f"\tTeam: {team.name}, Class: {team.category}, Car: {team.car}")
-            # Add team members
-            ir_team_members = ir_team_result["driver_results"] if "driver_results" in ir_team_result \
-                else [ir_team_result]
-            # Only drivers that have driven laps are listed here,
-            for ir_team_member in ir_team_members:
-                driver = team.add_driver(ir_team_member["cust_id"], ir_team_member["display_name"])
-                driver._old_irating = ir_team_member["oldi_rating"]
-                driver._new_irating = ir_team_member["newi_rating"]
-                # if irating is < 0, pretty sure that means that car Did Not Start
-                driver._total_laps_complete = ir_team_member["laps_complete"]
-                driver._total_lead_a_lap = ir_team_member["laps_lead"]
-                driver._total_incidents = ir_team_member["incidents"]
-                if log:
-                    team.get_driver()
-                    _logger.info(f"\t\t{driver.name} : {driver.cust_id}")
-
-            if detailed_team and "driver_results" in ir_team_result:
-                # If they crash and quit before all scheduled drivers drove a lap,
-                # They will not be in the driver list
-                # So we also pull the official team member list, which can be very long...
-                # So we cache team members to a separate file, so we don't have to pull as much
-                save_json = False
-                team_filename = teams_directory / f"{ir_team_result['team_id']}.json"
-                if team_filename.exists():
-                    with open(team_filename) as fp:
-                        ir_team = json.load(fp)
-                else:
-                    save_json = True
-                    time.sleep(0.01)  # So many calls makes iracing mad...
-                    _logger.info(f"Pulling team members for {ir_team_result['display_name']}")
-                    ir_team = idc.team(ir_team_result["team_id"])
-                    ir_team = {k: ir_team[k] for k in ["owner_id", "roster"] if k in ir_team}
-                    ir_team["display_name"] = ir_team_result['display_name']
-
-                team._owner = ir_team["owner_id"]
-                if not team._owner:
-                    _logger.error(f"Team {ir_team_result['display_name']} has no owner?")
-                for ir_member in ir_team["roster"]:
-                    if save_json:
-                        del ir_member["helmet"]
-                    team.add_member(ir_member["cust_id"], ir_member["display_name"])
-
-                if save_json:
-                    with open(team_filename, 'w') as fp:
-                        json.dump(ir_team, fp, indent=2)
+                _logger.info(f"\t\t{driver.name} : {driver.cust_id}")
+
+        if detailed_team and "driver_results" in ir_team_result:
+            ir_team = _pull_team(idc, ir_team_result, event_ir_directory / "teams")
+            team._owner = ir_team["owner_id"]
+            if not team._owner:
+                _logger.error(f"Team {ir_team_result['display_name']} has no owner?")
+            for ir_member in ir_team["roster"]:
+                team.add_member(ir_member["cust_id"], ir_member["display_name"])
+    return result
+
+
+def pull_event(idc: irDataClient, series_name: str, year: int, detailed_team: bool = False, log: bool = False) -> Event:
+    """
+    Pull an event (see pull_event_splits), the results of each split are only read from its record when first used
+    The event keeps idc to read splits with, so with detailed_team, reading a split may pull its team rosters from
+    iRacing (rosters already pulled are read from the event's records)
+    """
+    pulled = pull_event_splits(idc, series_name, year, detailed_team)
+    if pulled is None:
+        return None
+
+    event = Event(series_name, year)
+    event._is_multiclass = len(pulled["season"]["car_classes"]) > 1
+    event._num_splits = len(pulled["splits"])
+    _logger.info(f"There were {event.num_splits} splits.")
+
+    # Splits are read later, maybe after the working directory changed
+    event_ir_directory = Path(f"./events/{year}_{series_name}_iR").resolve()
+    subsession_ids = {split: subsession_id for split, (sof, subsession_id) in enumerate(pulled["splits"], 1)}
+    event._results = _SplitResults(list(subsession_ids.keys()),
+                                   lambda split: _build_split_result(split, subsession_ids[split], event_ir_directory,
+                                                                     idc, detailed_team, log))
     return event
 
 
@@ -163,6 +261,7 @@ def add_lap_data(idc: irDataClient, event: Event, splits: list):
         result = event.get_result(split)
 
         ir_laps_filename = laps_directory / f"{result.subsession_id}.pkl"
+        instrumentation.cache("event.laps", ir_laps_filename.exists())
         if not ir_laps_filename.exists():
             ir_lap_chart = idc.result_lap_chart_data(subsession_id=result.subsession_id)
             with open(ir_laps_filename, 'wb') as fp:
@@ -181,6 +280,10 @@ def add_lap_data(idc: irDataClient, event: Event, splits: list):
 
 
 def _create_report(basename: Path, data, fields, headings, widths=None):
+    # pandas and dataframe_image take a good while to import, and only reports need them
+    import dataframe_image as dfi
+    import pandas as pd
+
     if widths is None:
         widths = []
     align = []
@@ -1,15 +1,77 @@
 # Started from https://github.com/KuzmaLesnoy/garage61api
 
 import json
+import logging
+import os
 import requests
-from typing import Literal, List
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Literal, List
 from datetime import datetime, timezone
 from pathlib import Path
 
+from core import instrumentation
+
+_logger = logging.getLogger('log')
+
+# Garage61 returns no more than this many laps per request
+_max_laps_per_page = 1000
+
+
+def is_clean_lap(g61_lap: dict) -> bool:
+    """
+    Whether a lap counts as clean: Garage61 says it is, and it was a complete lap on track, not a joker or in the pits.
+
+    :param g61_lap: lap as returned by Garage61Client.laps or Garage61LapStore.laps.
+    """
+    return g61_lap["clean"] and not (g61_lap["offtrack"] or g61_lap["discontinuity"] or g61_lap["joker"] or
+                                     g61_lap["incomplete"] or g61_lap["pitlane"] or g61_lap["pitIn"] or
+                                     g61_lap["pitOut"])
+
+
+class TokenBucket:
+    def __init__(self,
+                 rate: float,
+                 capacity: int
+                 ):
+        """
+        Thread safe token bucket rate limiter.
+
+        :param rate: tokens added per second.
+        :param capacity: maximum number of tokens that can build up (i.e. the allowed burst).
+        """
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        Block until a token is available, and take it.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_s = (1 - self._tokens) / self._rate
+            time.sleep(wait_s)
+
 
 class Garage61Client:
     def __init__(self,
-                 token: str
+                 token: str,
+                 max_concurrency: int = 4,
+                 requests_per_second: float = 2.0,
+                 burst: int = 4,
+                 timeout_s: float = 30.0,
+                 max_retries: int = 5,
+                 backoff_s: float = 1.0
                  ):
         """
         Garage61Client is a simple Python wrapper around the Garage61 API with synchronous functions.
@@ -22,11 +84,33 @@ class Garage61Client:
         - set_token: set new access token.
         - use_garage61_ids: False by default. True if you provide Garage61 car and track IDs instead of iRacing ones.
         - ids: dict of track and cars IDs.
+
+        All GET requests go through a request executor that limits how many requests are in flight,
+        rate limits them with a token bucket, uses per request timeouts,
+        and retries with exponential backoff when Garage61 responds with a 429 or 5xx.
+        Any other error response (ex. a 401 or 404) raises a requests.HTTPError right away,
+        rather than being returned as if it were the requested resource.
+
+        :param token: Garage61 access token.
+        :param max_concurrency: maximum number of requests in flight at once.
+        :param requests_per_second: sustained request rate allowed.
+        :param burst: number of requests allowed back to back before rate limiting kicks in.
+        :param timeout_s: timeout of each request.
+        :param max_retries: number of times to retry a request that was throttled or failed on the server.
+        :param backoff_s: initial backoff between retries, doubled on each retry.
         """
-        self._session = requests.Session()
+        if max_retries < 0:
+            raise ValueError(f"max_retries must be 0 or more, not {max_retries}")
+        self._session = instrumentation.instrument_session(requests.Session(), "garage61")
         self._base_url = "https://garage61.net/api/v1/"
         self._token = token
         self._use_garage61_ids = False
+        self._max_concurrency = max_concurrency
+        self._in_flight = threading.BoundedSemaphore(max_concurrency)
+        self._rate_limiter = TokenBucket(requests_per_second, burst)
+        self._timeout_s = timeout_s
+        self._max_retries = max_retries
+        self._backoff_s = backoff_s
 
         ids_file = Path("./g61.json")
         if ids_file.exists():
@@ -140,9 +224,57 @@ class Garage61Client:
         request_url = self._build_url(endpoint)
         if payload:
             request_url += self._add_payload(payload)
+        return self._request(request_url).json()
+
+    def _request(self,
+                 request_url: str,
+                 stream: bool = False
+                 ) -> requests.Response:
         header = {'Authorization': f"Bearer {self._token}"}
-        r = self._session.get(request_url, headers=header)
-        return r.json()
+        backoff_s = self._backoff_s
+        for attempt in range(self._max_retries + 1):
+            self._rate_limiter.acquire()
+            wait_s = backoff_s
+            try:
+                with self._in_flight:
+                    r = self._session.get(request_url, headers=header, timeout=self._timeout_s, stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self._max_retries:
+                    raise
+                _logger.warning(f"Garage61 request failed ({e}), retrying in {wait_s}s")
+            else:
+                if r.status_code != 429 and r.status_code < 500:
+                    r.raise_for_status()
+                    return r
+                if attempt == self._max_retries:
+                    r.raise_for_status()
+                # Garage61 may tell us how long to wait
+                retry_after = r.headers.get("Retry-After")
+                if retry_after and retry_after.isdigit():
+                    wait_s = max(wait_s, float(retry_after))
+                _logger.warning(f"Garage61 responded with {r.status_code}, retrying in {wait_s}s")
+                r.close()
+            time.sleep(wait_s)
+            backoff_s *= 2
+
+    def run_concurrently(self,
+                         fn: Callable,
+                         calls: list[dict]
+                         ) -> list:
+        """
+        Run fn for each set of keyword arguments in calls, up to max_concurrency at a time.
+        Requests made by fn still go through the rate limiter.
+
+        :param fn: function to call, usually a method of this client (ex. self.laps).
+        :param calls: list of keyword argument dicts, one per call.
+
+        :return: A list of fn results, in the same order as calls.
+        """
+        if len(calls) <= 1:
+            return [fn(**kwargs) for kwargs in calls]
+        with ThreadPoolExecutor(max_workers=self._max_concurrency) as executor:
+            futures = [executor.submit(fn, **kwargs) for kwargs in calls]
+            return [future.result() for future in futures]
 
     ####################################
     #   Functions available to user
@@ -581,6 +713,224 @@ class Garage61Client:
         :return: A str representing 'text/csv'.
         """
         request_url = self._build_url(f"laps/{lap_id}/csv")
-        header = {'Authorization': f"Bearer {self._token}"}
-        r = self._session.get(request_url, headers=header)
+        r = self._request(request_url)
         return r.content.decode("utf-8")
+
+    def lap_csv_lines(self,
+                      lap_id: str,
+                      chunk_size: int = 64 * 1024
+                      ):
+        """
+        Stream the telemetry CSV for a lap, without holding the whole file in memory.
+
+        Same endpoint as lap_csv: https://garage61.net/developer/endpoints/v1/getLapCSV
+
+        :param lap_id: lap ID (required).
+        :param chunk_size: number of bytes read from the response at a time.
+
+        :return: A generator of decoded CSV lines.
+        """
+        request_url = self._build_url(f"laps/{lap_id}/csv")
+        with self._request(request_url, stream=True) as r:
+            for line in r.iter_lines(chunk_size=chunk_size, decode_unicode=False):
+                yield line.decode("utf-8")
+
+
+class Garage61LapStore:
+    __slots__ = ["_g61", "_filename", "_laps", "_queries", "_frozen"]
+
+    def __init__(self,
+                 g61: Garage61Client | None,
+                 filename: Path
+                 ):
+        """
+        A local store of Garage61 laps, keyed by the Garage61 lap id.
+
+        Laps are synced per (team, track, cars) query, only asking Garage61 for laps driven after
+        the newest startTime we have already seen for that query.
+        Once a session window has closed, the laps for that window are frozen
+        and will be served from the store without calling Garage61 again.
+
+        :param g61: client used to sync new laps (can be None if everything asked for is frozen).
+        :param filename: json file the store is persisted to.
+        """
+        self._g61 = g61
+        self._filename = filename
+        self._laps = {}  # lap id -> lap
+        self._queries = {}  # query key -> {"synced_from", "watermark", "laps"}
+        self._frozen = {}  # window key -> [lap ids]
+
+        if self._filename.exists():
+            with self._filename.open('rt') as f:
+                d = json.load(f)
+            self._laps = d["laps"]
+            self._queries = d["queries"]
+            self._frozen = d["frozen"]
+
+    @staticmethod
+    def _time(time_str: str) -> datetime:
+        return datetime.strptime(time_str, '%Y-%m-%dT%H:%M:%SZ')
+
+    @staticmethod
+    def _query_key(team: str, track: int, cars: list[int]) -> str:
+        return f"{team}|{track}|{','.join(map(str, sorted(cars)))}"
+
+    def save(self) -> None:
+        self._filename.parent.mkdir(exist_ok=True, parents=True)
+        # Write to a temporary file first, so an interrupted save never leaves a partial store behind
+        tmp_filename = self._filename.with_name(self._filename.name + ".tmp")
+        with tmp_filename.open('wt') as f:
+            json.dump({"laps": self._laps, "queries": self._queries, "frozen": self._frozen}, f)
+        os.replace(tmp_filename, self._filename)
+
+    def _plan_sync(self,
+                   team: str,
+                   track: int,
+                   cars: list[int],
+                   date_after: datetime
+                   ) -> dict:
+        # Naive times are UTC (ex. from session_window), the client would take them as local time
+        if date_after.tzinfo is None:
+            date_after = date_after.replace(tzinfo=timezone.utc)
+        else:
+            date_after = date_after.astimezone(timezone.utc)
+        key = self._query_key(team, track, cars)
+        query = self._queries.get(key)
+        if query is None or date_after < self._time(query["synced_from"]).replace(tzinfo=timezone.utc):
+            # We have never asked for laps this far back
+            query = {"synced_from": date_after.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                     "watermark": None,
+                     "laps": [] if query is None else query["laps"]}
+            self._queries[key] = query
+            after = date_after
+        else:
+            after = self._time(query["watermark"] or query["synced_from"]).replace(tzinfo=timezone.utc)
+        return {"teams": team,
+                "cars": list(cars),  # The client converts ids in place
+                "tracks": track,
+                "group": "none",
+                "include_unclean": True,
+                "date_after": after}
+
+    def _pull(self,
+              **kwargs
+              ) -> list[dict]:
+        """
+        Every lap of a planned sync, a page at a time, so a full page never leaves laps behind the watermark.
+
+        :param kwargs: laps keyword arguments, from _plan_sync.
+
+        :return: A list of dicts representing laps.
+        """
+        g61_laps = []
+        while True:
+            # The client converts car ids in place, so every page gets its own list
+            page = self._g61.laps(**{**kwargs, "cars": list(kwargs["cars"])},
+                                  limit=_max_laps_per_page, offset=len(g61_laps))
+            g61_laps.extend(page)
+            if len(page) < _max_laps_per_page:
+                return g61_laps
+
+    def _merge(self,
+               team: str,
+               track: int,
+               cars: list[int],
+               g61_laps: list[dict]
+               ) -> int:
+        query = self._queries[self._query_key(team, track, cars)]
+        known = set(query["laps"])
+        num_new = 0
+        for g61_lap in g61_laps:
+            if g61_lap["id"] not in known:
+                num_new += 1
+                known.add(g61_lap["id"])
+                query["laps"].append(g61_lap["id"])
+            self._laps[g61_lap["id"]] = g61_lap
+            if query["watermark"] is None or self._time(g61_lap["startTime"]) > self._time(query["watermark"]):
+                query["watermark"] = g61_lap["startTime"]
+        return num_new
+
+    def sync(self,
+             team: str,
+             track: int,
+             cars: list[int],
+             date_after: datetime
+             ) -> int:
+        """
+        Pull any laps for this query that we do not already have.
+
+        :param team: Garage61 team slug.
+        :param track: iRacing track id.
+        :param cars: iRacing car ids.
+        :param date_after: earliest lap start time we need.
+
+        :return: The number of new laps added to the store.
+        """
+        g61_laps = self._pull(**self._plan_sync(team, track, cars, date_after))
+        return self._merge(team, track, cars, g61_laps)
+
+    def laps(self,
+             team: str,
+             track: int,
+             cars: list[int],
+             window_start: datetime,
+             window_end: datetime
+             ) -> list[dict]:
+        """
+        All the laps for this query driven after window_start, sorted by start time.
+
+        If window_end is in the past, the result is frozen and any later call for the same window
+        is answered from the store alone.
+
+        :param team: Garage61 team slug.
+        :param track: iRacing track id.
+        :param cars: iRacing car ids.
+        :param window_start: laps driven after this (naive UTC) time.
+        :param window_end: when this (naive UTC) time has passed, the window is closed.
+
+        :return: A list of dicts representing laps.
+        """
+        return self.laps_many(team, [(track, cars, window_start, window_end)])[0]
+
+    def laps_many(self,
+                  team: str,
+                  queries: list[tuple]
+                  ) -> list[list[dict]]:
+        """
+        Same as laps, for a list of (track, cars, window_start, window_end) queries.
+        Any queries that need to be synced are sent to Garage61 concurrently.
+
+        :param team: Garage61 team slug.
+        :param queries: list of (track, cars, window_start, window_end) tuples.
+
+        :return: A list of lap lists, in the same order as queries.
+        """
+        def window_key(_track, _cars, _window_start, _window_end):
+            return f"{self._query_key(team, _track, _cars)}|{_window_start.isoformat()}|{_window_end.isoformat()}"
+
+        to_sync = [q for q in queries if window_key(*q) not in self._frozen]
+        instrumentation.cache("garage61.lap_windows", True, len(queries) - len(to_sync))
+        instrumentation.cache("garage61.lap_windows", False, len(to_sync))
+        if len(to_sync) > 0:
+            calls = [self._plan_sync(team, track, cars, window_start)
+                     for track, cars, window_start, window_end in to_sync]
+            results = self._g61.run_concurrently(self._pull, calls)
+            for (track, cars, window_start, window_end), g61_laps in zip(to_sync, results):
+                self._merge(team, track, cars, g61_laps)
+
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        all_laps = []
+        for track, cars, window_start, window_end in queries:
+            key = window_key(track, cars, window_start, window_end)
+            if key in self._frozen:
+                all_laps.append([self._laps[lap_id] for lap_id in self._frozen[key]])
+                continue
+            laps = [self._laps[lap_id] for lap_id in self._queries[self._query_key(team, track, cars)]["laps"]
+                    if self._time(self._laps[lap_id]["startTime"]) >= window_start]
+            laps.sort(key=lambda lap: lap["startTime"])
+            if window_end < now:
+                self._frozen[key] = [lap["id"] for lap in laps]
+            all_laps.append(laps)
+        if len(to_sync) > 0:
+            self.save()
+        return all_laps
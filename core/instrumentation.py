@@ -0,0 +1,292 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+import json
+import logging
+import re
+import threading
+import time
+
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+from urllib.parse import urlparse
+
+_logger = logging.getLogger('log')
+
+# Path segments that identify a resource (ids, hashes, tokens) are grouped together as one endpoint
+_id_segment = re.compile(r"^(?=.*\d)[\w\-.]+$|^[\w\-]{24,}$")
+
+
+def _percentile(values: list, p: float) -> float:
+    """ Nearest rank percentile of sorted values """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+
+def endpoint_name(url: str) -> str:
+    """
+    The endpoint a url calls, with any ids in its path replaced
+    ex. https://garage61.net/api/v1/laps/abc123/csv -> garage61.net/api/v1/laps/:id/csv
+    """
+    parsed = urlparse(url)
+    segments = [":id" if _id_segment.match(s) else s for s in parsed.path.split("/")]
+    return parsed.netloc + "/".join(segments)
+
+
+class _Recorder:
+    __slots__ = ["_lock", "_stacks", "_start", "_started", "listeners", "spans", "calls", "counters", "caches",
+                 "trace_filename", "name"]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stacks = dict()  # thread id -> open spans
+        self.listeners = list()
+        self.trace_filename = None  # Where finish writes the trace, see start
+        self.name = None
+        self.reset()
+
+    def reset(self):
+        self._start = time.perf_counter()
+        self._started = datetime.now().isoformat(timespec="seconds")
+        self.spans = list()
+        self.calls = list()
+        self.counters = dict()
+        self.caches = dict()
+
+    def stack(self, thread_id: int = None) -> list:
+        thread_id = threading.get_ident() if thread_id is None else thread_id
+        stack = self._stacks.get(thread_id)
+        if stack is None:
+            stack = self._stacks.setdefault(thread_id, list())
+        return stack
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._start
+
+
+_recorder = _Recorder()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Time a block of code, spans opened within it (on the same thread) are its children
+    :param name: what is being timed, ex. score.trueskill
+    :param attrs: anything worth keeping with the span in the trace, ex. race=3
+    """
+    stack = _recorder.stack()
+    record = {"name": name,
+              "parent": stack[-1]["name"] if stack else None,
+              "thread": threading.current_thread().name,
+              "start_s": _recorder.elapsed()}
+    if attrs:
+        record["attrs"] = attrs
+    stack.append(record)
+    for listener in _recorder.listeners:
+        listener(stack)
+    try:
+        yield record
+    finally:
+        stack.pop()
+        record["duration_s"] = _recorder.elapsed() - record["start_s"]
+        for listener in _recorder.listeners:
+            listener(stack)
+        with _recorder._lock:
+            _recorder.spans.append(record)
+
+
+def timed(name: str):
+    """ Decorator version of span """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def open_spans(thread_id: int = None) -> list[str]:
+    """ Names of the spans a thread (default this thread) is in, outermost first """
+    thread_id = threading.get_ident() if thread_id is None else thread_id
+    return [s["name"] for s in list(_recorder._stacks.get(thread_id, []))]
+
+
+def add_listener(listener):
+    """
+    Call listener(open spans) on a thread every time that thread enters or leaves a span
+    (ex. to only profile some spans)
+    """
+    _recorder.listeners.append(listener)
+
+
+def remove_listener(listener):
+    _recorder.listeners.remove(listener)
+
+
+def count(name: str, n: int = 1):
+    with _recorder._lock:
+        _recorder.counters[name] = _recorder.counters.get(name, 0) + n
+
+
+def cache(name: str, hit: bool, n: int = 1):
+    """ Record whether n lookups in a named cache (ex. a file cache of API responses) were hits """
+    with _recorder._lock:
+        stats = _recorder.caches.setdefault(name, {"hits": 0, "misses": 0})
+        stats["hits" if hit else "misses"] += n
+
+
+def record_call(service: str, endpoint: str, latency_s: float, status: int, num_bytes: int = None):
+    # The span the call was made from, not the fetch span around the request itself
+    spans = [s for s in open_spans() if not s.startswith("fetch.")]
+    call = {"service": service,
+            "endpoint": endpoint,
+            "span": spans[-1] if spans else None,
+            "start_s": _recorder.elapsed() - latency_s,
+            "latency_s": latency_s,
+            "status": status,
+            "bytes": num_bytes}
+    with _recorder._lock:
+        _recorder.calls.append(call)
+
+
+def instrument_session(session, service: str):
+    """
+    Record every response a requests.Session receives as a call to service,
+    each request is made in a fetch.<service> span
+    The iRacing, Garage61 and gspread clients all make their requests through a requests.Session
+    """
+    request = session.request
+
+    @wraps(request)
+    def fetch(*args, **kwargs):
+        with span(f"fetch.{service}"):
+            return request(*args, **kwargs)
+    session.request = fetch
+
+    def on_response(response, *args, **kwargs):
+        num_bytes = response.headers.get("Content-Length")
+        if num_bytes is not None:
+            num_bytes = int(num_bytes)
+        elif not kwargs.get("stream", False):
+            num_bytes = len(response.content)  # requests reads it right after the hooks anyway
+        record_call(service, endpoint_name(response.url), response.elapsed.total_seconds(),
+                    response.status_code, num_bytes)
+        return response
+    session.hooks.setdefault("response", []).append(on_response)
+    return session
+
+
+def reset():
+    _recorder.reset()
+
+
+def start(trace_filename: Path, name: str = None):
+    """ Write the trace of this run to trace_filename when it finishes (or is flushed) """
+    _recorder.trace_filename = trace_filename
+    _recorder.name = name
+
+
+def flush():
+    """
+    Finish what has been recorded so far, then start recording anew
+    A long running process (ex. a daemon) flushes after every poll, so the log has a summary of each poll,
+    the trace is of the last poll, and what is recorded does not grow for as long as the process runs
+    """
+    if _recorder.trace_filename is not None:
+        finish()
+    reset()
+
+
+def summarize() -> dict:
+    """ Aggregate what has been recorded into per span, per endpoint, counter and cache statistics """
+    with _recorder._lock:
+        spans = list(_recorder.spans)
+        calls = list(_recorder.calls)
+        counters = dict(_recorder.counters)
+        caches = {k: dict(v) for k, v in _recorder.caches.items()}
+
+    span_stats = {}
+    for s in spans:
+        span_stats.setdefault(s["name"], []).append(s["duration_s"])
+    for name, durations in span_stats.items():
+        durations.sort()
+        span_stats[name] = {"count": len(durations),
+                            "total_s": sum(durations),
+                            "p50_s": _percentile(durations, 50),
+                            "p90_s": _percentile(durations, 90),
+                            "max_s": durations[-1]}
+
+    call_stats = {}
+    for c in calls:
+        call_stats.setdefault(f"{c['service']} {c['endpoint']}", []).append(c)
+    for name, endpoint_calls in call_stats.items():
+        latencies = sorted(c["latency_s"] for c in endpoint_calls)
+        call_stats[name] = {"count": len(endpoint_calls),
+                            "errors": sum(1 for c in endpoint_calls if c["status"] >= 400),
+                            "bytes": sum(c["bytes"] for c in endpoint_calls if c["bytes"] is not None),
+                            "total_s": sum(latencies),
+                            "p50_s": _percentile(latencies, 50),
+                            "p90_s": _percentile(latencies, 90),
+                            "p99_s": _percentile(latencies, 99)}
+
+    for stats in caches.values():
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+
+    return {"spans": span_stats, "calls": call_stats, "counters": counters, "caches": caches}
+
+
+def summary_table(summary: dict) -> str:
+    lines = [f"{'Span':<40} {'Count':>7} {'Total s':>9} {'p50 s':>8} {'p90 s':>8} {'Max s':>8}"]
+    for name, s in sorted(summary["spans"].items(), key=lambda kv: kv[1]["total_s"], reverse=True):
+        lines.append(f"{name:<40} {s['count']:>7} {s['total_s']:>9.3f} {s['p50_s']:>8.3f} "
+                     f"{s['p90_s']:>8.3f} {s['max_s']:>8.3f}")
+    if summary["calls"]:
+        lines.append("")
+        lines.append(f"{'Call':<60} {'Count':>7} {'Errors':>6} {'KB':>9} {'p50 s':>8} {'p90 s':>8} {'p99 s':>8}")
+        for name, c in sorted(summary["calls"].items(), key=lambda kv: kv[1]["total_s"], reverse=True):
+            lines.append(f"{name[:60]:<60} {c['count']:>7} {c['errors']:>6} {c['bytes'] / 1024:>9.1f} "
+                         f"{c['p50_s']:>8.3f} {c['p90_s']:>8.3f} {c['p99_s']:>8.3f}")
+    if summary["counters"]:
+        lines.append("")
+        for name, n in sorted(summary["counters"].items()):
+            lines.append(f"{name:<40} {n:>7}")
+    if summary["caches"]:
+        lines.append("")
+        lines.append(f"{'Cache':<40} {'Hits':>7} {'Misses':>7} {'Rate':>6}")
+        for name, c in sorted(summary["caches"].items()):
+            lines.append(f"{name:<40} {c['hits']:>7} {c['misses']:>7} {c['hit_rate']:>6.0%}")
+    return "\n".join(lines)
+
+
+def write_trace(filename: Path, name: str = None):
+    """ Write everything recorded, and its summary, as json """
+    summary = summarize()
+    with _recorder._lock:
+        trace = {"name": name,
+                 "started": _recorder._started,
+                 "duration_s": _recorder.elapsed(),
+                 "summary": summary,
+                 "spans": sorted(_recorder.spans, key=lambda s: s["start_s"]),
+                 "calls": list(_recorder.calls)}
+    filename.parent.mkdir(exist_ok=True, parents=True)
+    with open(filename, 'w', encoding="utf-8") as fp:
+        json.dump(trace, fp, indent=2)
+    return summary
+
+
+def finish(trace_filename: Path = None, name: str = None):
+    """ Log a summary of this run and write its trace, if anything was recorded, by default to where start said """
+    trace_filename = trace_filename or _recorder.trace_filename
+    name = name or _recorder.name
+    if trace_filename is None:
+        return
+    if not _recorder.spans and not _recorder.calls and not _recorder.counters and not _recorder.caches:
+        return
+    summary = write_trace(trace_filename, name)
+    _logger.info(f"Run summary ({_recorder.elapsed():.1f}s), trace written to {trace_filename}\n"
+                 f"{summary_table(summary)}")
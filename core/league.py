@@ -1,34 +1,45 @@
 # Distributed under the Apache License, Version 2.0.
 # See accompanying NOTICE file for details.
 
+from __future__ import annotations
+
 import json
 import logging
 import math
+import time
 from pathlib import Path
 
-import trueskill
-
 from datetime import datetime, timedelta
 from dateutil import tz
 from google.protobuf import json_format, text_format
-from iracingdataapi.client import irDataClient
-from trueskill import Rating
+from typing import TYPE_CHECKING
 
-from core.clients import ClientMain
-from core.garage61 import Garage61Client
+from core import instrumentation
+from core.catalog import LeagueCatalog
+from core.clients import CachingDataClient, ClientMain
+from core.garage61 import Garage61Client, Garage61LapStore, is_clean_lap
 from core.objects import GroupRules, LeagueResult, PositionValue, SerializationFormat, serialize_to_string, \
     percent_difference, time2str
 from core.objects_pb2 import (GroupRulesData, LeagueConfigurationData, PointsMultiplierData,
                               PenaltyData, TimePenaltyData, PointsThresholdData, IncidentPointsData)
 
+if TYPE_CHECKING:
+    from iracingdataapi.client import irDataClient
+    from core.ratings import RatingStore
+
 _logger = logging.getLogger('log')
+# Seasons and sessions of every league we look at, shared by all configurations
+_catalog = LeagueCatalog()
 
 
 class LeagueMain(ClientMain):
-    __slots__ = ["configs"]
+    __slots__ = ["configs", "_daemon", "_poll_interval_s", "_archive_dir"]
 
     def __init__(self, log_filename: str):
         self.configs = []
+        self._daemon = False
+        self._poll_interval_s = 300
+        self._archive_dir = None
         super().__init__(log_filename)
 
     def add_args(self, parser):
@@ -43,9 +54,29 @@ class LeagueMain(ClientMain):
             nargs='*',
             help="Optional list of string tokens to search for in all config file names"
         )
+        parser.add_argument(
+            "-dmn", "--daemon",
+            action="store_true",
+            help="Keep running, scoring (and pushing) a league season every time one of its races completes"
+        )
+        parser.add_argument(
+            "-poll", "--poll_interval",
+            default=300,
+            type=float,
+            help="Seconds between checks for completed races when running as a daemon"
+        )
+        parser.add_argument(
+            "-arc", "--archive_dir",
+            default=Path("./archive"),
+            type=Path,
+            help="Archive every scored season to this directory, refreshing the careers of its drivers"
+        )
 
     def process_args(self, args):
         super().process_args(args)
+        self._daemon = args.daemon
+        self._poll_interval_s = args.poll_interval
+        self._archive_dir = args.archive_dir
         if args.cfg_files:
             for filename in args.cfg_files:
                 print(f"Opening file: {filename}")
@@ -61,6 +92,128 @@ class LeagueMain(ClientMain):
                         self.configs.append(serialize_league_configuration_from_string(content,
                                                                                        SerializationFormat.JSON))
 
+    @property
+    def daemon(self) -> bool: return self._daemon
+
+    @property
+    def archive_dir(self) -> Path: return self._archive_dir
+
+    def watch(self, score, polls: int = None):
+        """
+        Score configurations as their races complete, with a new cache for every poll
+        Every configuration is scored on the first poll, and all of a configuration's races are scored again when
+        one of them completes, from results score_league checkpointed to disk, so only new races are pulled
+        Races only count as seen once every configuration of their season scored, so a poll or a scoring that fails
+        is tried again on the next poll
+        :param score: called with each configuration to score and push,
+                      ex. lambda cfg: score_league(self, cfg, archive_dir=self.archive_dir),
+                      returns None if it failed
+        :param polls: stop after this many polls, default is to keep polling until interrupted
+        """
+        from iracingdataapi.exceptions import AccessTokenInvalid
+
+        watcher = LeagueWatcher(self.configs)
+        poll = 0
+        while polls is None or poll < polls:
+            if poll > 0:
+                # Each poll has its own summary, and what is recorded does not grow poll after poll
+                instrumentation.flush()
+                time.sleep(self._poll_interval_s)
+            poll += 1
+            # What a poll pulls is cached for the scoring that follows it, then dropped, so memory does not grow with
+            # every completed race (score may have authenticated again, replacing the cache with a new client)
+            if isinstance(self._idc, CachingDataClient):
+                self._idc = self._idc.client
+            cache = CachingDataClient(self.idc)
+            self._idc = cache
+            try:
+                with instrumentation.span("daemon.poll"):
+                    try:
+                        updated = watcher.poll(cache)
+                    except AccessTokenInvalid:
+                        _logger.info("iRacing access token expired, authenticating again")
+                        cache.client = self.authenticate()
+                        self._idc = cache
+                        updated = watcher.poll(cache)
+            except KeyboardInterrupt:
+                raise
+            except Exception as e:
+                _logger.error(f"Unable to check for completed races, will try again: {e}")
+                continue
+            failed = set()
+            for cfg in updated:
+                _logger.info(f"Scoring {cfg.name} {cfg.season}")
+                if score(cfg) is None:
+                    _logger.error(f"Failed to score {cfg.name} {cfg.season}, will try again")
+                    failed.add((cfg.iracing_id, cfg.season))
+            watcher.commit(failed)
+
+
+class LeagueWatcher:
+    """
+    Finds the subsessions of league seasons that completed since we last looked
+    What a poll finds is only remembered once it is committed (ex. after it was scored)
+    """
+    __slots__ = ["_configs", "_completed", "_staged"]
+
+    def __init__(self, configs: list):
+        self._configs = configs
+        self._completed = dict()  # (league id, season name) -> completed subsession ids
+        self._staged = dict()  # (league id, season name) -> completed subsession ids, as of the last poll
+
+    def poll(self, idc: irDataClient) -> list:
+        """
+        :param idc: client to look with, results it pulls are what scoring will need next
+        :return: configurations with a subsession that completed since the last commit (all of them until the first)
+        """
+        self._staged = dict()
+        staged = dict()
+        season_ids = dict()  # league id -> {season name: season id}
+        looked = set()  # (league id, season name), configurations can share a season
+        updated = set()
+        for cfg in self._configs:
+            key = (cfg.iracing_id, cfg.season)
+            if key in looked:
+                continue
+            looked.add(key)
+            if cfg.iracing_id not in season_ids:
+                ir_seasons = idc.league_seasons(cfg.iracing_id, True)["seasons"]
+                season_ids[cfg.iracing_id] = {s["season_name"]: s["season_id"] for s in ir_seasons}
+            season_id = season_ids[cfg.iracing_id].get(cfg.season)
+            if season_id is None:
+                _logger.warning(f"League {cfg.iracing_id} has no season named {cfg.season}")
+                continue
+
+            first_poll = key not in self._completed
+            completed = set(self._completed.get(key, set()))
+            staged[key] = completed
+            ir_sessions = idc.league_season_sessions(cfg.iracing_id, season_id, False)["sessions"]
+            for ir_session in ir_sessions:
+                subsession_id = ir_session.get("subsession_id")
+                if subsession_id is None or subsession_id in completed:
+                    continue
+                try:
+                    idc.result(subsession_id=subsession_id)
+                except RuntimeError:
+                    continue  # Still running
+                _logger.info(f"Subsession {subsession_id} of {cfg.name} {cfg.season} has completed")
+                completed.add(subsession_id)
+                updated.add(key)
+            if first_poll:
+                updated.add(key)
+        self._staged = staged
+        return [cfg for cfg in self._configs if (cfg.iracing_id, cfg.season) in updated]
+
+    def commit(self, failed: set = frozenset()):
+        """
+        Remember what the last poll found, so it is not returned again
+        :param failed: (league id, season name) of seasons to find again on the next poll (ex. they failed to score)
+        """
+        for key, completed in self._staged.items():
+            if key not in failed:
+                self._completed[key] = completed
+        self._staged = dict()
+
 
 # Note, for our API, use 1 based counting
 # The first race is race 1, not race 0
@@ -238,6 +391,153 @@ class TimePenalty(Penalty):
     def seconds(self): return self._seconds
 
 
+class LapConditions:
+    """
+    The weather a lap was driven in, or a hot lap session is set to, in Garage61 units.
+    The signature quantizes these values so laps can be indexed by the conditions they were driven in.
+    """
+    __slots__ = ["_air_temp_c",
+                 "_wind_m_per_s",
+                 "_rel_humidity",
+                 "_dry",
+                 "_clouds",
+                 "_signature"]
+
+    # Bucket sizes, these must be wider than the percent tolerance used in matches
+    air_temp_step_c = 0.5
+    wind_step_m_per_s = 0.5
+    rel_humidity_step = 0.05
+    tolerance_percent = 0.25
+
+    def __init__(self, air_temp_c: float, wind_m_per_s: float, rel_humidity: float, dry: bool | None, clouds: int):
+        self._air_temp_c = air_temp_c
+        self._wind_m_per_s = wind_m_per_s
+        self._rel_humidity = rel_humidity
+        self._dry = dry  # None means any wetness is acceptable
+        self._clouds = clouds
+        self._signature = (math.floor(air_temp_c / self.air_temp_step_c),
+                           math.floor(wind_m_per_s / self.wind_step_m_per_s),
+                           math.floor(rel_humidity / self.rel_humidity_step),
+                           dry,
+                           clouds)
+
+    @staticmethod
+    def from_ir_weather(weather: dict):
+        # Convert iRacing units to g61 units
+        # Sky/Cloud values seem to be off by 1
+        return LapConditions((weather["temp_value"] - 32) * 0.555,
+                             weather["wind_value"] * 0.44704,
+                             weather["rel_humidity"] * 0.01,
+                             True if weather["track_water"] == 0 else None,
+                             weather["skies"] + 1)
+
+    @staticmethod
+    def from_g61_lap(g61_lap: dict):
+        return LapConditions(g61_lap["airTemp"],
+                             g61_lap["windVel"],
+                             g61_lap["relativeHumidity"],
+                             g61_lap["trackWetness"] == 0,
+                             g61_lap["clouds"])
+
+    @property
+    def air_temp_c(self): return self._air_temp_c
+
+    @property
+    def wind_m_per_s(self): return self._wind_m_per_s
+
+    @property
+    def rel_humidity(self): return self._rel_humidity
+
+    @property
+    def dry(self): return self._dry
+
+    @property
+    def clouds(self): return self._clouds
+
+    @property
+    def signature(self): return self._signature
+
+    @property
+    def key(self):
+        # TODO Sky mapping is weird between iR and g61... they just don't seem to match, so clouds are not part of the key
+        return self._signature[:4]
+
+    def neighbor_keys(self):
+        """
+        Every key a lap within tolerance of these conditions could be indexed under
+        """
+        t, w, h, dry, _ = self._signature
+        wetness = (True, False) if dry is None else (dry,)
+        for dt in (-1, 0, 1):
+            for dw in (-1, 0, 1):
+                for dh in (-1, 0, 1):
+                    for wet in wetness:
+                        yield t + dt, w + dw, h + dh, wet
+
+    def mismatches(self, lap: "LapConditions") -> list[str]:
+        """
+        :return: what about a lap's conditions did not match these, as "<condition>. Expected: <these>, Lap <lap>"
+        """
+        failed = []
+        if self._dry is not None and self._dry != lap.dry:
+            failed.append(f"Failed wetness. Expected: {'dry' if self._dry else 'wet'}, "
+                          f"Lap {'dry' if lap.dry else 'wet'}")
+        for name, expected, actual in (("Air Temp", self._air_temp_c, lap.air_temp_c),
+                                       ("Wind", self._wind_m_per_s, lap.wind_m_per_s),
+                                       ("Humidity", self._rel_humidity, lap.rel_humidity)):
+            if percent_difference(expected, actual) > self.tolerance_percent:
+                failed.append(f"Failed {name}. Expected: {expected}, Lap {actual}")
+        return failed
+
+    def matches(self, lap: "LapConditions") -> bool:
+        if self._dry is not None and self._dry != lap.dry:
+            return False
+        return (percent_difference(self._air_temp_c, lap.air_temp_c) <= self.tolerance_percent and
+                percent_difference(self._wind_m_per_s, lap.wind_m_per_s) <= self.tolerance_percent and
+                percent_difference(self._rel_humidity, lap.rel_humidity) <= self.tolerance_percent)
+
+
+class LapConditionsIndex:
+    """
+    Garage61 laps bucketed by their LapConditions key,
+    so finding the laps driven in a session's conditions does not need to look at every lap
+    """
+    __slots__ = ["_laps", "_buckets"]
+
+    def __init__(self, g61_laps: list[dict]):
+        self._laps = g61_laps
+        self._buckets = dict()
+        for idx, g61_lap in enumerate(g61_laps):
+            conditions = LapConditions.from_g61_lap(g61_lap)
+            self._buckets.setdefault(conditions.key, []).append((idx, conditions))
+
+    @property
+    def num_laps(self): return len(self._laps)
+
+    def rejected(self, session: LapConditions) -> list[tuple[dict, list[str]]]:
+        """
+        The laps matching looked at, but that were not driven in the given session conditions
+        :return: (lap, what did not match, see LapConditions.mismatches) of each, in the order they were provided
+        """
+        found = []
+        for key in session.neighbor_keys():
+            for idx, conditions in self._buckets.get(key, []):
+                if not session.matches(conditions):
+                    found.append((idx, session.mismatches(conditions)))
+        return [(self._laps[idx], mismatches) for idx, mismatches in sorted(found)]
+
+    def matching(self, session: LapConditions) -> list[dict]:
+        """
+        All laps driven in the given session conditions, in the order they were provided
+        """
+        found = []
+        for key in session.neighbor_keys():
+            for idx, conditions in self._buckets.get(key, []):
+                if session.matches(conditions):
+                    found.append(idx)
+        return [self._laps[idx] for idx in sorted(found)]
+
+
 class LeagueConfiguration:
     __slots__ = ["_iracing_id",
                  "_g61_id",
@@ -391,19 +691,25 @@ class LeagueConfiguration:
 
     @staticmethod
     def fetch_all_season_names(idc: irDataClient, league_id: int) -> list:
-        ir_seasons = idc.league_seasons(league_id, True)["seasons"]
-        names = []
-        for ir_season in ir_seasons:
-            names.append(ir_season["season_name"])
-        return names
+        """
+        :return: the name of every (including retired) season of a league, as iRacing lists them now
+        """
+        # Only the season list, no sessions, so pulled every time (a long running process sees new seasons)
+        return [ir_season["season_name"] for ir_season in idc.league_seasons(league_id, True)["seasons"]]
 
     @staticmethod
-    def fetch_track_count(idc: irDataClient, league_id: int):
+    def fetch_track_count(idc: irDataClient, league_id: int, catalog: LeagueCatalog = None):
+        """
+        :param catalog: where league seasons and sessions are kept, default is ./catalog
+        """
+        catalog = catalog or _catalog
         tracks = dict()
-        ir_seasons = idc.league_seasons(league_id, True)["seasons"]
+        # Every time, a long running process (ex. the daemon) would otherwise miss new seasons and races
+        league = catalog.refresh(idc, league_id)
+        ir_seasons = league["seasons"]
         _logger.info("Found " + str(len(ir_seasons)) + " seasons")
         for ir_season in ir_seasons:
-            ir_sessions = idc.league_season_sessions(league_id, ir_season["season_id"], False)["sessions"]
+            ir_sessions = league["sessions"].get(ir_season["season_id"], [])
             for ir_session in ir_sessions:
                 ir_track = ir_session['track']
                 track = f"{ir_track['track_name']}"
@@ -415,7 +721,11 @@ class LeagueConfiguration:
                 tracks[track]["seasons"].add(ir_season["season_name"])
         return tracks
 
-    def fetch_and_score_league(self, idc: irDataClient, active: bool = True) -> LeagueResult:
+    def fetch_and_score_league(self, idc: irDataClient, active: bool = True, ratings: RatingStore = None) -> LeagueResult:
+        """
+        :param ratings: drivers start the season with the rating they had in this store before the season,
+                        rather than the default
+        """
         lg = self.fetch_league_members(idc)
 
         ir_league_info = idc.league_get(self._iracing_id)  # TODO replace with lg below
@@ -493,6 +803,7 @@ class LeagueConfiguration:
                         continue
 
                     completed_races += 1
+                    instrumentation.count("score.races")
                     ir_car_results = ir_race_results["results"]
                     ir_total_laps = ir_car_results[0]["laps_complete"]
                     multiplier = scoring.get_race_multiplier(race.number)
@@ -788,166 +1099,159 @@ class LeagueConfiguration:
                     _logger.info("\tRace " + str(race_num) + " at " + track_name + " has not completed yet.")
                     continue
 
-            # Rate each driver
-            ratings = list()
-            finishing_positions = list()
-            for race in lg.races.values():
-                if race.grid_size == 0:
-                    continue
-                ratings.clear()
-                finishing_positions.clear()
-                for cust_id, my_driver in lg.drivers.items():
-                    result = race.get_result(cust_id)
-                    if result is None:  # Not in this race
-                        finishing_positions.append(-1)
-                    else:
-                        finishing_positions.append(result.finish_position)
-                    ratings.append((Rating(my_driver._mu, my_driver._sigma),))
-                new_ratings = trueskill.rate(ratings, finishing_positions)
-                for idx, driver in enumerate(lg.drivers.values()):
-                    driver._mu = new_ratings[idx][0].mu
-                    driver._sigma = new_ratings[idx][0].sigma
-                    result = race.get_result(driver.cust_id)
-                    if result is None:
-                        continue  # The rating is propagated via the driver, not the result, so I think this is OK
-                    result._mu = driver._mu
-                    result._sigma = driver._sigma
-
-            # Track group statistics after the season, since we don't know when the final groups are set
-            # We will also compute trueskill ratings for each race based on finishing positions
-            for race in lg.races.values():
-                multiplier = scoring.get_race_multiplier(race.number)
-                # Find the fastest lap and pole position for every group
-
-                for result in race.grid.values():
-                    driver = lg.get_driver(result.cust_id)
+            # Rate each driver, from where they were before this season (never from a season that came after it)
+            prior = None
+            if ratings is not None:
+                from core.ratings import season_start
+                prior = ratings.before(f"{self._name} {self._season}", season_start(lg))
+            rate_drivers(lg, prior)
+
+            with instrumentation.span("score.race_stats"):
+                # Track group statistics after the season, since we don't know when the final groups are set
+                # We will also compute trueskill ratings for each race based on finishing positions
+                for race in lg.races.values():
+                    multiplier = scoring.get_race_multiplier(race.number)
+                    # Find the fastest lap and pole position for every group
+
+                    for result in race.grid.values():
+                        driver = lg.get_driver(result.cust_id)
+                        if driver.group == "Unknown":
+                            _logger.fatal(f"You should add {result.cust_id} as a non driver")
+                            exit(1)
+                        race_stats = race.get_stats(driver.group)
+                        race_stats._num_drivers += 1
+
+                        race_stats.check_if_pole_position(result.cust_id, result.start_position)
+                        if not result.met_minimum_distance:
+                            continue  # I think you should still get your pole position point if you don't finish the race
+                        race_stats.check_if_fastest_lap(result.cust_id, result.fastest_lap_time)
+                        race_stats.check_if_winner(result.cust_id, result.finish_position)
+                        race_stats.check_if_most_laps_lead(result.cust_id, result.laps_lead)
+                        if result.laps_lead > 0:
+                            race_stats.lead_a_lap_drivers.append(result.cust_id)
+
+                    # Now push those stats back into the results and drivers
+                    for grp, stat in race.stats.items():
+                        if grp == "Unknown":
+                            _logger.fatal(f"How did we get an Unknown group?")
+                            exit(1)
+                        if stat is None:
+                            _logger.warning(f"No race stats for group {grp}")
+                            continue
+
+                        if stat.winning_driver:
+                            dvr = lg.get_driver(stat.winning_driver)
+                            dvr._total_wins += 1
+
+                        if stat.pole_position_driver:
+                            rr = race.get_result(stat.pole_position_driver)
+                            rr._pole_position = True
+                            rr._points += self.scoring_system.pole_position * multiplier.pole_position
+                            dvr = lg.get_driver(stat.pole_position_driver)
+                            dvr._pole_position_points += self.scoring_system.pole_position * multiplier.pole_position
+
+                        if race.number in self._fast_laps_override:
+                            if stat.fastest_lap_driver in self._fast_laps_override[race.number]:
+                                new_fast_lap_id = self._fast_laps_override[race.number][stat.fastest_lap_driver]
+                                _logger.info(f"Overriding fasting lap for race {race.number} from "
+                                             f"{lg.get_driver(stat.fastest_lap_driver).name} to "
+                                             f"{lg.get_driver(new_fast_lap_id).name}")
+                                stat._fastest_lap_driver = new_fast_lap_id
+
+
+                        if stat.fastest_lap_driver:
+                            rr = race.get_result(stat.fastest_lap_driver)
+                            rr._fastest_lap = True
+                            rr._points += self.scoring_system.fastest_lap.points * multiplier.fastest_lap
+                            dvr = lg.get_driver(stat.fastest_lap_driver)
+                            dvr._fastest_lap_points += self.scoring_system.fastest_lap.points * multiplier.fastest_lap
+                        else:
+                            _logger.warning("No fastest lap for race")
+                            # You can have a race where noone sets a legal lap....
+
+                        if stat.most_laps_lead_driver:
+                            rr = race.get_result(stat.most_laps_lead_driver)
+                            rr._most_laps_lead = True
+                            rr._points += self.scoring_system.most_laps_lead.points * multiplier.most_laps_lead
+                            dvr = lg.get_driver(stat.most_laps_lead_driver)
+                            dvr._most_laps_lead_points += self.scoring_system.most_laps_lead.points * multiplier.most_laps_lead
+
+            with instrumentation.span("score.drivers"):
+                # Score each driver
+                points = list()
+                for cust_id, driver in lg.drivers.items():
                     if driver.group == "Unknown":
-                        _logger.fatal(f"You should add {result.cust_id} as a non driver")
-                        exit(1)
-                    race_stats = race.get_stats(driver.group)
-                    race_stats._num_drivers += 1
-
-                    race_stats.check_if_pole_position(result.cust_id, result.start_position)
-                    if not result.met_minimum_distance:
-                        continue  # I think you should still get your pole position point if you don't finish the race
-                    race_stats.check_if_fastest_lap(result.cust_id, result.fastest_lap_time)
-                    race_stats.check_if_winner(result.cust_id, result.finish_position)
-                    race_stats.check_if_most_laps_lead(result.cust_id, result.laps_lead)
-                    if result.laps_lead > 0:
-                        race_stats.lead_a_lap_drivers.append(result.cust_id)
-
-                # Now push those stats back into the results and drivers
-                for grp, stat in race.stats.items():
-                    if grp == "Unknown":
-                        _logger.fatal(f"How did we get an Unknown group?")
-                        exit(1)
-                    if stat is None:
-                        _logger.warning(f"No race stats for group {grp}")
                         continue
 
-                    if stat.winning_driver:
-                        dvr = lg.get_driver(stat.winning_driver)
-                        dvr._total_wins += 1
-
-                    if stat.pole_position_driver:
-                        rr = race.get_result(stat.pole_position_driver)
-                        rr._pole_position = True
-                        rr._points += self.scoring_system.pole_position * multiplier.pole_position
-                        dvr = lg.get_driver(stat.pole_position_driver)
-                        dvr._pole_position_points += self.scoring_system.pole_position * multiplier.pole_position
-
-                    if race.number in self._fast_laps_override:
-                        if stat.fastest_lap_driver in self._fast_laps_override[race.number]:
-                            new_fast_lap_id = self._fast_laps_override[race.number][stat.fastest_lap_driver]
-                            _logger.info(f"Overriding fasting lap for race {race.number} from "
-                                         f"{lg.get_driver(stat.fastest_lap_driver).name} to "
-                                         f"{lg.get_driver(new_fast_lap_id).name}")
-                            stat._fastest_lap_driver = new_fast_lap_id
-
-
-                    if stat.fastest_lap_driver:
-                        rr = race.get_result(stat.fastest_lap_driver)
-                        rr._fastest_lap = True
-                        rr._points += self.scoring_system.fastest_lap.points * multiplier.fastest_lap
-                        dvr = lg.get_driver(stat.fastest_lap_driver)
-                        dvr._fastest_lap_points += self.scoring_system.fastest_lap.points * multiplier.fastest_lap
-                    else:
-                        _logger.warning("No fastest lap for race")
-                        # You can have a race where noone sets a legal lap....
-
-                    if stat.most_laps_lead_driver:
-                        rr = race.get_result(stat.most_laps_lead_driver)
-                        rr._most_laps_lead = True
-                        rr._points += self.scoring_system.most_laps_lead.points * multiplier.most_laps_lead
-                        dvr = lg.get_driver(stat.most_laps_lead_driver)
-                        dvr._most_laps_lead_points += self.scoring_system.most_laps_lead.points * multiplier.most_laps_lead
-
-            # Score each driver
-            points = list()
-            for cust_id, driver in lg.drivers.items():
-                if driver.group == "Unknown":
-                    continue
-
-                lg.get_driver(cust_id)
-                points.clear()
-                num_races = 0
-                hcp_points = []
-                finishing_positions = []
-                for race in lg.races.values():
-                    result = race.get_result(cust_id)
-                    if result is None:  # Not in this race
-                        points.append(0)
-                        hcp_points.append(0)
-                    else:
-                        num_races += 1
-                        finishing_positions.append(result.finish_position)
-                        result._handicap_points = 0
-                        points.append(result.points)
-                        # Apply a handicap if requested
-                        if self.scoring_system.handicap:
-                            # N = average points per race
-                            # points added = 0.9 * (30 - N)
-                            n = (sum(points) + sum(hcp_points)) / num_races
-                            hcp = math.floor(0.90 * ((max_points * 0.75) - n))
-                            result._handicap_points = hcp if hcp > 0 else 0
-                            hcp_points.append(result._handicap_points)
-                driver._earned_points = sum(points)
-                driver._handicap_points = sum(points) + sum(hcp_points)
-                driver._drop_points = 0
-
-                #if cust_id == 855223:
-                #    print("Here")
-                num_drops = self.get_group_rules(driver.group).num_drops
-                min_races_for_drops = self.get_group_rules(driver.group).min_races_for_drops
-                if num_drops > 0:
-                    perform_drops = False
-                    if min_races_for_drops <= 0:
-                        if completed_races == self._num_races:
-                            # It's the last week, so do the drops
-                            perform_drops = True
-                    elif completed_races >= min_races_for_drops:
-                        # We have the minimum number of races to calculate drop points
-                        perform_drops = True
-                        if len(points) != self._num_races:
-                            num_drops -= self._num_races-len(points)
-                    else:  # We are trying to drop ahead of the min races are run
-                        # And we have unrun races, which are zero in the point
-                        # So we really don't need to do anything
+                    lg.get_driver(cust_id)
+                    points.clear()
+                    num_races = 0
+                    hcp_points = []
+                    finishing_positions = []
+                    for race in lg.races.values():
+                        result = race.get_result(cust_id)
+                        if result is None:  # Not in this race
+                            points.append(0)
+                            hcp_points.append(0)
+                        else:
+                            num_races += 1
+                            finishing_positions.append(result.finish_position)
+                            result._handicap_points = 0
+                            points.append(result.points)
+                            # Apply a handicap if requested
+                            if self.scoring_system.handicap:
+                                # N = average points per race
+                                # points added = 0.9 * (30 - N)
+                                n = (sum(points) + sum(hcp_points)) / num_races
+                                hcp = math.floor(0.90 * ((max_points * 0.75) - n))
+                                result._handicap_points = hcp if hcp > 0 else 0
+                                hcp_points.append(result._handicap_points)
+                    driver._earned_points = sum(points)
+                    driver._handicap_points = sum(points) + sum(hcp_points)
+                    driver._drop_points = 0
+
+                    #if cust_id == 855223:
+                    #    print("Here")
+                    num_drops = self.get_group_rules(driver.group).num_drops
+                    min_races_for_drops = self.get_group_rules(driver.group).min_races_for_drops
+                    if num_drops > 0:
                         perform_drops = False
-                        # If unrun races are not zero... we'd need to drop them... but wtf...
-                        # if len(points) > completed_races:
-                        #     num_drops = len(points) - completed_races
-                    if perform_drops:
-                        driver._drop_points = sum(sorted(points)[:num_drops])
-                if driver.total_completed_races > 0:
-                    driver._average_finish = sum(finishing_positions) / len(finishing_positions)
+                        if min_races_for_drops <= 0:
+                            if completed_races == self._num_races:
+                                # It's the last week, so do the drops
+                                perform_drops = True
+                        elif completed_races >= min_races_for_drops:
+                            # We have the minimum number of races to calculate drop points
+                            perform_drops = True
+                            if len(points) != self._num_races:
+                                num_drops -= self._num_races-len(points)
+                        else:  # We are trying to drop ahead of the min races are run
+                            # And we have unrun races, which are zero in the point
+                            # So we really don't need to do anything
+                            perform_drops = False
+                            # If unrun races are not zero... we'd need to drop them... but wtf...
+                            # if len(points) > completed_races:
+                            #     num_drops = len(points) - completed_races
+                        if perform_drops:
+                            driver._drop_points = sum(sorted(points)[:num_drops])
+                    if driver.total_completed_races > 0:
+                        driver._average_finish = sum(finishing_positions) / len(finishing_positions)
 
         # End of looping over every season
         # print(dict(sorted(contacts.items(), key=lambda item: item[1])))
         return lg
 
-    def fetch_and_score_hot_lap_league(self, idc: irDataClient, g61: Garage61Client, g612ir: dict) -> LeagueResult:
+    def fetch_and_score_hot_lap_league(self, idc: irDataClient, g61: Garage61Client, g612ir: dict,
+                                       lap_store: Garage61LapStore = None, telemetry_dir: Path = None) -> LeagueResult:
+        """
+        :param telemetry_dir: download the telemetry of each driver's fastest clean lap of every session to this
+                              directory, laps already downloaded are skipped
+        """
         lg = self.fetch_league_members(idc)
+        telemetry_lap_ids = []
+        if lap_store is None:
+            lap_store = Garage61LapStore(g61, Path("./g61_laps") / f"{self._g61_id}.json")
+        lg.add_aliases(g612ir)
 
         def lap2str(_lap: dict):
             return f"\t{_lap['driver']['slug']} {time2str(_lap['lapTime'])} on {_lap['startTime']}"
@@ -970,6 +1274,34 @@ class LeagueConfiguration:
 
             _logger.info("There are " + str(len(ir_sessions)) + " sessions in season ")
 
+            def session_window(_ir_session: dict):
+                _launch = datetime.strptime(_ir_session["launch_at"], '%Y-%m-%dT%H:%M:%SZ')
+                return (_launch - timedelta(days=7),  # TODO Make this delta a cfg variable
+                        _launch + timedelta(minutes=_ir_session["time_limit"]))
+
+            def session_pool(_ir_session: dict):
+                return _ir_session["track"]["track_id"], tuple(sorted(car["car_id"] for car in _ir_session["cars"]))
+
+            # Sessions at the same track with the same cars share one pool of laps
+            # Pull each pool once, and index it by the conditions each lap was driven in
+            pool_windows = {}
+            for ir_session in ir_sessions:
+                pool = session_pool(ir_session)
+                window_start, window_end = session_window(ir_session)
+                if pool in pool_windows:
+                    window_start = min(window_start, pool_windows[pool][0])
+                    window_end = max(window_end, pool_windows[pool][1])
+                pool_windows[pool] = (window_start, window_end)
+            # https://garage61.net/developer
+            # Pools are pulled concurrently, the g61 client rate limits and retries each request
+            with instrumentation.span("garage61.lap_pools", pools=len(pool_windows)):
+                pool_laps = lap_store.laps_many(self._g61_id,
+                                                [(pool[0], list(pool[1]), window_start, window_end)
+                                                 for pool, (window_start, window_end) in pool_windows.items()])
+            lap_pools = {}
+            for pool, g61_laps in zip(pool_windows.keys(), pool_laps):
+                lap_pools[pool] = LapConditionsIndex(g61_laps)
+
             completed_races = 0
             race_num = 0
             race_session_num = 0
@@ -979,11 +1311,7 @@ class LeagueConfiguration:
                 track_config = None
                 if "config_name" in ir_session["track"]:
                     track_config = ir_session["track"]["config_name"]
-                track_id = ir_session["track"]["track_id"]
                 weather = ir_session["weather"]
-                car_ids = []
-                for car in ir_session["cars"]:
-                    car_ids.append(car["car_id"])
                 session_launch = datetime.strptime(ir_session["launch_at"], '%Y-%m-%dT%H:%M:%SZ')
                 utc = session_launch.replace(tzinfo=tz.tzutc())
 
@@ -993,52 +1321,25 @@ class LeagueConfiguration:
 
                 _logger.info("\tSession " + str(race_num) + " at " + track_name)
 
-                # Convert iRacing units to g61 units
-                air_temp_c = (weather["temp_value"] - 32) * 0.555
-                wind_m_per_s = weather["wind_value"] * 0.44704
-                rel_humidity = weather["rel_humidity"] * 0.01
-
-                window_start = session_launch - timedelta(days=7)  # TODO Make this delta a cfg variable
-                window_end = session_launch + timedelta(minutes=ir_session["time_limit"])
-
-                # https://garage61.net/developer
-                all_g61_laps = g61.laps(teams=self._g61_id,
-                                        cars=car_ids,
-                                        tracks=track_id,
-                                        group="none",
-                                        include_unclean=True,
-                                        date_after=window_start
-                                        )
-                # Apply filters (API filters don't work when getting all laps (??))
-                """
-                                # min_cond_track_usage=0,
-                                # max_cond_track_usage=0,
-                                min_cond_track_wetness=weather["track_water"],
-                                max_cond_track_wetness=weather["track_water"],
-                                # min_cond_track_temp=0,
-                                # max_cond_track_temp=0,
-                                min_cond_air_temp=air_temp_c,
-                                max_cond_air_temp=air_temp_c,
-                                min_cond_wind_vel=wind_m_per_s,
-                                max_cond_wind_vel=wind_m_per_s,
-                                min_cond_relative_humidity=weather["rel_humidity"],
-                                max_cond_relative_humidity=weather["rel_humidity"],
-                                min_cond_fog_level=weather["fog"],
-                                max_cond_fog_level=weather["fog"],
-                                min_cond_precipitation=weather["precip_option"],
-                                max_cond_precipitation=weather["precip_option"],
-                                # min_cond_cloud=weather["skies"],
-                                # max_cond_cloud=weather["skies"],
-                                cond_wind_dir=weather["wind_dir"],
-                                # rounding="englishStandard"
-                                )
-                """
+                window_start, window_end = session_window(ir_session)
+                conditions = LapConditions.from_ir_weather(weather)
+                lap_pool = lap_pools[session_pool(ir_session)]
+                # Only look at laps driven in this session's conditions (air temp, wind, humidity and wetness)
+                all_g61_laps = lap_pool.matching(conditions)
+                rejected = lap_pool.rejected(conditions)
+                _logger.info(f"\t{len(rejected)} of {lap_pool.num_laps} laps were close to, "
+                             f"but did not match, the session conditions")
+                for g61_lap, mismatches in rejected:
+                    for mismatch in mismatches:
+                        _logger.info(f"Invalid Lap: {mismatch}")
+                    _logger.info(f"\t{lap2str(g61_lap)}")
 
                 race = lg.add_race(race_num,
                                    str(utc.astimezone(tz.gettz('America/New_York'))).split(' ')[0],
                                    ir_session["track"]["track_name"], subsession_id)
                 # Sort laps
                 lap_counts = {}
+                scored_g61_laps = []
                 for g61_lap in all_g61_laps:
 
                     driver_name = g61_lap["driver"]["firstName"] + " " + g61_lap["driver"]["lastName"]
@@ -1063,37 +1364,13 @@ class LeagueConfiguration:
                         _logger.info(f"Invalid Lap: Not a TestDrive lap. Lap from session {g61_lap['session']}")
                         _logger.info(f"\t{lap2str(g61_lap)}")
                         continue
-                    # Ensure this lap matches defined parameters
-                    if percent_difference(air_temp_c, g61_lap["airTemp"]) > 0.25:
-                        _logger.info(f"Invalid Lap: Failed Air Temp. Expected: {air_temp_c}, Lap {g61_lap['airTemp']}")
-                        _logger.info(f"\t{lap2str(g61_lap)}")
-                        continue
-                    if percent_difference(wind_m_per_s, g61_lap["windVel"]) > 0.25:
-                        _logger.info(
-                            f"Invalid Lap: Failed Wind. Expected: {wind_m_per_s}, Lap {g61_lap['airTemp']}")
-                        _logger.info(f"\t{lap2str(g61_lap)}")
-                        continue
-                    if percent_difference(rel_humidity, g61_lap["relativeHumidity"]) > 0.25:
-                        _logger.info(
-                            f"Invalid Lap: Failed Humidity. "
-                            f"Expected: {rel_humidity}, Lap {g61_lap['relativeHumidity']}")
-                        _logger.info(f"\t{lap2str(g61_lap)}")
-                        continue
-                    # Sky/Cloud values seem to be off by 1
-                    if weather["skies"]+1 != g61_lap["clouds"]:
+                    if conditions.clouds != g61_lap["clouds"]:
                         # TODO Sky mapping is weird between iR and g61... they just don't seem to match
                         _logger.info(
                             f"Invalid Lap: Failed Clouds. "
-                            f"Expected: {weather['skies']+1}, Lap {g61_lap['clouds']}")
+                            f"Expected: {conditions.clouds}, Lap {g61_lap['clouds']}")
                         _logger.info(f"\t{lap2str(g61_lap)}")
                         #continue
-                    if (weather["track_water"] == 0 and g61_lap["trackWetness"] != 0) or \
-                       (weather["track_water"] == 3 and (67 < g61_lap["trackWetness"] < 50)):
-                        _logger.info(
-                            f"Invalid Lap: Failed wetness. "
-                            f"Expected: {weather['track_water']}, Lap {g61_lap['trackWetness']}")
-                        _logger.info(f"\t{lap2str(g61_lap)}")
-                        continue
 
                     if g61_lap["joker"]:
                         _logger.info(
@@ -1102,10 +1379,7 @@ class LeagueConfiguration:
                         continue
 
                     if cust_id is None:
-                        if driver_name in g612ir:
-                            cust_id = lg.get_cust_id(g612ir[driver_name], clean_nums=True)
-                        if cust_id is None:
-                            raise ValueError(f"Cannot find g61 driver {driver_name} in league")
+                        raise ValueError(f"Cannot find g61 driver {driver_name} in league")
                     driver = lg.add_driver(cust_id)
                     member = lg.get_member(cust_id)
                     if member is None:
@@ -1126,6 +1400,7 @@ class LeagueConfiguration:
                         lap_counts[cust_id] = 0
                     lap_counts[cust_id] += 1
 
+                    scored_g61_laps.append(g61_lap)
                     result = race.add_result(cust_id)
                     result._laps_completed += 1
                     result._car = g61_lap["car"]["name"]
@@ -1135,8 +1410,7 @@ class LeagueConfiguration:
                     lap._number = lap_counts[cust_id]
                     lap._time = g61_lap["lapTime"]
                     lap._time_stamp = g61_lap["startTime"]
-                    if not g61_lap["clean"] or g61_lap["offtrack"] or g61_lap["discontinuity"] or g61_lap["joker"] or \
-                            g61_lap["incomplete"] or g61_lap["pitlane"] or g61_lap["pitIn"] or g61_lap["pitOut"]:
+                    if not is_clean_lap(g61_lap):
                         lap._clean = False
                         result._incidents += 1
                     else:
@@ -1147,6 +1421,10 @@ class LeagueConfiguration:
                             result._fastest_lap_time = lap._time
                             result._fastest_lap_time_stamp = lap._time_stamp
 
+                if telemetry_dir is not None:
+                    from core.telemetry import fastest_clean_lap_ids  # numpy, only needed for telemetry
+                    telemetry_lap_ids.extend(fastest_clean_lap_ids(scored_g61_laps).values())
+
                 # Sort and score fastest laps
                 position = 0
                 fastest_laps = []
@@ -1205,9 +1483,54 @@ class LeagueConfiguration:
                     # TODO Include races that driver did not participate in?
                     driver._average_finish = sum(positions) / len(positions)
 
+        if telemetry_dir is not None:
+            from core.telemetry import fetch_all_lap_telemetry
+            try:
+                with instrumentation.span("garage61.telemetry", laps=len(telemetry_lap_ids)):
+                    fetch_all_lap_telemetry(g61, telemetry_lap_ids, telemetry_dir)
+            except Exception as e:
+                _logger.error(f"Failed to download lap telemetry to {telemetry_dir}, run again to resume: {e}")
         return lg
 
 
+@instrumentation.timed("score.trueskill")
+def rate_drivers(lg: LeagueResult, prior: RatingStore = None):
+    """
+    Run every race of a season through TrueSkill, updating driver ratings and recording them on each result
+    :param lg: the scored season
+    :param prior: ratings (ex. of previous seasons) drivers start from
+    """
+    import trueskill  # Only needed once we score
+
+    if prior is not None:
+        for cust_id, driver in lg.drivers.items():
+            if cust_id in prior:
+                driver._mu, driver._sigma = prior.rating(cust_id)
+    ratings = list()
+    finishing_positions = list()
+    for race in lg.races.values():
+        if race.grid_size == 0:
+            continue
+        ratings.clear()
+        finishing_positions.clear()
+        for cust_id, my_driver in lg.drivers.items():
+            result = race.get_result(cust_id)
+            if result is None:  # Not in this race
+                finishing_positions.append(-1)
+            else:
+                finishing_positions.append(result.finish_position)
+            ratings.append((trueskill.Rating(my_driver._mu, my_driver._sigma),))
+        new_ratings = trueskill.rate(ratings, finishing_positions)
+        for idx, driver in enumerate(lg.drivers.values()):
+            driver._mu = new_ratings[idx][0].mu
+            driver._sigma = new_ratings[idx][0].sigma
+            result = race.get_result(driver.cust_id)
+            if result is None:
+                continue  # The rating is propagated via the driver, not the result, so I think this is OK
+            result._mu = driver._mu
+            result._sigma = driver._sigma
+
+
 def serialize_points_threshold_to_bind(src: PointsThreshold, dst: PointsThresholdData):
     dst.MinimumRequirement = src.minimum_requirement
     dst.Points = src.points
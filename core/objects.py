@@ -2,10 +2,10 @@
 # See accompanying NOTICE file for details.
 
 import argparse
+import atexit
 import json
 import logging
 import math
-import numpy as np
 import re
 import sys
 
@@ -14,9 +14,12 @@ from collections import OrderedDict
 from google.protobuf import json_format, text_format
 from pathlib import Path
 
+from core import instrumentation
+from core.profiling import Profiler, ProfileScope
 from core.objects_pb2 import EventData, LeagueResultData, LapData
 
 _logger = logging.getLogger('log')
+_digits = re.compile(r'\d+')
 
 
 def time2str(minutes: float):
@@ -27,10 +30,10 @@ def time2str(minutes: float):
 
 def percent_difference(expected: float, calculated: float, epsilon: float = 1e-10):
     # Check for 'invalid' numbers
-    if np.isnan(expected) or np.isnan(calculated) or np.isinf(expected) or np.isinf(calculated):
-        if (np.isnan(expected) and np.isnan(calculated)) or (np.isinf(expected) and np.isinf(calculated)):
+    if math.isnan(expected) or math.isnan(calculated) or math.isinf(expected) or math.isinf(calculated):
+        if (math.isnan(expected) and math.isnan(calculated)) or (math.isinf(expected) and math.isinf(calculated)):
             return 0.0
-        return np.nan
+        return math.nan
 
     # Special cases
     if expected == 0.0 and calculated == 0.0:
@@ -60,16 +63,32 @@ class Main:
                             filemode="w")
         logging.getLogger('log').setLevel(logging.INFO)
         logging.getLogger().addHandler(logging.StreamHandler(sys.stdout))
+        # Summarize where the run spent its time, with a json trace next to the log
+        self._name = Path(log_filename).stem
+        instrumentation.start(Path("./logs") / f"{self._name}.trace.json", self._name)
+        atexit.register(instrumentation.finish)
 
         parser = argparse.ArgumentParser()
         self.add_args(parser)
         self.process_args(parser.parse_args())
 
     def add_args(self, parser):
-        pass
+        parser.add_argument(
+            "-prof", "--profile",
+            action="store_true",
+            help="Profile this run, writing ./logs/<name>.pstats and a flamegraph ready ./logs/<name>.collapsed"
+        )
+        parser.add_argument(
+            "-profs", "--profile_scope",
+            default=ProfileScope.All.value,
+            choices=[s.value for s in ProfileScope],
+            help="Only profile scoring, or only fetching (requests to iRacing, Garage61 and Sheets)."
+        )
 
     def process_args(self, args):
-        pass
+        if args.profile:
+            profiler = Profiler(Path("./logs") / self._name, ProfileScope(args.profile_scope)).start()
+            atexit.register(profiler.stop)
 
 
 class GroupRules:
@@ -98,12 +117,17 @@ class PositionValue(Enum):
 
 
 class LeagueResult:
-    __slots__ = ["members", "drivers", "races"]
+    __slots__ = ["members", "drivers", "races",
+                 "_names", "_clean_names", "_aliases"]
 
     def __init__(self):
         self.members = dict()
         self.drivers = dict()
         self.races = dict()
+        # Name -> cust_id indexes, kept up to date by add_member
+        self._names = dict()
+        self._clean_names = dict()
+        self._aliases = dict()
 
     def as_dict(self):
         string = serialize_league_result_to_string(self, SerializationFormat.VERBOSE_JSON)
@@ -117,18 +141,46 @@ class LeagueResult:
     def add_member(self, cust_id: int, name: str, nickname: str = None):
         if cust_id not in self.members:
             self.members[cust_id] = Member(cust_id, name, nickname)
+            # First member added with a name wins, same as the old linear scan
+            self._names.setdefault(name, cust_id)
+            no_num = _digits.sub('', name)
+            if no_num != name:
+                self._clean_names.setdefault(no_num, cust_id)
         else:
             _logger.warning("Member " + name + " already exists.")
         return self.members[cust_id]
 
+    def add_alias(self, alias: str, name: str):
+        """
+        Map another name for a member (ex. their Garage61 name) to their iRacing name
+        :param alias: The name we will be asked for
+        :param name: The member name it resolves to
+        :return: None
+        """
+        self._aliases[alias] = name
+
+    def add_aliases(self, aliases: dict):
+        for alias, name in aliases.items():
+            self.add_alias(alias, name)
+
     def get_cust_id(self, name, clean_nums: bool = False) -> int | None:
-        for cust_id, member in self.members.items():
-            if member.name == name:
-                return cust_id
-            if clean_nums and bool(re.search(r'\d', member.name)):
-                no_num = re.sub(r'\d+', '', member.name)
-                if no_num == name:
-                    return cust_id
+        """
+        Find a member by name
+        A member named exactly name always wins over one whose name only matches without its digits,
+        even if the latter was added first, and an alias is only looked up if neither matched
+        :param clean_nums: also match members whose name, without its digits, is name (ex. "Alex Arber2")
+        :return: the member's cust_id, None if no member has that name
+        """
+        cust_id = self._lookup_name(name, clean_nums)
+        if cust_id is None and name in self._aliases:
+            cust_id = self._lookup_name(self._aliases[name], clean_nums)
+        return cust_id
+
+    def _lookup_name(self, name, clean_nums: bool) -> int | None:
+        if name in self._names:
+            return self._names[name]
+        if clean_nums and name in self._clean_names:
+            return self._clean_names[name]
         return None
 
     def get_member(self, cust_id: int):
@@ -463,7 +515,9 @@ class Race:
                  "_track",
                  "_subsession_id",
                  "stats",
-                 "grid"]
+                 "grid",
+                 "_finish_order",
+                 "_finish_key"]
 
     def __init__(self, number: int, date: str, track: str, subsession_id: int):
         self._number = number
@@ -472,6 +526,9 @@ class Race:
         self._subsession_id = subsession_id
         self.stats = dict()
         self.grid = dict()
+        # get_results, sorted when the grid or its finish positions change
+        self._finish_order = list()
+        self._finish_key = tuple()
 
     @property
     def number(self): return self._number
@@ -506,14 +563,18 @@ class Race:
         return self.grid[cust_id]
 
     def get_results(self):
-        results = []
-        for pos in range(1, len(self.grid)+1):
-            for cust_id, result in self.grid.items():
-                if result.finish_position == pos:
-                    results.append((cust_id, result))
-        if len(results) != len(self.grid):
-            _logger.error("results not the same length as the grid")
-        return results
+        """
+        :return: (cust_id, result) of every car in the race, in finish order
+        Cars with the same finish position keep their grid order, cars without one are last
+        """
+        key = tuple((cust_id, result._finish_position) for cust_id, result in self.grid.items())
+        if key != self._finish_key:
+            self._finish_key = key
+            self._finish_order = sorted(self.grid.items(),
+                                        key=lambda item: (item[1]._finish_position < 1, item[1]._finish_position))
+            if any(result._finish_position != pos for pos, (cust_id, result) in enumerate(self._finish_order, 1)):
+                _logger.error(f"Finish positions of race {self._number} are not 1 to {len(self.grid)}")
+        return list(self._finish_order)
 
 
 class Lap:
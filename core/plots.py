@@ -1,13 +1,19 @@
 # Distributed under the Apache License, Version 2.0.
 # See accompanying NOTICE file for details.
 
-import matplotlib
-import matplotlib.pyplot as plt
+import os
+
 from pathlib import Path
 
+from concurrent.futures import ProcessPoolExecutor
+
+from core import instrumentation
 from core.clients import ClientMain
-from core.event import add_lap_data
-from core.objects import serialize_league_result_from_file, LeagueResult, serialize_event_from_file, Event
+from core.event import add_lap_data, pull_event
+from core.objects import serialize_league_result_from_file, LeagueResult, Event
+
+# The widest a level of detail plot gets, every lap of a 24h race at full detail is over 140 inches
+_lod_width_in = 40.0
 
 
 def get_lap_positions(lg: LeagueResult, race: int):
@@ -30,13 +36,73 @@ def get_lap_positions(lg: LeagueResult, race: int):
     return car_positions
 
 
-def plot_position_changes(car_positions: list, to: Path, figsize=(16, 8)):
+def tick_label_width_in(text: str, fontsize) -> float:
+    """ Width of a monospace tick label, from its font metrics, so we do not need to draw a figure to measure it """
+    from matplotlib.font_manager import FontProperties
+    from matplotlib.textpath import TextToPath
+
+    width_pt, height_pt, descent_pt = TextToPath().get_text_width_height_descent(
+        text, FontProperties(family='monospace', size=fontsize), ismath=False)
+    return width_pt / 72
+
+
+def downsample_positions(car_positions: list) -> list:
+    """
+    Drop the laps in the middle of a stretch a car held its position for
+    Every lap a car's position changed on (and its first and last) is kept, so the lines drawn are the same,
+    with a fraction of the points
+    :param car_positions: (car number, [(lap, position), ...]) of each car
+    :return: car_positions, with only the laps that shape each line
+    """
+    import numpy as np
+
+    lengths = np.array([len(positions) for num, positions in car_positions], dtype=np.int64)
+    if lengths.sum() == 0:
+        return car_positions
+    # Every lap of every car, in one table
+    points = np.array([lap for num, positions in car_positions for lap in positions], dtype=np.int64)
+    ends = np.cumsum(lengths)
+    position = points[:, 1]
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:-1] = (position[1:-1] != position[:-2]) | (position[1:-1] != position[2:])
+    # The first and last lap of each car
+    keep[(ends - lengths)[lengths > 0]] = True
+    keep[ends[lengths > 0] - 1] = True
+    car_points = np.split(points, ends[:-1])
+    car_keep = np.split(keep, ends[:-1])
+    return [(num, [(int(lap), int(pos)) for lap, pos in car_points[i][car_keep[i]]])
+            for i, (num, positions) in enumerate(car_positions)]
+
+
+@instrumentation.timed("plots.position_changes")
+def plot_position_changes(car_positions: list, to: Path, figsize=(16, 8), lod: bool = False):
+    """
+    :param to: the image to write, .png or .svg
+    :param lod: level of detail, draw only the laps where positions change in a figure no wider than _lod_width_in,
+                labelling only as many laps as fit
+    """
+    import matplotlib  # Only plotting needs it, and it is slow to import
+
+    with matplotlib.rc_context({'font.family': 'monospace'}):
+        return _draw_position_changes(car_positions, to, figsize, lod)
+
 
-    matplotlib.rcParams['font.family'] = 'monospace'
-    fig, ax = plt.subplots(figsize=figsize)
+def _draw_position_changes(car_positions: list, to: Path, figsize, lod: bool):
+    import matplotlib
+    from matplotlib.figure import Figure  # Renders with Agg, without pyplot's global state, so it is safe in any process
+    from matplotlib.ticker import MaxNLocator
 
-    # Add lines to our plt
-    max_laps = -1
+    # Find the most number of laps a car ran (i.e. the highest position car)
+    max_laps = max([len(t[1]) for t in car_positions if len(t[0]) != 0], default=-1)
+    # Make the figure wide enough for every lap's tick label, and a margin
+    m = 5  # inch margin (orig = 0.2)
+    label_width_in = tick_label_width_in(str(max(max_laps - 1, 0)), matplotlib.rcParams['xtick.labelsize'])
+    width_in = label_width_in * max_laps + 2 * m
+    if lod:
+        car_positions = downsample_positions(car_positions)
+        width_in = min(width_in, _lod_width_in)
+    fig = Figure(figsize=(width_in, figsize[1]))
+    ax = fig.subplots()
 
     # Create y-axis labels
     # The left side is the starting position and car number
@@ -80,11 +146,6 @@ def plot_position_changes(car_positions: list, to: Path, figsize=(16, 8)):
             # Add a line for this car to the plot
             ax.plot([item[0] for item in t[1]], [item[1] for item in t[1]])
 
-            # Find the most number of laps a car ran (i.e. the highest position car)
-            num_laps = len(t[1])
-            if num_laps > max_laps:
-                max_laps = num_laps
-
     for t in car_positions:
         num = t[0]
         if len(num) != 0:
@@ -103,33 +164,29 @@ def plot_position_changes(car_positions: list, to: Path, figsize=(16, 8)):
     ax.set_yticks(list(range(1, field_size+1)), left_y_labels)
     fin_ax = ax.secondary_yaxis('right')
     fin_ax.set_yticks(list(range(1, field_size + 1)), right_y_labels)
-    ax.set_xticks(list(range(0, max_laps)))
+    if lod:
+        # Leave a label's width between labels
+        ax.xaxis.set_major_locator(MaxNLocator(nbins=max(1, int((width_in - 2 * m) / (2 * label_width_in))),
+                                               integer=True))
+        ax.set_xlim(0, max(max_laps - 1, 1))
+    else:
+        ax.set_xticks(list(range(0, max_laps)))
     ax.set_xlabel('Lap')
     ax.set_ylabel('Position')
-    ax.legend().set_visible(False)
 
-    plt.xticks(range(max_laps))  # add loads of ticks
-    plt.gca().margins(x=0)
-    plt.gcf().canvas.draw()
-    tl = plt.gca().get_xticklabels()
-    maxsize = max([t.get_window_extent().width for t in tl])
-    m = 5  # inch margin (orig = 0.2)
-    s = maxsize / plt.gcf().dpi * max_laps + 2 * m
-    margin = m / plt.gcf().get_size_inches()[0]
-    plt.gcf().subplots_adjust(left=float(margin), right=float(1. - margin))
-    plt.gcf().set_size_inches(s, float(plt.gcf().get_size_inches()[1]))
+    ax.margins(x=0)
+    margin = m / width_in
+    fig.subplots_adjust(left=float(margin), right=float(1. - margin))
 
     # plt.grid()
-    plt.tight_layout()
+    fig.tight_layout()
     print(f"Writing image file {to}")
     fig.savefig(to)
+    return to
 
-    plt.close('all')
-    plt.clf()
-
-
-def plot_event_split(event: Event, split: int, category: str):
 
+def get_event_split_positions(event: Event, split: int, category: str):
+    """ Lap positions of every car in a split, only cars of the category are numbered (and drawn) """
     result = event.get_result(split)
     car_positions = []
     for team_id, category_team in result._teams.items():
@@ -148,14 +205,41 @@ def plot_event_split(event: Event, split: int, category: str):
             lap_positions.append((lap_positions[-1][0], category_team.finish_position))
         if started:
             car_positions.append((num, lap_positions))
-    img_filename = Path("./events") / f"{event.year}_{event.name}_Split_{split}_{category}.png"
-    plot_position_changes(sorted(car_positions, key=lambda x: x[1][0]), img_filename, figsize=(144.0, 8.0))
+    return sorted(car_positions, key=lambda x: x[1][0])
+
+
+def _event_split_filename(event: Event, split: int, category: str, suffix: str) -> Path:
+    return Path("./events") / f"{event.year}_{event.name}_Split_{split}_{category}{suffix}"
+
+
+def plot_event_split(event: Event, split: int, category: str, lod: bool = False, suffix: str = ".png"):
+    car_positions = get_event_split_positions(event, split, category)
+    return plot_position_changes(car_positions, _event_split_filename(event, split, category, suffix),
+                                 figsize=(144.0, 8.0), lod=lod)
+
+
+def plot_event_splits(event: Event, splits: list[tuple[int, str]], max_workers: int = None,
+                      lod: bool = False, suffix: str = ".png") -> list[Path]:
     """
-        else:
-            del event._results[split +1]
-    with open(f"./events/Ed Petit Le Mans.json", 'w') as fp:
-        json.dump(event.as_dict(), fp, indent=2)
+    Plot many splits of an event, in parallel processes
+    The lap positions of every split are gathered first, so processes are only sent what they draw
+    :param splits: (split, category) to plot, splits must have their lap data (see add_lap_data)
+    :param max_workers: number of processes, default is one per core (and no more than there are plots)
+    :param lod: plot with less detail (see plot_position_changes), ex. for endurance events
+    :param suffix: image format, .png or .svg
+    :return: the images written
     """
+    with instrumentation.span("plots.prepare"):
+        plots = [(get_event_split_positions(event, split, category),
+                  _event_split_filename(event, split, category, suffix)) for split, category in splits]
+    if max_workers is None:
+        max_workers = min(len(plots), os.cpu_count() or 1)
+    if max_workers <= 1:
+        return [plot_position_changes(car_positions, to, (144.0, 8.0), lod) for car_positions, to in plots]
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(plot_position_changes, car_positions, to, (144.0, 8.0), lod)
+                   for car_positions, to in plots]
+        return [future.result() for future in futures]
 
 
 def plot_league_race(league_filename: Path, race: int):
@@ -170,13 +254,14 @@ def main():
 
     # plot_league_race(Path("./results/American Muscle Series Season 10.json"), 2)
 
-    event = serialize_event_from_file(Path("./events/2026_Daytona 24.json"))
+    event = pull_event(client.idc, "Daytona 24", 2026, detailed_team=True)
+    splits = []
     for split, result in event._results.items():
-        owner_teams = result.get_owner_teams(cust_id=180474)
-        if len(owner_teams) > 0:
-            for team in owner_teams:
-                add_lap_data(client.idc, event, [split])
-                plot_event_split(event, split, team.category)
+        for team in result.get_owner_teams(cust_id=180474):
+            if (split, team.category) not in splits:
+                splits.append((split, team.category))
+    add_lap_data(client.idc, event, sorted({split for split, category in splits}))
+    plot_event_splits(event, splits, lod=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,141 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+import cProfile
+import logging
+import pstats
+import sys
+import threading
+
+from enum import Enum
+from pathlib import Path
+
+from core import instrumentation
+
+_logger = logging.getLogger('log')
+
+
+class ProfileScope(Enum):
+    All = "all"
+    Scoring = "scoring"  # In a score span, but not while fetching
+    Fetching = "fetching"  # Waiting on, and parsing, iRacing/Garage61/Sheets requests
+
+
+def in_scope(scope: ProfileScope, spans: list[str]) -> bool:
+    """ Is a thread in the given open spans (see core.instrumentation.open_spans) in scope """
+    if scope == ProfileScope.All:
+        return True
+    fetching = any(s.startswith("fetch.") for s in spans)
+    if scope == ProfileScope.Fetching:
+        return fetching
+    return not fetching and any(s == "score" or s.startswith("score.") for s in spans)
+
+
+class Profiler:
+    """
+    Profiles a run with cProfile (deterministic, the thread that started it) and a stack sampler (all threads)
+    Writes <basename>.pstats, for pstats/snakeviz, and <basename>.collapsed, collapsed stacks in the
+    same format py-spy writes, for flamegraph.pl/speedscope/inferno
+    Scopes other than All follow core.instrumentation spans, so only code run within those spans is profiled
+    """
+    __slots__ = ["_basename", "_scope", "_interval_s", "_profile", "_thread_id",
+                 "_samples", "_sampler", "_stop", "_profiling"]
+
+    def __init__(self, basename: Path, scope: ProfileScope = ProfileScope.All, interval_s: float = 0.005):
+        """
+        :param basename: output files are this with .pstats and .collapsed suffixes
+        :param scope: what part of the run to profile
+        :param interval_s: time between stack samples
+        """
+        self._basename = basename
+        self._scope = scope
+        self._interval_s = interval_s
+        self._profile = cProfile.Profile()
+        self._thread_id = None
+        self._samples = dict()  # collapsed stack -> count
+        self._sampler = None
+        self._stop = threading.Event()
+        self._profiling = False
+
+    @property
+    def pstats_filename(self) -> Path: return self._basename.with_suffix(".pstats")
+
+    @property
+    def collapsed_filename(self) -> Path: return self._basename.with_suffix(".collapsed")
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        if self._scope == ProfileScope.All:
+            self._enable(True)
+        else:
+            instrumentation.add_listener(self._on_spans)
+        self._sampler = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self._sampler.start()
+        return self
+
+    def stop(self):
+        if self._sampler is None:
+            return
+        if self._scope != ProfileScope.All:
+            instrumentation.remove_listener(self._on_spans)
+        self._enable(False)
+        self._stop.set()
+        self._sampler.join()
+        self._sampler = None
+        self.write()
+
+    def write(self):
+        self._basename.parent.mkdir(exist_ok=True, parents=True)
+        if self._profile.getstats():
+            pstats.Stats(self._profile).dump_stats(self.pstats_filename)
+        else:
+            _logger.warning(f"Nothing was profiled in the {self._scope.value} scope")
+        with open(self.collapsed_filename, 'w', encoding="utf-8") as fp:
+            for stack, n in sorted(self._samples.items()):
+                fp.write(f"{stack} {n}\n")
+        _logger.info(f"Profile written to {self.pstats_filename} and {self.collapsed_filename}")
+
+    def _enable(self, enable: bool):
+        if enable == self._profiling:
+            return
+        self._profiling = enable
+        if enable:
+            self._profile.enable()
+        else:
+            self._profile.disable()
+
+    def _on_spans(self, stack: list):
+        # cProfile only profiles the thread that enabled it
+        if threading.get_ident() == self._thread_id:
+            self._enable(in_scope(self._scope, [s["name"] for s in stack]))
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self._interval_s):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if self._scope != ProfileScope.All and \
+                        not in_scope(self._scope, instrumentation.open_spans(thread_id)):
+                    continue
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                    frame = frame.f_back
+                frames.append(names.get(thread_id, str(thread_id)))
+                stack = ";".join(reversed(frames))
+                self._samples[stack] = self._samples.get(stack, 0) + 1
+
+
+def main():
+    """ Print the top of a pstats file """
+    for filename in sys.argv[1:]:
+        pstats.Stats(filename).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(40)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+import json
+import logging
+import numpy as np
+import os
+import time
+
+from pathlib import Path
+
+from concurrent.futures import ProcessPoolExecutor
+from google.protobuf import json_format
+
+from core import instrumentation
+from core.objects import LeagueResult, serialize_league_result_data_from_bind
+from core.objects_pb2 import LeagueResultData
+
+_logger = logging.getLogger('log')
+
+# TrueSkill's default rating
+_default_mu = 25.0
+_default_sigma = 25.0 / 3
+
+
+def rating_store_filename(name: str, ratings_dir: Path = Path("./ratings")) -> Path:
+    """ Where the RatingStore of a league is kept, next to its rating tables, by score_league and rebuild_league """
+    return ratings_dir / name / f"{name} Ratings.npz"
+
+
+def season_start(lg: LeagueResult) -> str | None:
+    """ :return: the date of the first race of a season, None if it has no races """
+    return min((race.date for race in lg.races.values()), default=None)
+
+
+def season_stamp(season_filename: Path) -> str:
+    """ Changes whenever a season file is written """
+    stat = season_filename.stat()
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class SeasonLoader:
+    """
+    Loads seasons written by score_league, by default without their laps (which ratings do not need)
+    A season is only read the first time it is asked for, then kept for anything else that asks for it
+    """
+    __slots__ = ["_laps", "_seasons"]
+
+    def __init__(self, laps: bool = False):
+        """
+        :param laps: load the laps of each result too
+        """
+        self._laps = laps
+        self._seasons = dict()  # filename -> (stamp, season)
+
+    def load(self, season_filename: Path) -> LeagueResult:
+        stamp = season_stamp(season_filename)
+        key = str(season_filename)
+        hit = key in self._seasons and self._seasons[key][0] == stamp
+        instrumentation.cache("ratings.seasons", hit)
+        if not hit:
+            with open(season_filename, 'r', encoding="utf-8") as fp:
+                src = json.load(fp)
+            if not self._laps:
+                for race in src.get("Races", {}).values():
+                    for result in race.get("Grid", {}).values():
+                        result.pop("Laps", None)
+            data = LeagueResultData()
+            json_format.ParseDict(src, data)
+            lg = LeagueResult()
+            serialize_league_result_data_from_bind(data, lg)
+            self._seasons[key] = (stamp, lg)
+        return self._seasons[key][1]
+
+
+# Shared by everything that loads seasons in this process
+_loader = SeasonLoader()
+
+
+def load_season(season_filename: Path) -> LeagueResult:
+    """ Load a season written by score_league, without laps """
+    return _loader.load(season_filename)
+
+
+class RatingStore:
+    """
+    TrueSkill ratings of a league's drivers across seasons
+    The mu and sigma of every driver after every race they ran is kept, in order, in one compressed columnar (npz) file
+    Adding a season only rates the races that are not in the store yet, so a running season can be added after
+    every race, and rating tables are views over the latest rating of each driver
+    """
+    __slots__ = ["_filename", "_seasons", "_names", "_rows", "_rated", "_current", "_starts"]
+
+    def __init__(self, filename: Path = None):
+        """
+        :param filename: where the store is kept, it is loaded if it exists
+        """
+        self._filename = filename
+        # {"name", "start": date of its first race, "drivers": [cust_id], "stamp": of its file}, in the order added
+        self._seasons = list()
+        self._names = dict()  # cust_id -> name
+        self._rows = list()  # (season index, race number, cust_id, mu, sigma), in the order they were rated
+        self._rated = set()  # (season index, race number)
+        self._current = dict()  # cust_id -> (mu, sigma)
+        self._starts = dict()  # cust_id -> number of races rated
+        if filename is not None and filename.exists():
+            self._load()
+
+    def __contains__(self, cust_id: int):
+        return cust_id in self._current
+
+    @property
+    def seasons(self) -> list[str]: return [season["name"] for season in self._seasons]
+
+    @property
+    def num_rows(self) -> int: return len(self._rows)
+
+    def _load(self):
+        with np.load(self._filename) as npz:
+            meta = json.loads(str(npz["meta"]))
+            columns = [npz["season"].tolist(), npz["race"].tolist(), npz["cust_id"].tolist(),
+                       npz["mu"].tolist(), npz["sigma"].tolist()]
+        self._seasons = meta["seasons"]
+        self._names = {int(cust_id): name for cust_id, name in meta["names"].items()}
+        for row in zip(*columns):
+            self._append(*row)
+        _logger.info(f"Loaded {len(self._rows)} ratings over {len(self._seasons)} seasons from {self._filename}")
+
+    def save(self, filename: Path = None):
+        filename = filename or self._filename
+        filename.parent.mkdir(exist_ok=True, parents=True)
+        meta = {"seasons": self._seasons, "names": self._names}
+        columns = list(zip(*self._rows)) if self._rows else [[]] * 5
+        # Write to a temporary file first, so an interrupted run never leaves a partial store behind
+        tmp_filename = filename.with_suffix(".tmp.npz")
+        with open(tmp_filename, 'wb') as fp:
+            np.savez_compressed(fp,
+                                meta=np.array(json.dumps(meta, ensure_ascii=False)),
+                                season=np.array(columns[0], dtype=np.int32),
+                                race=np.array(columns[1], dtype=np.int32),
+                                cust_id=np.array(columns[2], dtype=np.int64),
+                                mu=np.array(columns[3], dtype=np.float64),
+                                sigma=np.array(columns[4], dtype=np.float64))
+        os.replace(tmp_filename, filename)
+
+    def _append(self, season: int, race: int, cust_id: int, mu: float, sigma: float):
+        self._rows.append((season, race, cust_id, mu, sigma))
+        self._rated.add((season, race))
+        self._current[cust_id] = (mu, sigma)
+        self._starts[cust_id] = self._starts.get(cust_id, 0) + 1
+
+    def rating(self, cust_id: int) -> tuple[float, float]:
+        """ :return: the latest (mu, sigma) of a driver, the default rating if they have not raced """
+        return self._current.get(cust_id, (_default_mu, _default_sigma))
+
+    def history(self, cust_id: int) -> list[tuple]:
+        """ :return: (season name, race number, mu, sigma) after each race a driver ran """
+        return [(self._seasons[s]["name"], race, mu, sigma) for s, race, c, mu, sigma in self._rows if c == cust_id]
+
+    def before(self, name: str, start: str = None) -> "RatingStore":
+        """
+        The ratings drivers had before a season (ex. to score it from)
+        :param name: the season, if it is in this store, only the seasons added before it are kept
+        :param start: date of the first race of the season, if it is not in this store,
+                      only the seasons that started before it are kept (seasons that do not know their start are too)
+        :return: a store of the seasons before the season
+        """
+        index = next((i for i, season in enumerate(self._seasons) if season["name"] == name), None)
+        if index is not None:
+            keep = set(range(index))
+        else:
+            keep = {i for i, season in enumerate(self._seasons)
+                    if start is None or season.get("start") is None or season["start"] < start}
+        store = RatingStore()
+        store._names = self._names
+        remap = dict()
+        for i, season in enumerate(self._seasons):
+            if i in keep:
+                remap[i] = len(store._seasons)
+                store._seasons.append(season)
+        for row in self._rows:
+            if row[0] in keep:
+                store._append(remap[row[0]], *row[1:])
+        return store
+
+    def add_season_file(self, season_filename: Path, loader: SeasonLoader = None) -> int:
+        """
+        Add a season written by score_league, named by its file, only reading it if it changed since it was added
+        :return: the number of races rated
+        """
+        name = season_filename.stem
+        stamp = season_stamp(season_filename)
+        season = next((season for season in self._seasons if season["name"] == name), None)
+        if season is not None and season.get("stamp") == stamp:
+            return 0
+        num_rated = self.add_season(name, (loader or _loader).load(season_filename))
+        for season in self._seasons:
+            if season["name"] == name:
+                season["stamp"] = stamp
+        return num_rated
+
+    def season_drivers(self, name: str) -> set:
+        for season in self._seasons:
+            if season["name"] == name:
+                return set(season["drivers"])
+        return set()
+
+    @instrumentation.timed("ratings.add_season")
+    def add_season(self, name: str, lg: LeagueResult) -> int:
+        """
+        Rate the races of a season that are not in the store yet
+        Every driver in a race is rated against the others in finish order
+        :param name: the name of the season, adding a season with the same name again only rates its new races
+        :param lg: the scored season
+        :return: the number of races rated
+        """
+        import trueskill  # Only needed once we rate
+
+        index = next((i for i, season in enumerate(self._seasons) if season["name"] == name), None)
+        if index is None:
+            index = len(self._seasons)
+            self._seasons.append({"name": name, "start": season_start(lg), "drivers": []})
+        elif index != len(self._seasons) - 1 and any((index, number) not in self._rated for number in lg.races):
+            _logger.error(f"{name} has new races, but seasons have been added after it, rebuild the store to rate them")
+            return 0
+
+        self._seasons[index]["start"] = season_start(lg)
+        for cust_id, driver in lg.drivers.items():
+            self._names[cust_id] = driver.name
+        drivers = set(self._seasons[index]["drivers"]) | set(lg.drivers.keys())
+        self._seasons[index]["drivers"] = sorted(drivers)
+
+        num_rated = 0
+        for number in sorted(lg.races.keys()):
+            race = lg.races[number]
+            if (index, number) in self._rated or race.grid_size == 0:
+                continue
+            results = race.get_results()
+            ratings = [(trueskill.Rating(*self.rating(cust_id)),) for cust_id, result in results]
+            new_ratings = trueskill.rate(ratings)
+            for (cust_id, result), (new_rating,) in zip(results, new_ratings):
+                self._append(index, number, cust_id, new_rating.mu, new_rating.sigma)
+            num_rated += 1
+        _logger.info(f"Rated {num_rated} races of {name}")
+        return num_rated
+
+    def table(self, cust_ids: set = None, sigma_threshold: float = None) -> list[dict]:
+        """
+        The latest rating of drivers, best (mu - 3 sigma) first
+        :param cust_ids: only these drivers (ex. season_drivers of the current season), ranked by mu in season_rank
+        :param sigma_threshold: only drivers whose sigma is no more than this (ex. a trimmed table of regulars)
+        :return: {"name", "league_rank", "season_rank", "rating", "mu", "sigma", "starts"} for each driver
+        """
+        rows = []
+        for cust_id, (mu, sigma) in self._current.items():
+            rows.append({"cust_id": cust_id,
+                         "name": self._names.get(cust_id, str(cust_id)),
+                         "league_rank": None,
+                         "season_rank": None,
+                         "rating": mu - 3 * sigma,
+                         "mu": mu,
+                         "sigma": sigma,
+                         "starts": self._starts[cust_id]})
+        rows.sort(key=lambda row: row["rating"], reverse=True)
+        for rank, row in enumerate(rows, 1):
+            row["league_rank"] = rank
+
+        if cust_ids is not None:
+            rows = [row for row in rows if row["cust_id"] in cust_ids]
+            for rank, row in enumerate(sorted(rows, key=lambda r: r["mu"], reverse=True), 1):
+                row["season_rank"] = rank
+        if sigma_threshold is not None:
+            rows = [row for row in rows if row["sigma"] <= sigma_threshold]
+        return rows
+
+
+def write_ratings_table(table: list[dict], filename: Path):
+    """ Write a RatingStore table as text (.txt) or json (.json) """
+    filename.parent.mkdir(exist_ok=True, parents=True)
+    if filename.suffix == ".txt":
+        with open(filename, 'w', encoding='utf-8') as fp:
+            for idx, r in enumerate(table):
+                fp.write(f"{idx+1}. {r['name']} ({r['league_rank']}) {r['rating']} ({r['mu']} {r['sigma']}) "
+                         f"{r['starts']} starts\n")
+    elif filename.suffix == ".json":
+        with open(filename, 'w', encoding='utf-8') as fp:
+            json.dump(table, fp, indent=2)
+
+
+def rebuild_league(name: str, season_filenames: list[Path], ratings_dir: Path = Path("./ratings"),
+                   current_season_filename: Path = None) -> dict:
+    """
+    Bring the rating store of a league up to date with its seasons, and write its rating tables
+    :param name: the league (the name of its configurations), names the store and tables
+    :param season_filenames: seasons of the league, in the order they were run
+    :param ratings_dir: the store and tables are kept in ratings_dir/name/, see rating_store_filename
+    :param current_season_filename: the drivers of this season are in the current ratings table, default is the last
+    :return: {"name", "races": number rated, "drivers", "seconds"}
+    """
+    start = time.perf_counter()
+    filename = rating_store_filename(name, ratings_dir)
+    dst = filename.parent
+    store = RatingStore(filename)
+    num_rated = 0
+    for season_filename in season_filenames:
+        num_rated += store.add_season_file(season_filename)
+    store.save()
+
+    write_ratings_table(store.table(), dst / f"{name} League Ratings.txt")
+    write_ratings_table(store.table(), dst / f"{name} League Ratings.json")
+    write_ratings_table(store.table(sigma_threshold=2.0), dst / f"{name} Trimmed League Ratings.txt")
+    if current_season_filename is None:
+        current_drivers = store.season_drivers(season_filenames[-1].stem)
+    else:
+        current_drivers = set(load_season(current_season_filename).drivers.keys())
+    write_ratings_table(store.table(cust_ids=current_drivers), dst / f"{name} Current Ratings.txt")
+    return {"name": name, "races": num_rated, "drivers": len(store.table()), "seconds": time.perf_counter() - start}
+
+
+def rebuild_leagues(leagues: list[dict], max_workers: int = None) -> list[dict]:
+    """
+    Rebuild the ratings of leagues, which are independent of each other, in parallel processes
+    :param leagues: rebuild_league keyword arguments of each league
+    :param max_workers: number of processes, default is one per core (and no more than there are leagues)
+    :return: what rebuild_league returned for each league
+    """
+    if max_workers is None:
+        max_workers = min(len(leagues), os.cpu_count() or 1)
+    if max_workers <= 1:
+        return [rebuild_league(**league) for league in leagues]
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(rebuild_league, **league) for league in leagues]
+        return [future.result() for future in futures]
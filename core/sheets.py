@@ -2,7 +2,6 @@
 # See accompanying NOTICE file for details.
 
 
-import gspread
 import logging
 
 from abc import abstractmethod
@@ -10,6 +9,7 @@ from enum import Enum
 from operator import itemgetter
 from pathlib import Path
 
+from core import instrumentation
 from core.objects import Driver, LeagueResult
 
 _logger = logging.getLogger('log')
@@ -53,6 +53,8 @@ class GDrive:
                  "_driver_key", "_drivers_xls", "_driver_sheets"]
 
     def __init__(self, credentials: dict):
+        import gspread  # Only needed when we push to a sheet
+
         self._gc = None
         self._results_key = None
         self._results_xls = None
@@ -65,6 +67,7 @@ class GDrive:
         # self._gc = gspread.oauth(
         #     credentials_filename=credentials_filename)
         self._gc = gspread.service_account_from_dict(credentials)
+        instrumentation.instrument_session(self._gc.http_client.session, "sheets")
 
     @staticmethod
     def push_results_to_sheets(lg: LeagueResult, groups: list[str],
@@ -0,0 +1,281 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+from iracingdataapi.client import irDataClient
+
+_logger = logging.getLogger('log')
+
+# The endpoints we serve, and the query parameters that identify a response
+_endpoints = {
+    "/data/league/get": ["league_id"],
+    "/data/league/seasons": ["league_id"],
+    "/data/league/season_sessions": ["league_id", "season_id"],
+    "/data/results/get": ["subsession_id"],
+    "/data/results/lap_chart_data": ["subsession_id", "simsession_number"],
+    "/data/results/season_results": ["season_id"],
+    "/data/series/stats_series": [],
+    "/data/team/get": ["team_id"],
+    "/data/member/get": ["cust_ids"],
+    "/data/member/profile": ["cust_id"],
+}
+# Responses for these endpoints are served as chunks, like the real API does
+_chunked_endpoints = ["/data/results/lap_chart_data"]
+
+
+def response_name(endpoint: str, params: dict) -> str:
+    """
+    The name identifying a response to an endpoint, from the parameters that matter to it
+    ex. simsession_number=0&subsession_id=123
+    """
+    keys = _endpoints[endpoint]
+    name = "&".join(f"{k}={params[k]}" for k in sorted(keys) if k in params)
+    return name if name else "_"
+
+
+def response_filename(data_dir: Path, endpoint: str, params: dict) -> Path:
+    """
+    Where a recorded response for an endpoint lives in a stand-in data directory
+    ex. <data_dir>/results/lap_chart_data/simsession_number=0&subsession_id=123.json
+    """
+    return data_dir / endpoint.removeprefix("/data/") / f"{response_name(endpoint, params)}.json"
+
+
+def save_response(data_dir: Path, endpoint: str, params: dict, data) -> Path:
+    """
+    Write a response the stand-in server will serve for this endpoint and these parameters
+    For chunked endpoints (lap charts), data is the full list of rows the client returns
+    """
+    filename = response_filename(data_dir, endpoint, params)
+    filename.parent.mkdir(exist_ok=True, parents=True)
+    with open(filename, 'w', encoding="utf-8") as fp:
+        json.dump(data, fp, ensure_ascii=False)
+    return filename
+
+
+class RecordingDataClient(irDataClient):
+    """
+    An irDataClient that also saves every stand-in supported response it receives,
+    so a real run can be replayed later against the stand-in server
+    """
+
+    def __init__(self, data_dir: Path, **kwargs):
+        super().__init__(**kwargs)
+        self._data_dir = data_dir
+
+    def _get_resource(self, endpoint: str, payload: dict = None):
+        data = super()._get_resource(endpoint, payload=payload)
+        if endpoint in _endpoints and endpoint not in _chunked_endpoints:
+            save_response(self._data_dir, endpoint, payload or {}, data)
+        return data
+
+    def result_lap_chart_data(self, subsession_id: int, simsession_number: int = 0):
+        data = super().result_lap_chart_data(subsession_id, simsession_number)
+        save_response(self._data_dir, "/data/results/lap_chart_data",
+                      {"subsession_id": subsession_id, "simsession_number": simsession_number}, data)
+        return data
+
+
+class DataApiStandIn:
+    """
+    A local HTTP server that answers like the iRacing Data API, from recorded or synthetic responses.
+    Every data request answers with a link, which is fetched in a second hop, and lap charts are
+    served as chunks, just like the real API.
+    Point a ClientMain at it with --ir_base_url (see url)
+    """
+
+    def __init__(self, data_dir: Path,
+                 host: str = "127.0.0.1",
+                 port: int = 0,
+                 latency_s: float = 0.0,
+                 rate_limit_probability: float = 0.0,
+                 rate_limit_reset_s: int = 1,
+                 chunk_size: int = 500,
+                 access_token: str = None,
+                 seed: int = None):
+        """
+        :param data_dir: directory of responses written by save_response
+        :param host: interface to listen on
+        :param port: port to listen on, 0 picks a free port
+        :param latency_s: delay added to every request (both hops)
+        :param rate_limit_probability: chance [0, 1] a data request is answered with a 429
+        :param rate_limit_reset_s: how far in the future x-ratelimit-reset is set for a 429
+        :param chunk_size: number of rows in each chunk of a chunked response
+        :param access_token: data requests without this bearer token are answered with a 401, None accepts any
+        :param seed: seed for the 429 injection
+        """
+        self._data_dir = data_dir
+        self._latency_s = latency_s
+        self._rate_limit_probability = rate_limit_probability
+        self._rate_limit_reset_s = rate_limit_reset_s
+        self._chunk_size = chunk_size
+        self._access_token = access_token
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._links = {}  # link token -> payload bytes
+        self._counts = {}  # endpoint -> number of requests
+        self._num_rate_limited = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def counts(self) -> dict: return dict(self._counts)
+
+    @property
+    def num_rate_limited(self) -> int: return self._num_rate_limited
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        _logger.info(f"iRacing Data API stand-in serving {self._data_dir} at {self.url}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _add_link(self, payload: bytes) -> str:
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._links[token] = payload
+        return f"{self.url}/link/{token}"
+
+    def _rate_limited(self) -> bool:
+        with self._lock:
+            if self._rate_limit_probability > 0 and self._random.random() < self._rate_limit_probability:
+                self._num_rate_limited += 1
+                return True
+        return False
+
+    def _count(self, endpoint: str):
+        with self._lock:
+            self._counts[endpoint] = self._counts.get(endpoint, 0) + 1
+
+    def _resource(self, endpoint: str, params: dict) -> bytes | None:
+        filename = response_filename(self._data_dir, endpoint, params)
+        if not filename.exists():
+            return None
+        with open(filename, 'rb') as fp:
+            content = fp.read()
+        if endpoint not in _chunked_endpoints:
+            return json.dumps({"link": self._add_link(content)}).encode("utf-8")
+
+        rows = json.loads(content)
+        chunk_names = []
+        base_url = f"{self.url}/link/"
+        for start in range(0, len(rows), self._chunk_size):
+            link = self._add_link(json.dumps(rows[start:start + self._chunk_size]).encode("utf-8"))
+            chunk_names.append(link.removeprefix(base_url))
+        chunk_info = {"base_download_url": base_url, "chunk_file_names": chunk_names} if chunk_names else None
+        data = {"success": True, "chunk_info": chunk_info}
+        return json.dumps({"link": self._add_link(json.dumps(data).encode("utf-8"))}).encode("utf-8")
+
+    def _handler_class(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def _send(self, status: int, body: bytes = b"", headers: dict = None):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if standin._latency_s > 0:
+                    time.sleep(standin._latency_s)
+                url = urlparse(self.path)
+                # Like iRacing, the links (S3) it hands out do not need our token
+                if url.path.startswith("/data/") and standin._access_token is not None and \
+                        self.headers.get("Authorization") != f"Bearer {standin._access_token}":
+                    self._send(401, b'{"error": "Unauthorized"}')
+                    return
+                # Like iRacing, only the API itself rate limits, not the links (S3) it hands out
+                if url.path.startswith("/data/") and standin._rate_limited():
+                    reset = int(time.time()) + standin._rate_limit_reset_s
+                    self._send(429, b"{}", {"x-ratelimit-limit": "240",
+                                            "x-ratelimit-remaining": "0",
+                                            "x-ratelimit-reset": str(reset)})
+                    return
+
+                if url.path.startswith("/link/"):
+                    with standin._lock:
+                        body = standin._links.get(url.path.removeprefix("/link/"))
+                    if body is None:
+                        self._send(404)
+                    else:
+                        self._send(200, body)
+                    return
+
+                if url.path not in _endpoints:
+                    self._send(404)
+                    return
+                standin._count(url.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                body = standin._resource(url.path, params)
+                if body is None:
+                    _logger.warning(f"Stand-in has no response for {url.path} {params}")
+                    self._send(404)
+                else:
+                    self._send(200, body)
+
+            def log_message(self, fmt, *args):
+                pass  # Keep the request log out of our console
+
+        return Handler
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser(description="Serve recorded/synthetic iRacing Data API responses")
+    parser.add_argument("-d", "--data", default=Path("./standin"), type=Path,
+                        help="Directory of recorded responses.")
+    parser.add_argument("-p", "--port", default=8061, type=int, help="Port to serve on.")
+    parser.add_argument("-l", "--latency", default=0.0, type=float, help="Seconds of latency added to each request.")
+    parser.add_argument("-rl", "--rate_limit", default=0.0, type=float,
+                        help="Probability [0, 1] of answering a request with a 429.")
+    parser.add_argument("-s", "--seed", default=None, type=int, help="Seed for 429 injection.")
+    opts = parser.parse_args()
+
+    standin = DataApiStandIn(opts.data, port=opts.port, latency_s=opts.latency,
+                             rate_limit_probability=opts.rate_limit, seed=opts.seed)
+    standin.start()
+    print(f"Serving at {standin.url}, run with --ir_base_url {standin.url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        standin.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+import csv
+import json
+import os
+import re
+
+from enum import Enum
+from pathlib import Path
+
+from core.objects import Driver, LeagueResult
+
+# Numbers people put in their names (ex. John Smith2)
+_name_numbers = re.compile(r"\d+")
+
+_broadcast_headers = [
+    "First name", "Last name", "Suffix", "Multicar team name", "Club name", "iRacing ID", "Car number",
+    "Multicar team background color", "iRacing car color", "iRacing car number color", "iRacing car number color 2",
+    "iRacing car number color 3", "iRacing car number font ID", "iRacing car number style",
+    "Points before weekend", "Points earned", "Bonus points", "Points after weekend"
+]
+
+
+class StandingsFormat(Enum):
+    CSV = "csv"  # iRacing broadcast standings
+    JSON = "json"  # For overlays
+
+
+def split_name(name: str) -> tuple[str, str]:
+    """ First and last name, without any numbers """
+    names = _name_numbers.sub("", name).split()
+    if not names:
+        return "", ""
+    return names[0], names[-1]
+
+
+def group_standings(lg: LeagueResult, group: str):
+    """
+    :return: (position, driver) of every driver in a group, by points after drops
+    """
+    drivers = [driver for driver in lg.drivers.values() if driver.group == group]
+    drivers.sort(key=lambda driver: driver.earned_points - driver.drop_points, reverse=True)
+    return enumerate(drivers, 1)
+
+
+def _broadcast_row(driver: Driver) -> list:
+    first_name, last_name = split_name(driver.name)
+    points = driver.earned_points - driver.drop_points
+    return [first_name, last_name, "", "", "", driver.cust_id, driver.car_number,
+            "Transparent", "Transparent", "Transparent", "Transparent", "Transparent",
+            "0", "0", points, "0", "0", points]
+
+
+def _write_csv(fp, lg: LeagueResult, group: str, info: dict):
+    writer = csv.writer(fp)
+    writer.writerow(_broadcast_headers)
+    for position, driver in group_standings(lg, group):
+        writer.writerow(_broadcast_row(driver))
+
+
+def _write_json(fp, lg: LeagueResult, group: str, info: dict):
+    standings = []
+    for position, driver in group_standings(lg, group):
+        first_name, last_name = split_name(driver.name)
+        standings.append({"position": position,
+                          "cust_id": driver.cust_id,
+                          "name": driver.name,
+                          "first_name": first_name,
+                          "last_name": last_name,
+                          "car_number": driver.car_number,
+                          "points": driver.earned_points - driver.drop_points})
+    json.dump({**info, "standings": standings}, fp, ensure_ascii=False, indent=2)
+
+
+_writers = {StandingsFormat.CSV: _write_csv, StandingsFormat.JSON: _write_json}
+
+
+def write_standings(lg: LeagueResult, group: str, filename: Path, fmt: StandingsFormat, info: dict = None):
+    """
+    Write the standings of a group, replacing filename only once it is completely written,
+    so anything watching it (ex. an overlay) never reads a partial file
+    :param info: anything to describe the standings with (json only), ex. league and season names
+    """
+    tmp_filename = filename.with_name(filename.name + ".tmp")
+    with open(tmp_filename, 'w', newline='', encoding="utf-8") as fp:
+        _writers[fmt](fp, lg, group, info or {})
+    os.replace(tmp_filename, filename)
+    return filename
+
+
+def export_standings(lg: LeagueResult, groups: list[str], out_dir: Path, basename: str,
+                     formats: list[StandingsFormat] = (StandingsFormat.CSV,)) -> list[Path]:
+    """
+    Write the standings of each group, in each format
+    Broadcast csvs are <basename> <group> [r=<races run>].csv, overlay json keeps one name, <basename> <group>.json
+    :return: the files written
+    """
+    num_races = lg.num_races_run()
+    filenames = []
+    for group in groups:
+        info = {"name": basename, "group": group, "races": num_races}
+        for fmt in formats:
+            if fmt == StandingsFormat.CSV:
+                filename = out_dir / f"{basename} {group} [r={num_races}].csv"
+            else:
+                filename = out_dir / f"{basename} {group}.{fmt.value}"
+            filenames.append(write_standings(lg, group, filename, fmt, info))
+    return filenames
@@ -0,0 +1,655 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+import argparse
+import logging
+import numpy as np
+
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from core.league import LeagueConfiguration, serialize_league_configuration_to_string
+from core.objects import GroupRules, SerializationFormat
+from core.standin import response_name, save_response
+
+_logger = logging.getLogger('log')
+
+# Synthetic data is generated with iRacing's units, times are in 1/10000 of a second
+_time_units = 10000
+
+_first_names = ["Alex", "Bobby", "Casey", "Dale", "Emma", "Fran", "Gil", "Hank", "Ivy", "Jo", "Kyle", "Lou",
+                "Max", "Nina", "Otto", "Pat", "Quinn", "Ray", "Sam", "Tess", "Uma", "Vic", "Wes", "Zoe"]
+_syllables = ["ar", "ber", "cal", "dor", "el", "fen", "gar", "hol", "in", "kes", "lan", "mor",
+              "nel", "or", "pet", "ros", "son", "tan", "ul", "ver", "wick", "yen"]
+_tracks = [(1, "Lime Rock Park", "Full Course"),
+           (2, "Summit Point Raceway", "Summit Point Raceway"),
+           (3, "Okayama International Circuit", "Full Course"),
+           (4, "Road America", "Full Course"),
+           (5, "Watkins Glen International", "Boot"),
+           (6, "Virginia International Raceway", "Full Course"),
+           (7, "Mid-Ohio Sports Car Course", "Full Course"),
+           (8, "Daytona International Speedway", "Road Course")]
+_reason_running = (0, "Running")
+_reason_dnf = (32, "Disconnected")
+_reason_dq = (6, "Disqualified")
+
+
+class SyntheticResponses:
+    """
+    API shaped responses, keyed by endpoint and the parameters that identify them (see core.standin.response_name)
+    These can be written out for the stand-in server, or served directly with a SyntheticDataClient
+    """
+    __slots__ = ["_responses", "_params"]
+
+    def __init__(self):
+        self._responses = dict()  # endpoint -> response name -> data
+        self._params = dict()  # endpoint -> response name -> params
+
+    def __len__(self):
+        return sum(len(r) for r in self._responses.values())
+
+    def add(self, endpoint: str, params: dict, data):
+        name = response_name(endpoint, params)
+        self._responses.setdefault(endpoint, {})[name] = data
+        self._params.setdefault(endpoint, {})[name] = params
+
+    def get(self, endpoint: str, params: dict):
+        name = response_name(endpoint, params)
+        if endpoint not in self._responses or name not in self._responses[endpoint]:
+            raise RuntimeError(f"No synthetic response for {endpoint} {params}")
+        return self._responses[endpoint][name]
+
+    def update(self, other: "SyntheticResponses"):
+        for endpoint, responses in other._responses.items():
+            for name, data in responses.items():
+                self.add(endpoint, other._params[endpoint][name], data)
+
+    def save(self, data_dir: Path):
+        """ Write every response where a core.standin.DataApiStandIn serving data_dir will find it """
+        for endpoint, responses in self._responses.items():
+            for name, data in responses.items():
+                save_response(data_dir, endpoint, self._params[endpoint][name], data)
+        _logger.info(f"Wrote {len(self)} synthetic responses to {data_dir}")
+
+
+class SyntheticDataClient:
+    """
+    Answers the irDataClient calls we make with SyntheticResponses, so scoring can be run without any server
+    """
+    __slots__ = ["_responses"]
+
+    def __init__(self, responses: SyntheticResponses):
+        self._responses = responses
+
+    def league_get(self, league_id: int, include_licenses: bool = False):
+        return self._responses.get("/data/league/get", {"league_id": league_id})
+
+    def league_seasons(self, league_id: int, retired: bool = False):
+        return self._responses.get("/data/league/seasons", {"league_id": league_id})
+
+    def league_season_sessions(self, league_id: int, season_id: int, results_only: bool = False):
+        return self._responses.get("/data/league/season_sessions", {"league_id": league_id, "season_id": season_id})
+
+    def result(self, subsession_id: int, include_licenses: bool = False):
+        return self._responses.get("/data/results/get", {"subsession_id": subsession_id})
+
+    def result_lap_chart_data(self, subsession_id: int, simsession_number: int = 0):
+        return self._responses.get("/data/results/lap_chart_data",
+                                   {"subsession_id": subsession_id, "simsession_number": simsession_number})
+
+    def result_season_results(self, season_id: int, event_type: int = None, race_week_num: int = None):
+        return self._responses.get("/data/results/season_results", {"season_id": season_id})
+
+    def series_stats(self):
+        return self._responses.get("/data/series/stats_series", {})
+
+    def team(self, team_id: int, include_licenses: bool = False):
+        return self._responses.get("/data/team/get", {"team_id": team_id})
+
+    def member(self, cust_id: int, include_licenses: bool = False):
+        return self._responses.get("/data/member/get", {"cust_ids": cust_id})
+
+
+def _unique_names(rng: np.random.Generator, count: int, taken: set) -> list:
+    # Names have no digits, so LeagueResult.get_cust_id's clean name lookup stays unambiguous
+    names = []
+    while len(names) < count:
+        last = "".join(rng.choice(_syllables, size=int(rng.integers(2, 4)))).capitalize()
+        name = f"{rng.choice(_first_names)} {last}"
+        if name not in taken:
+            taken.add(name)
+            names.append(name)
+    return names
+
+
+def _format_time(t: datetime) -> str:
+    return t.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _simulate_race(rng: np.random.Generator, entries: list, laps: int, lap_time_s: float,
+                   dnf_probability: float, incident_rate: float):
+    """
+    Race a field of entries
+    :param entries: a dict per car with group_id, car_number, skill (seconds off the lap time) and
+                    drivers, a list of (cust_id, display_name), who drive in equal stints
+    :return: (a result dict per entry in entry order, the lap chart rows ordered by lap and position)
+    """
+    n = len(entries)
+    skill = np.array([e["skill"] for e in entries], dtype=float)
+    lap_times = lap_time_s + skill[:, None] + rng.normal(0, 0.3, (n, laps)) + rng.exponential(0.4, (n, laps))
+    lap_times[:, 0] += 4.0  # Standing start
+    lap_times = np.round(lap_times * _time_units).astype(np.int64)
+
+    laps_complete = np.full(n, laps)
+    dnf = rng.random(n) < dnf_probability
+    laps_complete[dnf] = rng.integers(0, laps, int(dnf.sum()))
+
+    grid = np.argsort(np.argsort(skill + rng.normal(0, 0.3, n)))  # 0 based starting positions
+    session_times = np.cumsum(lap_times, axis=1) + grid[:, None] * 1000  # Grid stagger keeps the start order
+    # Retired cars drop to the back of the running order
+    racing = np.arange(laps)[None, :] < laps_complete[:, None]
+    ordered_times = np.where(racing, session_times, np.iinfo(np.int64).max)
+    lap_positions = np.argsort(np.argsort(ordered_times, axis=0, kind="stable"), axis=0)
+
+    final_times = np.array([session_times[i, lc - 1] if lc > 0 else grid[i] for i, lc in enumerate(laps_complete)])
+    finish_order = np.lexsort((final_times, -laps_complete))
+    finish = np.empty(n, dtype=int)
+    finish[finish_order] = np.arange(n)
+    winner = finish_order[0]
+    incidents = rng.poisson(incident_rate, n)
+
+    results = []
+    for i, entry in enumerate(entries):
+        lc = int(laps_complete[i])
+        drivers = entry["drivers"]
+        stint = max(1, -(-laps // len(drivers)))
+        driver_laps = np.zeros(len(drivers), dtype=int)
+        driver_lead = np.zeros(len(drivers), dtype=int)
+        for lap in range(lc):
+            driver_laps[lap // stint] += 1
+            if lap_positions[i, lap] == 0:
+                driver_lead[lap // stint] += 1
+        if lc == laps_complete[winner]:
+            interval = int(final_times[i] - final_times[winner])
+        else:
+            interval = -1  # Not on the lead lap
+        reason = _reason_running if lc == laps else _reason_dnf
+        results.append({
+            "starting_position": int(grid[i]),
+            "finish_position": int(finish[i]),
+            "laps_complete": lc,
+            "laps_lead": int(driver_lead.sum()),
+            "interval": interval,
+            "incidents": int(incidents[i]),
+            "reason_out_id": reason[0],
+            "reason_out": reason[1],
+            "best_lap_time": int(lap_times[i, 1:lc].min()) if lc > 1 else -1,
+            "best_lap_num": int(lap_times[i, 1:lc].argmin()) + 2 if lc > 1 else -1,
+            "average_lap": int(lap_times[i, :lc].mean()) if lc > 0 else 0,
+            "livery": {"car_number": str(entry["car_number"])},
+            "driver_laps": driver_laps.tolist(),
+            "driver_laps_lead": driver_lead.tolist(),
+            "driver_incidents": rng.multinomial(int(incidents[i]), [1 / len(drivers)] * len(drivers)).tolist(),
+        })
+
+    lap_chart = []
+    for lap in range(laps + 1):
+        if lap == 0:
+            order = np.argsort(grid)
+        else:
+            order = [i for i in np.argsort(lap_positions[:, lap - 1]) if laps_complete[i] >= lap]
+        for position, i in enumerate(order):
+            if lap > laps_complete[i]:
+                continue
+            entry = entries[i]
+            drivers = entry["drivers"]
+            stint = max(1, -(-laps // len(drivers)))
+            cust_id, display_name = drivers[min((max(lap, 1) - 1) // stint, len(drivers) - 1)]
+            lap_chart.append({
+                "group_id": entry["group_id"],
+                "cust_id": cust_id,
+                "display_name": display_name,
+                "lap_number": lap,
+                "lap_time": int(lap_times[i, lap - 1]) if lap > 0 else -1,
+                "session_time": int(session_times[i, lap - 1]) if lap > 0 else int(grid[i]) * 1000,
+                "lap_position": position + 1,
+                "car_number": str(entry["car_number"]),
+                "incident": False,
+                "lap_events": [],
+            })
+    return results, lap_chart
+
+
+def _class_positions(results: list, classes: list):
+    """ Fill in the in class finish and start positions """
+    for key in ["finish_position", "starting_position"]:
+        counts = {}
+        for result, car_class in sorted(zip(results, classes), key=lambda rc: rc[0][key]):
+            result[f"{key}_in_class"] = counts.get(car_class, 0)
+            counts[car_class] = counts.get(car_class, 0) + 1
+
+
+class SyntheticLeague:
+    """
+    Generates the iRacing responses for a league: roster, seasons, sessions, subsession results and lap charts
+    Drivers are spread over classes by car number, like our GroupRules,
+    and the roster churns between races, so some drivers are not league members when they race
+    """
+    __slots__ = ["league_id",
+                 "name",
+                 "num_drivers",
+                 "num_seasons",
+                 "num_races",
+                 "num_run_races",
+                 "laps",
+                 "lap_time_s",
+                 "classes",
+                 "attendance",
+                 "dnf_probability",
+                 "incident_rate",
+                 "penalty_probability",
+                 "churn",
+                 "seed",
+                 "_responses",
+                 "_penalties"]
+
+    def __init__(self,
+                 league_id: int = 1000,
+                 name: str = "Synthetic League",
+                 num_drivers: int = 40,
+                 num_seasons: int = 1,
+                 num_races: int = 14,
+                 num_run_races: int = None,
+                 laps: int = 30,
+                 lap_time_s: float = 90.0,
+                 classes: dict = None,
+                 attendance: float = 0.85,
+                 dnf_probability: float = 0.05,
+                 incident_rate: float = 3.0,
+                 penalty_probability: float = 0.02,
+                 churn: float = 0.02,
+                 seed: int = 0):
+        """
+        :param num_drivers: size of the roster
+        :param num_run_races: races run in the last season, the rest have not happened yet (default all)
+        :param classes: class name -> (min car number, max car number), default is one class of 1-999
+        :param attendance: chance [0, 1] a rostered driver shows up to a race
+        :param dnf_probability: chance [0, 1] a driver does not finish a race
+        :param incident_rate: average number of incidents per driver per race
+        :param penalty_probability: chance [0, 1] a driver is given a time penalty (or 1 in 4 times, a DQ)
+        :param churn: chance [0, 1] a rostered driver leaves the league after a race, and is replaced
+        """
+        self.league_id = league_id
+        self.name = name
+        self.num_drivers = num_drivers
+        self.num_seasons = num_seasons
+        self.num_races = num_races
+        self.num_run_races = num_races if num_run_races is None else num_run_races
+        self.laps = laps
+        self.lap_time_s = lap_time_s
+        self.classes = {"Pro": (1, 999)} if classes is None else classes
+        self.attendance = attendance
+        self.dnf_probability = dnf_probability
+        self.incident_rate = incident_rate
+        self.penalty_probability = penalty_probability
+        self.churn = churn
+        self.seed = seed
+        self._responses = None
+        self._penalties = dict()  # season name -> [(race, cust_id, seconds or None for a DQ)]
+
+    @staticmethod
+    def season_name(season: int) -> str:
+        return f"Season {season}"
+
+    @property
+    def responses(self) -> SyntheticResponses:
+        if self._responses is None:
+            self._generate()
+        return self._responses
+
+    def configuration(self, season: int = None, top_score: int = 40, num_drops: int = 2) -> LeagueConfiguration:
+        """
+        A configuration to score a generated season with, including the generated penalties
+        :param season: 1 based season number, default is the last season
+        """
+        season_name = self.season_name(self.num_seasons if season is None else season)
+        self.responses  # Penalties are drawn while generating
+        cfg = LeagueConfiguration(self.name, self.league_id, season_name, self.num_races)
+        cfg.set_linear_decent_scoring(top_score, separate_pool=len(self.classes) > 1)
+        for car_class, (min_number, max_number) in self.classes.items():
+            cfg.add_group_rule(car_class, GroupRules(min_number, max_number, num_drops))
+        for race, cust_id, seconds in self._penalties.get(season_name, []):
+            if seconds is None:
+                cfg.add_disqualification(race, cust_id)
+            else:
+                cfg.add_time_penalty(race, cust_id, seconds)
+        return cfg
+
+    def _generate(self):
+        rng = np.random.default_rng(self.seed)
+        self._responses = responses = SyntheticResponses()
+        taken_names = set()
+        taken_numbers = set()
+        next_cust_id = 300000 + self.league_id
+        drivers = dict()  # cust_id -> driver
+        roster = list()  # cust_ids of current members
+
+        def new_number(car_class: str) -> int:
+            min_number, max_number = self.classes[car_class]
+            free = [n for n in range(min_number, max_number + 1) if n not in taken_numbers]
+            if not free:
+                raise ValueError(f"Class {car_class} has no car numbers left for a new driver")
+            number = int(rng.choice(free))
+            taken_numbers.add(number)
+            return number
+
+        def join(count: int):
+            nonlocal next_cust_id
+            class_names = list(self.classes.keys())
+            for name in _unique_names(rng, count, taken_names):
+                next_cust_id += int(rng.integers(1, 500))
+                car_class = class_names[len(drivers) % len(class_names)]
+                drivers[next_cust_id] = {"cust_id": next_cust_id,
+                                         "display_name": name,
+                                         "nick_name": name.split(" ")[0],
+                                         "class": car_class,
+                                         "car_number": new_number(car_class),
+                                         "skill": float(rng.normal(0, 1.5)),
+                                         "irating": int(np.clip(rng.normal(2000, 600), 500, 9000))}
+                roster.append(next_cust_id)
+
+        join(self.num_drivers)
+        launch = datetime(2024, 1, 9, 1, 0)
+        subsession_id = 60000000 + self.league_id * 1000
+        seasons = []
+        for season in range(1, self.num_seasons + 1):
+            season_id = self.league_id * 100 + season
+            season_name = self.season_name(season)
+            seasons.append({"league_id": self.league_id, "season_id": season_id, "season_name": season_name,
+                            "active": season == self.num_seasons})
+            penalties = self._penalties.setdefault(season_name, [])
+            num_run_races = self.num_run_races if season == self.num_seasons else self.num_races
+            sessions = []
+            for race in range(1, self.num_races + 1):
+                launch += timedelta(days=7)
+                track_id, track_name, config_name = _tracks[int(rng.integers(len(_tracks)))]
+                session = {"league_id": self.league_id,
+                           "league_season_id": season_id,
+                           "session_id": int(subsession_id // 2 + race),
+                           "launch_at": _format_time(launch),
+                           "time_limit": 60,
+                           "qualify_laps": 2,
+                           "qualify_length": 10,
+                           "race_laps": self.laps,
+                           "track": {"track_id": track_id, "track_name": track_name, "config_name": config_name},
+                           "cars": [{"car_id": 100 + i, "car_name": f"{c} Car", "car_class_id": 1000 + i}
+                                    for i, c in enumerate(self.classes)],
+                           "weather": {"temp_value": int(rng.integers(55, 95)),
+                                       "wind_value": int(rng.integers(0, 15)),
+                                       "rel_humidity": int(rng.integers(30, 80)),
+                                       "track_water": 0,
+                                       "skies": int(rng.integers(0, 4))},
+                           "status": 0}
+                sessions.append(session)
+                if race > num_run_races:
+                    continue  # Not run yet, so no subsession
+
+                subsession_id += int(rng.integers(1, 5000))
+                session["subsession_id"] = subsession_id
+                field = [d for d in roster if rng.random() < self.attendance]
+                entries = [{"group_id": d,
+                            "car_number": drivers[d]["car_number"],
+                            "skill": drivers[d]["skill"],
+                            "drivers": [(d, drivers[d]["display_name"])]} for d in field]
+                results, lap_chart = _simulate_race(rng, entries, self.laps, self.lap_time_s,
+                                                    self.dnf_probability, self.incident_rate)
+                _class_positions(results, [drivers[d]["class"] for d in field])
+                for d, result in zip(field, results):
+                    driver = drivers[d]
+                    del result["driver_laps"], result["driver_laps_lead"], result["driver_incidents"]
+                    result["cust_id"] = d
+                    result["display_name"] = driver["display_name"]
+                    result["car_class_short_name"] = driver["class"]
+                    result["oldi_rating"] = driver["irating"]
+                    driver["irating"] += int((len(field) / 2 - result["finish_position"]) * 4)
+                    result["newi_rating"] = driver["irating"]
+                    if rng.random() < self.penalty_probability:
+                        if rng.random() < 0.25:
+                            penalties.append((race, d, None))
+                        elif result["interval"] >= 0:
+                            penalties.append((race, d, int(rng.choice([5, 10, 30]))))
+                results.sort(key=lambda r: r["finish_position"])
+                responses.add("/data/results/get", {"subsession_id": subsession_id},
+                              {"subsession_id": subsession_id,
+                               "league_id": self.league_id,
+                               "league_season_id": season_id,
+                               "start_time": _format_time(launch),
+                               "track": session["track"],
+                               "event_laps_complete": max(r["laps_complete"] for r in results) if results else 0,
+                               "session_results": [{"simsession_number": 0,
+                                                    "simsession_type": 6,
+                                                    "simsession_type_name": "Race",
+                                                    "simsession_name": "RACE",
+                                                    "results": results}]})
+                responses.add("/data/results/lap_chart_data",
+                              {"subsession_id": subsession_id, "simsession_number": 0}, lap_chart)
+
+                # Churn the roster, leavers are no longer league members when the league is fetched
+                leavers = [d for d in roster if rng.random() < self.churn]
+                for d in leavers:
+                    roster.remove(d)
+                join(len(leavers))
+
+            responses.add("/data/league/season_sessions", {"league_id": self.league_id, "season_id": season_id},
+                          {"league_id": self.league_id, "season_id": season_id, "sessions": sessions})
+
+        responses.add("/data/league/seasons", {"league_id": self.league_id},
+                      {"league_id": self.league_id, "seasons": seasons})
+        responses.add("/data/league/get", {"league_id": self.league_id},
+                      {"league_id": self.league_id,
+                       "league_name": self.name,
+                       "roster_count": len(roster),
+                       "roster": [{"cust_id": d,
+                                   "display_name": drivers[d]["display_name"],
+                                   "nick_name": drivers[d]["nick_name"],
+                                   "car_number": str(drivers[d]["car_number"]) if rng.random() > 0.05 else None}
+                                  for d in roster]})
+        for d, driver in drivers.items():
+            responses.add("/data/member/get", {"cust_ids": d},
+                          {"success": True, "cust_ids": [d],
+                           "members": [{"cust_id": d, "display_name": driver["display_name"]}]})
+
+
+class SyntheticEvent:
+    """
+    Generates the iRacing responses for a special (team) event: the series, its splits, results, lap charts and teams
+    """
+    __slots__ = ["series_name",
+                 "year",
+                 "num_splits",
+                 "teams_per_split",
+                 "drivers_per_team",
+                 "roster_size",
+                 "laps",
+                 "lap_time_s",
+                 "classes",
+                 "dnf_probability",
+                 "incident_rate",
+                 "penalty_probability",
+                 "seed",
+                 "_responses"]
+
+    def __init__(self,
+                 series_name: str = "Synthetic Endurance",
+                 year: int = 2024,
+                 num_splits: int = 10,
+                 teams_per_split: int = 40,
+                 drivers_per_team: int = 3,
+                 roster_size: int = 5,
+                 laps: int = 100,
+                 lap_time_s: float = 100.0,
+                 classes: list = None,
+                 dnf_probability: float = 0.15,
+                 incident_rate: float = 20.0,
+                 penalty_probability: float = 0.005,
+                 seed: int = 0):
+        """
+        :param drivers_per_team: number of drivers that drive for each team
+        :param roster_size: number of members on each team, including members that do not drive
+        :param classes: car class short names, default is GTP, LMP2 and GT3
+        :param penalty_probability: chance [0, 1] a team is disqualified
+        """
+        self.series_name = series_name
+        self.year = year
+        self.num_splits = num_splits
+        self.teams_per_split = teams_per_split
+        self.drivers_per_team = drivers_per_team
+        self.roster_size = max(roster_size, drivers_per_team)
+        self.laps = laps
+        self.lap_time_s = lap_time_s
+        self.classes = ["GTP", "LMP2", "GT3"] if classes is None else classes
+        self.dnf_probability = dnf_probability
+        self.incident_rate = incident_rate
+        self.penalty_probability = penalty_probability
+        self.seed = seed
+        self._responses = None
+
+    @property
+    def responses(self) -> SyntheticResponses:
+        if self._responses is None:
+            self._generate()
+        return self._responses
+
+    def _generate(self):
+        rng = np.random.default_rng(self.seed)
+        self._responses = responses = SyntheticResponses()
+        season_id = 5000 + self.year
+        car_classes = [{"car_class_id": 2000 + i, "short_name": c, "name": f"{c} Class"}
+                       for i, c in enumerate(self.classes)]
+        responses.add("/data/series/stats_series", {},
+                      [{"series_id": 500, "series_name": self.series_name,
+                        "seasons": [{"series_id": 500, "season_id": season_id, "season_year": self.year,
+                                     "season_name": f"{self.year} {self.series_name}",
+                                     "car_classes": car_classes}]}])
+        taken_names = set()
+        cust_id = 500000
+        team_id = -100000  # iRacing team ids are negative in results
+        subsession_id = 70000000
+        results_list = []
+        launch = datetime(self.year, 1, 27, 13, 0)
+        for split in range(self.num_splits):
+            split_irating = 4500 - split * (3500 / max(1, self.num_splits))
+            subsession_id += int(rng.integers(1, 50))
+            entries = []
+            teams = []
+            for t in range(self.teams_per_split):
+                team_id -= int(rng.integers(1, 1000))
+                names = _unique_names(rng, self.roster_size, taken_names)
+                roster = []
+                for name in names:
+                    cust_id += int(rng.integers(1, 500))
+                    roster.append((cust_id, name, int(np.clip(rng.normal(split_irating, 400), 500, 9000))))
+                drivers = [roster[i] for i in sorted(rng.choice(self.roster_size, self.drivers_per_team,
+                                                                replace=False))]
+                car_class = self.classes[t % len(self.classes)]
+                # Faster classes lap quicker, better splits are quicker too
+                class_pace = self.classes.index(car_class) * self.lap_time_s * 0.06
+                entries.append({"group_id": team_id,
+                                "car_number": t + 1,
+                                "skill": class_pace + float(rng.normal(split * 0.1, 1.0)),
+                                "drivers": [(d[0], d[1]) for d in drivers]})
+                teams.append((team_id, f"Team {names[0].split(' ')[1]}", car_class, roster, drivers))
+
+            results, lap_chart = _simulate_race(rng, entries, self.laps, self.lap_time_s,
+                                                self.dnf_probability, self.incident_rate)
+            _class_positions(results, [team[2] for team in teams])
+            for (tid, team_name, car_class, roster, drivers), result in zip(teams, results):
+                if rng.random() < self.penalty_probability:
+                    result["reason_out_id"], result["reason_out"] = _reason_dq
+                result["team_id"] = tid
+                result["display_name"] = team_name
+                result["car_class_short_name"] = car_class
+                result["car_name"] = f"{car_class} Car"
+                result["driver_results"] = [{"cust_id": d[0],
+                                             "display_name": d[1],
+                                             "team_id": tid,
+                                             "oldi_rating": d[2],
+                                             "newi_rating": d[2] + int(rng.integers(-60, 60)),
+                                             "laps_complete": driven,
+                                             "laps_lead": lead,
+                                             "incidents": incidents}
+                                            for d, driven, lead, incidents in zip(drivers,
+                                                                                result.pop("driver_laps"),
+                                                                                result.pop("driver_laps_lead"),
+                                                                                result.pop("driver_incidents"))
+                                            # Only drivers that have driven laps are listed
+                                            if driven > 0 or d is drivers[0]]
+                responses.add("/data/team/get", {"team_id": tid},
+                              {"team_id": tid, "team_name": team_name, "owner_id": roster[0][0],
+                               "roster": [{"cust_id": m[0], "display_name": m[1], "owner": m is roster[0],
+                                           "admin": m is roster[0], "helmet": {"pattern": 1, "color1": "ffffff"}}
+                                          for m in roster]})
+            results.sort(key=lambda r: r["finish_position"])
+
+            class_sofs = []
+            for c in car_classes:
+                iratings = [d[2] for team in teams if team[2] == c["short_name"] for d in team[4]]
+                class_sofs.append({"car_class_id": c["car_class_id"], "short_name": c["short_name"],
+                                   "strength_of_field": int(np.mean(iratings)) if iratings else 0,
+                                   "num_entries": sum(1 for team in teams if team[2] == c["short_name"])})
+            sof = int(np.mean([d[2] for team in teams for d in team[4]])) if teams else 0
+            results_list.append({"subsession_id": subsession_id,
+                                 "start_time": _format_time(launch),
+                                 "event_strength_of_field": sof,
+                                 "car_classes": class_sofs})
+            responses.add("/data/results/get", {"subsession_id": subsession_id},
+                          {"subsession_id": subsession_id,
+                           "season_id": season_id,
+                           "event_strength_of_field": sof,
+                           "event_laps_complete": max(r["laps_complete"] for r in results) if results else 0,
+                           "session_results": [{"simsession_number": 0,
+                                                "simsession_type": 6,
+                                                "simsession_type_name": "Race",
+                                                "simsession_name": "RACE",
+                                                "results": results}]})
+            responses.add("/data/results/lap_chart_data",
+                          {"subsession_id": subsession_id, "simsession_number": 0}, lap_chart)
+
+        responses.add("/data/results/season_results", {"season_id": season_id},
+                      {"success": True, "season_id": season_id, "event_type": 5, "results_list": results_list})
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser(description="Write synthetic iRacing Data API responses for core.standin")
+    parser.add_argument("-o", "--output", default=Path("./standin"), type=Path,
+                        help="Directory to write responses to.")
+    parser.add_argument("-s", "--seed", default=0, type=int, help="Random seed.")
+    parser.add_argument("-d", "--drivers", default=40, type=int, help="Number of league drivers.")
+    parser.add_argument("-r", "--races", default=14, type=int, help="Number of races in a league season.")
+    parser.add_argument("-ns", "--seasons", default=1, type=int, help="Number of league seasons.")
+    parser.add_argument("-l", "--laps", default=30, type=int, help="Number of laps in a league race.")
+    parser.add_argument("-es", "--event_splits", default=0, type=int,
+                        help="Number of splits for a special event, 0 means no event.")
+    parser.add_argument("-et", "--event_teams", default=40, type=int, help="Number of teams in each event split.")
+    parser.add_argument("-el", "--event_laps", default=100, type=int, help="Number of laps in the event.")
+    opts = parser.parse_args()
+
+    league = SyntheticLeague(num_drivers=opts.drivers, num_races=opts.races, num_seasons=opts.seasons,
+                             laps=opts.laps, seed=opts.seed)
+    responses = league.responses
+    if opts.event_splits > 0:
+        event = SyntheticEvent(num_splits=opts.event_splits, teams_per_split=opts.event_teams,
+                               laps=opts.event_laps, seed=opts.seed)
+        responses.update(event.responses)
+    responses.save(opts.output)
+    # Write the configuration to score the league with
+    configuration_filename = opts.output / "configuration.json"
+    with open(configuration_filename, 'w') as fp:
+        fp.write(serialize_league_configuration_to_string(league.configuration(), SerializationFormat.JSON))
+    print(f"Wrote {len(responses)} responses and {configuration_filename}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+import csv
+import logging
+import numpy as np
+import os
+
+from array import array
+from pathlib import Path
+
+from core import instrumentation
+from core.garage61 import Garage61Client, is_clean_lap
+
+_logger = logging.getLogger('log')
+
+
+def _to_float(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        if value == "true" or value == "True":
+            return 1.0
+        if value == "false" or value == "False":
+            return 0.0
+        return float("nan")
+
+
+def parse_telemetry_csv(lines) -> dict:
+    """
+    Parse Garage61 telemetry CSV lines into a numpy array per channel
+    Values are packed into typed arrays as each line is read, so no text copy of the lap is kept around
+    :param lines: iterable of CSV lines, the first being the channel names
+    :return: dict of channel name to a float64 numpy array
+    """
+    reader = csv.reader(lines)
+    channels = next(reader, None)
+    if channels is None:
+        return {}
+    columns = [array('d') for _ in channels]
+    for row in reader:
+        if len(row) != len(channels):
+            continue  # Blank or truncated line
+        for column, value in zip(columns, row):
+            column.append(_to_float(value))
+    return {name: np.frombuffer(column, dtype=np.float64) for name, column in zip(channels, columns)}
+
+
+def telemetry_filename(out_dir: Path, lap_id: str) -> Path:
+    return out_dir / f"{lap_id}.npz"
+
+
+def fetch_lap_telemetry(g61: Garage61Client, lap_id: str, out_dir: Path) -> Path:
+    """
+    Stream the telemetry of a lap into a compressed columnar (npz) file
+    If the file already exists, nothing is downloaded
+    :return: The telemetry filename
+    """
+    filename = telemetry_filename(out_dir, lap_id)
+    if filename.exists():
+        return filename
+    channels = parse_telemetry_csv(g61.lap_csv_lines(lap_id))
+    # Write to a temporary file first, so an interrupted run never leaves a partial lap behind
+    tmp_filename = filename.with_suffix(".tmp.npz")
+    with open(tmp_filename, 'wb') as fp:
+        np.savez_compressed(fp, **channels)
+    os.replace(tmp_filename, filename)
+    return filename
+
+
+def fetch_all_lap_telemetry(g61: Garage61Client, lap_ids: list, out_dir: Path) -> dict:
+    """
+    Download the telemetry of many laps concurrently (using the g61 client's concurrency and rate limits)
+    Laps that have already been downloaded to out_dir are skipped, so an interrupted run can just be rerun
+    :return: dict of lap id to telemetry filename
+    """
+    out_dir.mkdir(exist_ok=True, parents=True)
+    # A lap is only downloaded once, two downloads of it would write the same temporary file
+    lap_ids = list(dict.fromkeys(lap_ids))
+    todo = [lap_id for lap_id in lap_ids if not telemetry_filename(out_dir, lap_id).exists()]
+    _logger.info(f"Downloading telemetry for {len(todo)} of {len(lap_ids)} laps")
+    instrumentation.cache("garage61.telemetry", True, len(lap_ids) - len(todo))
+    instrumentation.cache("garage61.telemetry", False, len(todo))
+    g61.run_concurrently(fetch_lap_telemetry, [{"g61": g61, "lap_id": lap_id, "out_dir": out_dir} for lap_id in todo])
+    return {lap_id: telemetry_filename(out_dir, lap_id) for lap_id in lap_ids}
+
+
+def read_lap_telemetry(filename: Path, channels: list = None):
+    """
+    Read the channels of a downloaded lap, one at a time
+    Only the requested channels are decompressed
+    :param filename: telemetry file written by fetch_lap_telemetry
+    :param channels: channel names to read, all channels if None
+    :return: A generator of (channel name, numpy array)
+    """
+    with np.load(filename) as npz:
+        names = npz.files if channels is None else channels
+        for name in names:
+            yield name, npz[name]
+
+
+def fastest_clean_lap_ids(g61_laps: list) -> dict:
+    """
+    Find the fastest clean lap of each driver
+    :param g61_laps: laps as returned by Garage61Client.laps or Garage61LapStore.laps
+    :return: dict of driver slug to lap id
+    """
+    fastest = {}
+    for g61_lap in g61_laps:
+        if not is_clean_lap(g61_lap):
+            continue
+        slug = g61_lap["driver"]["slug"]
+        if slug not in fastest or g61_lap["lapTime"] < fastest[slug]["lapTime"]:
+            fastest[slug] = g61_lap
+    return {slug: g61_lap["id"] for slug, g61_lap in fastest.items()}
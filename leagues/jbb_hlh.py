@@ -2,6 +2,7 @@
 # See accompanying NOTICE file for details.
 
 from datetime import datetime
+from pathlib import Path
 from dateutil import tz
 
 from score_hot_lap_league import score_league
@@ -30,7 +31,7 @@ def main():
     }
 
     cfg, sheet = get_season_2_cfg()
-    score_league(client, cfg, g612ir, HLHSheetsDisplay(sheet))
+    score_league(client, cfg, g612ir, HLHSheetsDisplay(sheet), telemetry_dir=Path("./telemetry") / __team_name)
     json = serialize_league_configuration_to_string(cfg, SerializationFormat.JSON)
     serialize_league_configuration_from_string(json, SerializationFormat.JSON)
 
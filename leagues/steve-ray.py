@@ -62,8 +62,11 @@ class SteveRay(LeagueMain):
         # Should only 1 be allowed, or allow a big mix? Cull duplicates?
         if len(self.configs) == 0:
             self.gen_configs()
+        if self.daemon:
+            self.watch(lambda cfg: score_league(self, cfg, RaySheets(cfg.google_sheet), archive_dir=self.archive_dir))
+            return
         for cfg in self.configs:
-            score_league(self, cfg, RaySheets(cfg.google_sheet))
+            score_league(self, cfg, RaySheets(cfg.google_sheet), archive_dir=self.archive_dir)
 
     def gen_configs(self):
 
@@ -17,17 +17,16 @@ _logger = logging.getLogger('log')
 def load_event(idc: irDataClient, series_name: str, year: int, detailed_team=False) -> Event:
     event_file = Path(f"./events/{year}_{series_name}.json")
     if event_file.exists():
+        # An event written out whole, before splits were kept as they were pulled
         _logger.info(f"Reading event file for : {series_name}")
         with open(event_file) as fp:
             d = json.load(fp)
         event = Event.from_dict(d)
     else:
+        # Only pulls splits we do not have yet, each split is read when it is first used
         event = pull_event(idc, series_name, year, detailed_team=detailed_team)
         if event is None:
             raise Exception(f"Could not find the event: {series_name}")
-        _logger.info(f"Writing event file for : {series_name}")
-        with open(f"./events/{year}_{series_name}.json", 'w') as fp:
-            json.dump(event.as_dict(), fp, indent=2)
     # Fill out ownership info
     for split in range(event.num_splits):
         result = event.get_result(split+1)
@@ -16,8 +16,12 @@ _logger = logging.getLogger('log')
 def score_league(client: ClientMain,
                  cfg: LeagueConfiguration,
                  g612ir: dict,
-                 sheets_display: SheetsDisplay):
-    league = cfg.fetch_and_score_hot_lap_league(client.idc, client.g61, g612ir)
+                 sheets_display: SheetsDisplay,
+                 telemetry_dir: Path = None):
+    """
+    :param telemetry_dir: download the telemetry of each driver's fastest clean lap of every session to this directory
+    """
+    league = cfg.fetch_and_score_hot_lap_league(client.idc, client.g61, g612ir, telemetry_dir=telemetry_dir)
 
     results_dir = Path("./results")
     results_dir.mkdir(exist_ok=True)
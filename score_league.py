@@ -1,20 +1,18 @@
 # Distributed under the Apache License, Version 2.0.
 # See accompanying NOTICE file for details.
 
-import copy
-import csv
 import json
 import logging
 import os
-import re
 
-from iracingdataapi.client import irDataClient
 from pathlib import Path
 
-from core.clients import ClientMain
+from core import instrumentation
+from core.clients import CheckpointDataClient, ClientMain
 from core.league import LeagueConfiguration, LeagueResult, serialize_league_configuration_to_string
 from core.objects import serialize_league_result_from_file, serialize_league_result_to_string, SerializationFormat
 from core.sheets import GDrive, SheetsDisplay
+from core.standings import export_standings, StandingsFormat
 
 _logger = logging.getLogger('log')
 
@@ -23,21 +21,46 @@ def score_league(client: ClientMain,
                  cfg: LeagueConfiguration,
                  sheets_display: SheetsDisplay = None,
                  active: bool = True,
-                 broadcast: bool = True):
+                 broadcast: bool = True,
+                 checkpoint_dir: Path = Path("./checkpoints"),
+                 ratings_dir: Path = Path("./ratings"),
+                 archive_dir: Path = None):
+    """
+    :param ratings_dir: drivers start the season from their rating in this league's RatingStore, kept in this
+                        directory (see rating_store_filename) and brought up to date with the season once it is scored,
+                        None to start from defaults
+    :param archive_dir: archive the season in this SeasonArchive directory, and refresh the careers of its drivers
+    :return: the scored season, None if it could not be scored
+    """
     # Write out the cfg
     cfg_dir = Path("./configs")
     cfg_dir.mkdir(exist_ok=True)
     filename = cfg_dir / f"{cfg.name} {cfg.season}.cfg.json"
     print(f"Writing league cfg to {filename}")
-    cfg_str = serialize_league_configuration_to_string(cfg, SerializationFormat.JSON)
-    with open(filename, 'w') as fp:
-        fp.write(cfg_str)
-
-    # Score
+    with instrumentation.span("write.configuration"):
+        cfg_str = serialize_league_configuration_to_string(cfg, SerializationFormat.JSON)
+        with open(filename, 'w') as fp:
+            fp.write(cfg_str)
+
+    # Drivers start the season with the ratings they finished the previous seasons with
+    store = None
+    if ratings_dir is not None:
+        from core.ratings import rating_store_filename, RatingStore  # numpy, only needed if we keep ratings
+        store = RatingStore(rating_store_filename(cfg.name, ratings_dir))
+
+    # Score, checkpointing every subsession as it is pulled, so an interrupted pull resumes where it stopped
+    from iracingdataapi.exceptions import AccessTokenInvalid
     try:
-        league = cfg.fetch_and_score_league(client.idc, active)
+        with instrumentation.span("score", league=cfg.name, season=cfg.season):
+            try:
+                league = cfg.fetch_and_score_league(CheckpointDataClient(client.idc, checkpoint_dir), active, store)
+            except AccessTokenInvalid:
+                _logger.info("iRacing access token expired, authenticating again and resuming")
+                client.authenticate()
+                league = cfg.fetch_and_score_league(CheckpointDataClient(client.idc, checkpoint_dir), active, store)
     except Exception as e:
         _logger.fatal(f"Houston, we have a problem: {e}")
+        _logger.fatal(f"Races pulled so far are checkpointed in {checkpoint_dir}, run again to resume")
         return
 
     # print_debug_stats(league, 609455)
@@ -48,24 +71,46 @@ def score_league(client: ClientMain,
     results_dir.mkdir(exist_ok=True)
     filename = results_dir / f"{cfg.name} {cfg.season}.json"
     print(f"Writing league to {filename}")
-    # Convert the League class to a python dict
-    d = league.as_dict()  # Work with data in a native python format instead of our classes
-    # Dump the dict to json
-    with open(filename, 'w', encoding="utf-8") as fp:
-        json.dump(d, fp, ensure_ascii=False, indent=2)
+    with instrumentation.span("write.results"):
+        # Convert the League class to a python dict
+        d = league.as_dict()  # Work with data in a native python format instead of our classes
+        # Dump the dict to json
+        with open(filename, 'w', encoding="utf-8") as fp:
+            json.dump(d, fp, ensure_ascii=False, indent=2)
+
+    # Rate the new races of the season, for the seasons that follow it
+    if store is not None:
+        try:
+            with instrumentation.span("write.ratings"):
+                store.add_season_file(filename)
+                store.save()
+        except Exception as e:
+            _logger.error(f"Failed to update driver ratings: {e}")
 
-    # Write broadcast csv
+    # Archive the season and refresh the careers of its drivers, if it changed since it was last archived
+    if archive_dir is not None:
+        from core.archive import season_content_stamp
+        from core.careers import DriverCareers  # numpy, only needed once we have a result
+        try:
+            with instrumentation.span("write.careers"):
+                DriverCareers(archive_dir).add_season(cfg.name, cfg.season, league, season_content_stamp(filename))
+        except Exception as e:
+            _logger.error(f"Failed to update driver careers in {archive_dir}: {e}", exc_info=True)
+
+    # Write broadcast csv and overlay json standings
     if broadcast:
-        broadcast_standings(cfg, league, results_dir)
+        with instrumentation.span("write.broadcast"):
+            broadcast_standings(cfg, league, results_dir)
 
     # Push our results up to our sheets
     if sheets_display is not None and len(client.google_credentials) > 0:
         try:
             _logger.info("Pushing " + cfg.name + " season " + str(cfg.season) + " results to sheets")
-            GDrive.push_results_to_sheets(league,
-                                          list(cfg.group_rules.keys()),
-                                          sheets_display,
-                                          client.google_credentials)
+            with instrumentation.span("sheets.push"):
+                GDrive.push_results_to_sheets(league,
+                                              list(cfg.group_rules.keys()),
+                                              sheets_display,
+                                              client.google_credentials)
         except Exception as e:
             print("Failed to upload to google sheets", e)
             if "Token" in str(e) and "expired" in str(e):
@@ -84,46 +129,9 @@ def score_league(client: ClientMain,
                 # TODO change up the auth type so we don't need to do this
     else:
         print("Could not find credentials file. Not pushing to sheets.")
+    return league
 
 
-def broadcast_standings(cfg: LeagueConfiguration, lg: LeagueResult, out_dir: Path):
-
-    headers = [
-        "First name", "Last name", "Suffix", "Multicar team name", "Club name", "iRacing ID", "Car number",
-        "Multicar team background color", "iRacing car color", "iRacing car number color", "iRacing car number color 2",
-        "iRacing car number color 3", "iRacing car number font ID", "iRacing car number style",
-        "Points before weekend", "Points earned", "Bonus points", "Points after weekend"
-    ]
-    data = ["First name", "Last name", "", "", "", "iRacindID", "CarNumber",
-            "Transparent", "Transparent", "Transparent", "Transparent", "Transparent",
-            "0", "0", "0", "0", "0", "0"]
-
-    def pull_class(c: str, lr: LeagueResult):
-        class_standings = []
-        for iRid, driver in lr.drivers.items():
-            if driver.group != c:
-                continue
-
-            # Split name, and remove numbers
-            clean_name = re.sub(r"\d+", "", driver.name)
-            names = clean_name.split(" ")
-
-            d = copy.deepcopy(data)
-            d[0] = names[0]
-            d[1] = names[-1]
-            d[5] = iRid
-            d[6] = driver.car_number
-            d[14] = driver.earned_points - driver.drop_points
-            d[17] = driver.earned_points - driver.drop_points
-            class_standings.append(d)
-        class_standings.sort(key=lambda x: x[-1], reverse=True)
-        class_standings.insert(0, headers)
-        return class_standings
-
-    num_races = lg.num_races_run()
-    for group in cfg.group_rules.keys():
-        standings = pull_class(group, lg)
-        filename = out_dir / f"{cfg.name} {cfg.season} {group} [r={num_races}].csv"
-        with open(filename, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerows(standings)
+def broadcast_standings(cfg: LeagueConfiguration, lg: LeagueResult, out_dir: Path,
+                        formats: list[StandingsFormat] = tuple(StandingsFormat)):
+    return export_standings(lg, list(cfg.group_rules.keys()), out_dir, f"{cfg.name} {cfg.season}", formats)
@@ -0,0 +1,85 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+import contextlib
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.event import add_lap_data, pull_event
+from core.synthetic import SyntheticDataClient, SyntheticEvent, SyntheticLeague
+
+
+def pytest_configure(config):
+    # Keep every benchmark run in .benchmarks/, named by commit, so runs can be compared with
+    #   python -m pytest tests --benchmark-compare --benchmark-compare-fail=mean:10%
+    if hasattr(config.option, "benchmark_autosave") and not config.option.benchmark_disable:
+        from pytest_benchmark.utils import get_tag
+        config.option.benchmark_autosave = get_tag()
+
+
+class _ScoreClient:
+    """ Just enough of a ClientMain for score_league """
+
+    def __init__(self, idc):
+        self.idc = idc
+        self.google_credentials = dict()
+
+
+class _FailingDataClient(SyntheticDataClient):
+    """ Loses its connection after pulling a few results, until fail_after is None """
+    __slots__ = ["fail_after", "results"]
+
+    def __init__(self, responses, fail_after: int = None):
+        super().__init__(responses)
+        self.fail_after = fail_after
+        self.results = []  # Subsession ids pulled
+
+    def result(self, subsession_id: int, include_licenses: bool = False):
+        if self.fail_after is not None and len(self.results) == self.fail_after:
+            raise ConnectionError("iRacing is having a bad night")
+        self.results.append(subsession_id)
+        return super().result(subsession_id, include_licenses)
+
+
+@pytest.fixture
+def failing_client(request):
+    """
+    An idc that raises ConnectionError after pulling a few results
+    Parametrize indirectly with (SyntheticLeague, number of results pulled before it fails)
+    """
+    league, fail_after = request.param
+    return _FailingDataClient(league.responses, fail_after)
+
+
+@pytest.fixture
+def score_client(request):
+    """ A client for score_league, pulling from the SyntheticLeague it is indirectly parametrized with """
+    return _ScoreClient(SyntheticDataClient(request.param.responses))
+
+
+@pytest.fixture(scope="session")
+def synthetic_league():
+    """ A league about the size of our real ones, 40 drivers in 2 classes over a 14 race season """
+    return SyntheticLeague(num_drivers=40, num_races=14, laps=40, classes={"Pro": (1, 99), "Am": (100, 199)}, seed=1)
+
+
+@pytest.fixture(scope="session")
+def scored_season(synthetic_league):
+    cfg = synthetic_league.configuration()
+    return cfg.fetch_and_score_league(SyntheticDataClient(synthetic_league.responses))
+
+
+@pytest.fixture(scope="session")
+def synthetic_event(tmp_path_factory):
+    """ A pulled, 10 split team event with lap data """
+    generator = SyntheticEvent(num_splits=10, teams_per_split=40, laps=200, seed=1)
+    idc = SyntheticDataClient(generator.responses)
+    # pull_event caches what it pulls under ./events
+    with contextlib.chdir(tmp_path_factory.mktemp("event")):
+        event = pull_event(idc, generator.series_name, generator.year, detailed_team=True)
+        add_lap_data(idc, event, list(range(1, event.num_splits + 1)))
+    return event
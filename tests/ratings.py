@@ -1,169 +1,72 @@
 # Distributed under the Apache License, Version 2.0.
 # See accompanying NOTICE file for details.
 
-import json
+import argparse
 from pathlib import Path
-from trueskill import TrueSkill
 # An interesting use of trueskill
 # https://www.reddit.com/r/formula1/comments/1cb4aen/trueskill_ratings_separating_driver_performance/
 
-from core.objects import LeagueResult
-
-
-def assess_seasons(season_filenames: list) -> dict:
-    league_ratings = {}
-    for season_filename in season_filenames:
-        assess_season(season_filename, league_ratings)
-    # Sort the league_ratings by rating mu
-    driver_rankings = sorted(list(league_ratings.values()), key=lambda d: (d["rating"].mu-3*d["rating"].sigma), reverse=True)
-    for idx, driver in enumerate(driver_rankings):
-        driver["league_rank"] = idx+1
-    return league_ratings
-
-
-def assess_season(season_filename: Path, league_ratings: dict):
-    print(f"Assessing {season_filename}")
-    with open(season_filename, 'r') as file:
-        league_ledger = LeagueResult.from_dict(json.load(file))
-
-    env = TrueSkill()  # uses default settings
-
-    num_races = len(league_ledger.races)
-    print(f"There are {num_races} races")
-
-    for r in range(1, num_races+1):
-        race = league_ledger.get_race(r)
-        results = race.get_results()
-        if len(results) == 0:
-            continue
-        driver_ratings = []
-        for result in results:
-            if result[0] not in league_ratings:
-                league_ratings[result[0]] = {"name": league_ledger.get_driver(result[0]).name,
-                                             "rating": env.create_rating(),
-                                             "starts": 0,
-                                             "league_rank": None,
-                                             "season_rank": None}
-            driver_ratings.append((league_ratings[result[0]]["rating"],))
-        new_driver_ratings = env.rate(driver_ratings)
-        # Push the new driver ratings into our league_ratings
-        for i, result in enumerate(results):
-            league_ratings[result[0]]["rating"] = new_driver_ratings[i][0]
-
-    for cust_id, items in league_ratings.items():
-        driver = league_ledger.get_driver(cust_id)
-        if driver:
-            items["starts"] += driver.total_race_starts
-
-    return league_ratings
-
-
-# Trim the given league ratings to only the drivers in the given season file
-def trim(league_ratings: dict, season_filename: Path):
-    season_ratings = {}
-    with open(season_filename, 'r') as file:
-        season_ledger = LeagueResult.from_dict(json.load(file))
-    for cust_id in season_ledger.drivers.keys():
-        if cust_id not in league_ratings:
-            print(f"{cust_id} is a new driver")
-        else:
-            season_ratings[cust_id] = league_ratings[cust_id]
-    # Sort the league_ratings by rating mu
-    driver_rankings = sorted(list(season_ratings.values()), key=lambda d: d["rating"].mu, reverse=True)
-    for idx, driver in enumerate(driver_rankings):
-        driver["season_rank"] = idx + 1
-    return season_ratings
-
-
-def write_ratings_file(league_ratings: dict, rating_filename: Path, sigma_threshold: float = None):
-    league_order = []
-    for cust_id, items in league_ratings.items():
-        if sigma_threshold and items["rating"].sigma > sigma_threshold:
-            continue
-        j_items = items.copy()
-        j_items["mu"] = j_items["rating"].mu
-        j_items["sigma"] = j_items["rating"].sigma
-        j_items["rating"] = j_items["mu"] - (3*j_items["sigma"])
-        league_order.append(j_items)
-    sorted_ratings = sorted(league_order, key=lambda x: x["rating"], reverse=True)
-
-    if rating_filename.suffix == ".txt":
-        with open(rating_filename, 'w', encoding='utf-8') as file:
-            for idx, p in enumerate(sorted_ratings):
-                file.write(f"{idx+1}. {p['name']} ({p['league_rank']}) {p['rating']} ({p['mu']} {p['sigma']}) {p['starts']} starts\n")
-    elif rating_filename.suffix == ".json":
-        with open(rating_filename, 'w') as file:
-            json.dump(sorted_ratings, file, indent=2)
+from core.ratings import rebuild_leagues
+
+_out_dir = Path("./ratings")
+# The seasons of each league, in the order they were run, named like their configurations so score_league shares
+# the rating store kept in _out_dir
+_leagues = {
+    "ams": {"name": "American Muscle Series",
+            "season_filenames": [Path("./results/American Muscle Series Season 1.json"),
+                                 Path("./results/American Muscle Series Season 2.json"),
+                                 Path("./results/American Muscle Series Season 3.json"),
+                                 Path("./results/American Muscle Series Season 4.json"),
+                                 Path("./results/American Muscle Series Season 5.json"),
+                                 Path("./results/American Muscle Series Season 6.json"),
+                                 Path("./results/American Muscle Series Season 7.json"),
+                                 Path("./results/American Muscle Series Season 8.json")],
+            # Path("./results/American Muscle Series Season 9.json")]
+            "current_season_filename": Path("./results/American Muscle Series Season 9.json")},
+    "ww-ff": {"name": "FF Weekend Warriors",
+              "season_filenames": [Path("./results/FF Weekend Warriors 2025 S1 FF Weekend Warriors.json"),
+                                   Path("./results/FF Weekend Warriors 2025 S2.json"),
+                                   Path("./results/FF Weekend Warriors 2025S3 WW FF1600.json"),
+                                   Path("./results/FF Weekend Warriors 2025S4 WW FF1600.json")]},
+    "ww-fv": {"name": "FV Weekend Warriors",
+              "season_filenames": [Path("./results/FV Weekend Warriors WW FV 2025 S1.json"),
+                                   Path("./results/FV Weekend Warriors WW FV 2025 S2.json"),
+                                   Path("./results/FV Weekend Warriors WW FV 2025 S3.json"),
+                                   Path("./results/FV Weekend Warriors WW FV 2025 S4.json")]},
+    "ww-srf": {"name": "SRF Weekend Warriors",
+               "season_filenames": [Path("./results/SRF Weekend Warriors 2025 S1 SRF Weekend Warriors.json"),
+                                    Path("./results/SRF Weekend Warriors 2025 S2.json"),
+                                    Path("./results/SRF Weekend Warriors 2025 S3 SRF WW.json"),
+                                    Path("./results/SRF Weekend Warriors 2025S4 WW SRF 10yr Anniversary season.json")]},
+    "rnp": {"name": "Road N' Plate Palm Rat Golf Series",
+            "season_filenames": [Path("./results/Road N' Plate Palm Rat Golf Series Season 1.json"),
+                                 Path("./results/Road N' Plate Palm Rat Golf Series Season 2.json"),
+                                 Path("./results/Road N' Plate Palm Rat Golf Series Season 3.json"),
+                                 Path("./results/Road N' Plate Palm Rat Golf Series Season 4.json"),
+                                 Path("./results/Road N' Plate Palm Rat Golf Series Season 5.json"),
+                                 Path("./results/Road N' Plate Palm Rat Golf Series Season 6.json"),
+                                 Path("./results/Road N' Plate Palm Rat Golf Series Season 7.json"),
+                                 Path("./results/Road N' Plate Palm Rat Golf Series Special Events.json"),
+                                 Path("./results/Road N' Plate Palm Rat Golf Series Summer Series 2025.json")],
+            "current_season_filename": Path("./results/Road N' Plate Palm Rat Golf Series Season 7.json")},
+}
 
 
 def main():
-    out_dir = Path("./ratings")
-    todo = ["ams"]  # ["ww-srf", "ww-ff", "ww-fv"]  # , "rnp"]
-
-    def write_ratings(name: str, season_files: list, dst: Path, trim_season_file: Path = None):
-        ratings = assess_seasons(season_files)
-        dst.mkdir(exist_ok=True, parents=True)
-        write_ratings_file(ratings, dst/f"{name} League Ratings.txt")
-        write_ratings_file(ratings, dst/f"{name} League Ratings.json")
-        write_ratings_file(ratings, dst/f"{name} Trimmed League Ratings.txt", sigma_threshold=2.0)
-        if trim_season_file is None:
-            current_ratings = trim(ratings, season_files[-1])
-        else:
-            current_ratings = trim(ratings, trim_season_file)
-        write_ratings_file(current_ratings, dst/f"{name} Current Ratings.txt")
-
-    for lg in todo:
-        if lg == "ams":
-            seasons = [Path("./results/American Muscle Series Season 1.json"),
-                       Path("./results/American Muscle Series Season 2.json"),
-                       Path("./results/American Muscle Series Season 3.json"),
-                       Path("./results/American Muscle Series Season 4.json"),
-                       Path("./results/American Muscle Series Season 5.json"),
-                       Path("./results/American Muscle Series Season 6.json"),
-                       Path("./results/American Muscle Series Season 7.json"),
-                       Path("./results/American Muscle Series Season 8.json")]
-                       #Path("./results/American Muscle Series Season 9.json")]
-            write_ratings(name="American Muscle Series", season_files=seasons, dst=out_dir/f"{lg}",
-                          trim_season_file=Path("./results/American Muscle Series Season 9.json"))
-            continue
-
-        if lg == "ww-ff":
-            seasons = [Path("./results/FF Weekend Warriors 2025 S1 FF Weekend Warriors.json"),
-                       Path("./results/FF Weekend Warriors 2025 S2.json"),
-                       Path("./results/FF Weekend Warriors 2025S3 WW FF1600.json"),
-                       Path("./results/FF Weekend Warriors 2025S4 WW FF1600.json")]
-            write_ratings(name="Weekend Warriors FF", season_files=seasons, dst=out_dir/f"{lg}")
-            continue
-
-        if lg == "ww-fv":
-            seasons = [Path("./results/FV Weekend Warriors WW FV 2025 S1.json"),
-                       Path("./results/FV Weekend Warriors WW FV 2025 S2.json"),
-                       Path("./results/FV Weekend Warriors WW FV 2025 S3.json"),
-                       Path("./results/FV Weekend Warriors WW FV 2025 S4.json")]
-            write_ratings(name="Weekend Warriors FV", season_files=seasons, dst=out_dir/f"{lg}")
-            continue
-
-        if lg == "ww-srf":
-            seasons = [Path("./results/SRF Weekend Warriors 2025 S1 SRF Weekend Warriors.json"),
-                       Path("./results/SRF Weekend Warriors 2025 S2.json"),
-                       Path("./results/SRF Weekend Warriors 2025 S3 SRF WW.json"),
-                       Path("./results/SRF Weekend Warriors 2025S4 WW SRF 10yr Anniversary season.json")]
-            # seasons = list(Path("./results").glob("SRF*.json"))
-            write_ratings(name="Weekend Warriors SRF", season_files=seasons, dst=out_dir/f"{lg}")
-            continue
-
-        if lg == "rnp":
-            seasons = [Path("./results/Road N' Plate Palm Rat Golf Series Season 1.json"),
-                       Path("./results/Road N' Plate Palm Rat Golf Series Season 2.json"),
-                       Path("./results/Road N' Plate Palm Rat Golf Series Season 3.json"),
-                       Path("./results/Road N' Plate Palm Rat Golf Series Season 4.json"),
-                       Path("./results/Road N' Plate Palm Rat Golf Series Season 5.json"),
-                       Path("./results/Road N' Plate Palm Rat Golf Series Season 6.json"),
-                       Path("./results/Road N' Plate Palm Rat Golf Series Season 7.json"),
-                       Path("./results/Road N' Plate Palm Rat Golf Series Special Events.json"),
-                       Path("./results/Road N' Plate Palm Rat Golf Series Summer Series 2025.json")]
-            write_ratings(name="Road n' Plate", season_files=seasons, dst=out_dir/f"{lg}", current_season_idx=6)
-            continue
+    parser = argparse.ArgumentParser(description="Rebuild league ratings, only rating races that are new")
+    parser.add_argument("leagues", nargs='*',
+                        help=f"Leagues to rebuild ({', '.join(_leagues.keys())}), default is all of them.")
+    parser.add_argument("-j", "--jobs", default=None, type=int,
+                        help="Number of leagues to rebuild at once, default is one per core.")
+    opts = parser.parse_args()
+    for lg in opts.leagues:
+        if lg not in _leagues:
+            parser.error(f"Unknown league: {lg}")
+
+    leagues = [{**_leagues[lg], "ratings_dir": _out_dir} for lg in opts.leagues or _leagues.keys()]
+    for rebuilt in rebuild_leagues(leagues, opts.jobs):
+        print(f"{rebuilt['name']}: rated {rebuilt['races']} new races, "
+              f"{rebuilt['drivers']} drivers, in {rebuilt['seconds']:.2f}s")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,98 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+import gc
+import numpy as np
+import os
+import pytest
+
+from core.archive import SeasonArchive
+from core.synthetic import SyntheticDataClient, SyntheticLeague
+
+
+def test_season_archive(tmp_path):
+    league = SyntheticLeague(num_drivers=10, num_seasons=2, num_races=3, laps=4, seed=6)
+    idc = SyntheticDataClient(league.responses)
+    seasons = {league.season_name(season): league.configuration(season=season).fetch_and_score_league(idc)
+               for season in (1, 2)}
+
+    archive = SeasonArchive(tmp_path)
+    for name, lg in seasons.items():
+        archive.add_season(league.name, name, lg, stamp="1")
+    assert archive.add_season(league.name, "Season 2", seasons["Season 2"], stamp="1")["id"] == 1  # Unchanged
+
+    # Every result and lap of a driver, across seasons, from a reopened archive
+    archive = SeasonArchive(tmp_path)
+    cust_id = next(iter(seasons["Season 2"].drivers))
+    expected = [(season_id, number, result.finish_position)
+                for season_id, lg in enumerate(seasons.values())
+                for number, race in lg.races.items()
+                for c, result in race.grid.items() if c == cust_id]
+    results = archive.driver_results(cust_id)
+    assert list(zip(results["season"], results["race"], results["finish_position"])) == expected
+    num_laps = sum(len(race.grid[cust_id].laps) for lg in seasons.values()
+                   for race in lg.races.values() if cust_id in race.grid)
+    assert len(archive.driver_laps(cust_id)["time"]) == num_laps
+    assert archive.name(cust_id) == seasons["Season 2"].drivers[cust_id].name
+    race = seasons["Season 1"].races[2]
+    assert sorted(archive.season_results(league.name, "Season 1", race=2)["cust_id"]) == sorted(race.grid)
+
+    # Archiving a season again supersedes its rows, until they are compacted away
+    num_results = archive.num_rows("results")
+    archive.add_season(league.name, "Season 1", seasons["Season 1"], stamp="2")
+    assert len(archive.seasons()) == 2 and len(archive.seasons(superseded=True)) == 3
+    assert len(archive.driver_results(cust_id)["season"]) == len(expected)
+    archive.compact()
+    assert archive.num_rows("results") == num_results
+    assert len(SeasonArchive(tmp_path).driver_results(cust_id)["season"]) == len(expected)
+
+
+def test_season_archive_compacts(tmp_path):
+    league = SyntheticLeague(num_drivers=6, num_seasons=2, num_races=2, laps=2, seed=7)
+    idc = SyntheticDataClient(league.responses)
+    seasons = [league.configuration(season=season).fetch_and_score_league(idc) for season in (1, 2)]
+
+    archive = SeasonArchive(tmp_path, compact_ratio=0.4)
+    archive.add_season(league.name, "Season 1", seasons[0], stamp="1")
+    archive.add_season(league.name, "Season 2", seasons[1], stamp="1")
+    num_rows = {table: archive.num_rows(table) for table in ("drivers", "results", "laps")}
+    archive.add_season(league.name, "Season 2", seasons[1], stamp="2")
+    assert 0 < archive.superseded_ratio() <= 0.4
+    # Superseding more of the rows than the ratio compacts them away
+    archive.add_season(league.name, "Season 2", seasons[1], stamp="3")
+    assert archive.superseded_ratio() == 0
+    assert len(archive.seasons(superseded=True)) == 2
+    assert {table: archive.num_rows(table) for table in num_rows} == num_rows
+    assert archive.find_season(league.name, "Season 2")["stamp"] == "3"
+
+
+def test_season_archive_compacts_unmapped(tmp_path, monkeypatch):
+    league = SyntheticLeague(num_drivers=6, num_races=2, laps=2, seed=8)
+    lg = league.configuration().fetch_and_score_league(SyntheticDataClient(league.responses))
+    archive = SeasonArchive(tmp_path)
+    archive.add_season(league.name, "Season 1", lg, stamp="1")
+    archive.add_season(league.name, "Season 1", lg, stamp="2")
+    cust_id = next(iter(lg.drivers))
+    expected = archive.driver_results(cust_id)["finish_position"].tolist()
+
+    # Like Windows, refuse to replace a column file that is still memory mapped
+    replace = os.replace
+
+    def windows_replace(src, dst):
+        mapped = [m for m in gc.get_objects() if isinstance(m, np.memmap) and m._mmap is not None and
+                  os.path.samefile(m.filename, dst)]
+        if mapped:
+            raise PermissionError(f"{dst} is memory mapped")
+        replace(src, dst)
+
+    held = archive.column("results", "cust_id")
+    (tmp_path / "copy.bin").write_bytes(b"")
+    with pytest.raises(PermissionError):
+        windows_replace(tmp_path / "copy.bin", tmp_path / "results" / "cust_id.bin")
+    del held
+
+    monkeypatch.setattr(os, "replace", windows_replace)
+    archive.compact()
+    monkeypatch.undo()
+    assert archive.driver_results(cust_id)["finish_position"].tolist() == expected
+    assert archive.superseded_ratio() == 0
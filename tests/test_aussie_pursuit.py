@@ -0,0 +1,95 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+import csv
+import numpy as np
+import pytest
+
+from aussie_pursuit import best_lap_averages, HoldTimes, write_hold_times
+
+_drivers = [  # cust_id, name, car class, ai, practice lap times
+    (1, "Alex Arber", "MX5", False, [95.0, 94.0, 93.5, 93.0]),
+    (2, "Bobby Cal", "GT3", False, [80.0, 81.0, 79.0]),
+    (3, "Casey Dor", "GT3", True, [82.0, 81.5, 100.0]),
+    (4, "Dale Fen", "GT3", False, []),
+]
+
+
+class _LiveSession:
+    """ Answers with the laps run so far, and with results once the session is over """
+    def __init__(self, running: bool = False):
+        self.laps_run = 0
+        self.running = running
+
+    def result(self, subsession_id: int):
+        if self.running:
+            raise RuntimeError("Unhandled Error Response")  # As irDataClient does
+        results = [{"cust_id": cust_id, "display_name": name, "livery": {"car_number": str(cust_id)},
+                    "car_class_short_name": car_class, "ai": ai} for cust_id, name, car_class, ai, laps in _drivers]
+        return {"session_results": [{"simsession_number": -3, "results": results}]}
+
+    def result_lap_chart_data(self, subsession_id: int, simsession_number: int):
+        if simsession_number != -3:
+            return None
+        return [{"cust_id": cust_id, "display_name": name, "car_number": str(cust_id), "ai": ai,
+                 "lap_number": number, "lap_time": int(lap_time_s * 10000)}
+                for cust_id, name, car_class, ai, laps in _drivers
+                for number, lap_time_s in enumerate(laps[:self.laps_run], 1)]
+
+
+def test_hold_times(tmp_path):
+    idc = _LiveSession()
+    hold_times = HoldTimes(subsession_id=1, num_laps=10)
+    assert not hold_times.update(idc)  # No laps yet
+
+    idc.laps_run = 1
+    assert hold_times.update(idc)
+    assert hold_times.slowest_driver.cust_id == 1
+    assert hold_times.drivers[1].hold_time_s == 0
+    assert hold_times.drivers[2].hold_time_s == 150.0
+    assert not hold_times.update(idc)  # Nothing new
+
+    idc.laps_run = 4
+    assert hold_times.update(idc)
+    assert hold_times.drivers[1].average_lap_time_s == pytest.approx((93.0 + 93.5 + 94.0) / 3)  # The fastest 3
+    assert hold_times.drivers[2].average_lap_time_s == pytest.approx(80.0)
+    assert hold_times.drivers[3].average_lap_time_s == pytest.approx((81.5 + 82.0) / 2)  # Without the lap over 107%
+    # Without any laps, 2s faster than the fastest bot in their class
+    assert hold_times.drivers[4].average_lap_time_s == hold_times.drivers[3].average_lap_time_s - 2
+    assert hold_times.estimated_race_time_s == 10 * hold_times.drivers[1].average_lap_time_s
+
+    filename = write_hold_times(hold_times.table(), tmp_path / "holds.csv")
+    with open(filename, newline='', encoding="utf-8") as fp:
+        rows = list(csv.reader(fp))
+    assert [row[0] for row in rows[1:]] == ["Alex Arber", "Casey Dor*", "Bobby Cal", "Dale Fen"]
+
+
+def test_running_hold_times():
+    idc = _LiveSession(running=True)
+    hold_times = HoldTimes(subsession_id=1, num_laps=10)
+    assert not hold_times.update(idc)  # No laps, so no drivers yet
+
+    # Drivers come from the lap chart until there are results
+    idc.laps_run = 4
+    assert hold_times.update(idc)
+    assert sorted(hold_times.drivers.keys()) == [1, 2, 3]
+    assert hold_times.drivers[1].car_class is None
+    assert hold_times.drivers[3].name == "Casey Dor*"
+    assert hold_times.drivers[2].hold_time_s == pytest.approx(10 * (93.5 - 80.0))
+
+    # Once the session is over its results add car classes, and drivers without laps
+    idc.running = False
+    assert hold_times.update(idc)
+    assert hold_times.drivers[2].car_class == "GT3"
+    assert hold_times.drivers[4].average_lap_time_s == hold_times.drivers[3].average_lap_time_s - 2
+
+
+def test_best_lap_averages():
+    drivers = np.array([2, 0, 0, 2, 0, 2, 0])
+    lap_times_s = np.array([60.0, 91.0, 90.0, 70.0, 99.0, 61.0, 89.0])
+    averages, num_averaged = best_lap_averages(drivers, lap_times_s, 3, num_laps=2, max_ratio=1.07)
+    assert averages[0] == pytest.approx(89.5) and averages[2] == pytest.approx(60.5)
+    assert np.isnan(averages[1])
+    assert num_averaged.tolist() == [2, 0, 2]
+    averages, num_averaged = best_lap_averages(drivers, lap_times_s, 3, num_laps=4, max_ratio=1.1)
+    assert num_averaged.tolist() == [3, 0, 2]  # Not the 99s lap, or the 70s lap
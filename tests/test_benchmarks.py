@@ -0,0 +1,68 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+# Benchmarks of our hot paths, run with
+#   python -m pytest tests/test_benchmarks.py
+# Every run is saved to .benchmarks/ by commit (see conftest.py), compare against earlier runs with
+#   python -m pytest tests/test_benchmarks.py --benchmark-compare
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from core.league import rate_drivers
+from core.objects import SerializationFormat, serialize_league_result_from_string, serialize_league_result_to_string
+from core.plots import get_lap_positions
+from core.synthetic import SyntheticDataClient
+
+
+def _largest_race(lg):
+    return max(lg.races.values(), key=lambda race: race.grid_size)
+
+
+def test_score_season(benchmark, synthetic_league):
+    cfg = synthetic_league.configuration()
+    idc = SyntheticDataClient(synthetic_league.responses)
+    lg = benchmark.pedantic(cfg.fetch_and_score_league, args=(idc,), rounds=3, iterations=1)
+    assert len(lg.races) == synthetic_league.num_races
+
+
+@pytest.mark.parametrize("fmt", list(SerializationFormat), ids=lambda fmt: fmt.name)
+def test_serialize_league_result_to_string(benchmark, scored_season, fmt):
+    assert benchmark(serialize_league_result_to_string, scored_season, fmt)
+
+
+@pytest.mark.parametrize("fmt", list(SerializationFormat), ids=lambda fmt: fmt.name)
+def test_serialize_league_result_from_string(benchmark, scored_season, fmt):
+    src = serialize_league_result_to_string(scored_season, fmt)
+    lg = benchmark(serialize_league_result_from_string, src, fmt)
+    assert len(lg.drivers) == len(scored_season.drivers)
+
+
+def test_rate_drivers(benchmark, scored_season):
+    src = serialize_league_result_to_string(scored_season, SerializationFormat.BINARY)
+
+    def fresh_season():
+        return (serialize_league_result_from_string(src, SerializationFormat.BINARY),), {}
+
+    benchmark.pedantic(rate_drivers, setup=fresh_season, rounds=5, iterations=1)
+
+
+def test_get_results(benchmark, scored_season):
+    race = _largest_race(scored_season)
+    results = benchmark(race.get_results)
+    assert [result.finish_position for cust_id, result in results] == list(range(1, race.grid_size + 1))
+
+
+def test_get_lap_positions(benchmark, scored_season):
+    race = _largest_race(scored_season)
+    car_positions = benchmark(get_lap_positions, scored_season, race.number)
+    assert len(car_positions) == race.grid_size
+
+
+def test_get_driver_team_results(benchmark, synthetic_event):
+    # A driver in the last split, so every split is searched
+    team = next(iter(synthetic_event.get_result(synthetic_event.num_splits)._teams.values()))
+    cust_id = next(iter(team._drivers))
+    teams = benchmark(synthetic_event.get_driver_team_results, cust_id)
+    assert list(teams.keys()) == [synthetic_event.num_splits]
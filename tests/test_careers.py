@@ -0,0 +1,66 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+import pytest
+
+from core.archive import SeasonArchive
+from core.careers import DriverCareers
+from core.synthetic import SyntheticDataClient, SyntheticLeague
+
+
+def test_driver_careers(tmp_path):
+    league = SyntheticLeague(num_drivers=10, num_seasons=2, num_races=3, laps=4, seed=8)
+    idc = SyntheticDataClient(league.responses)
+    seasons = {league.season_name(season): league.configuration(season=season).fetch_and_score_league(idc)
+               for season in (1, 2)}
+
+    careers = DriverCareers(tmp_path)
+    name = "Season 1"
+    assert careers.add_season(league.name, name, seasons[name], stamp="1") == len(seasons[name].drivers)
+    assert careers.add_season(league.name, name, seasons[name], stamp="1") == 0  # Unchanged
+    # The same races scored by another configuration (ex. by class) are not counted twice
+    careers.add_season("By Class", name, seasons[name], stamp="1")
+    careers.add_season(league.name, "Season 2", seasons["Season 2"], stamp="1")
+
+    # Another process (ex. a bot) sees what was added
+    bot = DriverCareers(tmp_path)
+    assert len(bot) == len(set(seasons["Season 1"].drivers) | set(seasons["Season 2"].drivers))
+    for cust_id in seasons["Season 2"].drivers:
+        results = [race.grid[cust_id] for lg in seasons.values() for race in lg.races.values() if cust_id in race.grid]
+        career = bot.driver(cust_id)
+        assert career["starts"] == len(results)
+        assert career["wins"] == sum(lg.drivers[cust_id].total_wins for lg in seasons.values() if cust_id in lg.drivers)
+        assert career["incidents"] == sum(r.incidents for r in results)
+        assert career["laps"] == sum(r.laps_completed for r in results)
+        assert len(career["trajectory"]) == len(results)
+        assert career["mu"] == results[-1].mu
+        assert career["leagues"] == [league.name]
+        assert bot.find(career["name"].upper())[0][0] == cust_id
+
+    # Archiving a season again refreshes its drivers
+    cust_id = next(iter(seasons["Season 1"].drivers))
+    assert careers.add_season(league.name, name, seasons[name], stamp="2") >= len(seasons[name].drivers)
+    assert bot.driver(cust_id)["starts"] == DriverCareers(tmp_path).driver(cust_id)["starts"]
+    assert bot.driver(0) is None
+
+
+_scored_league = SyntheticLeague(num_drivers=8, num_races=3, laps=3, seed=9)
+
+
+@pytest.mark.parametrize("score_client", [_scored_league], indirect=True)
+def test_score_league_careers(tmp_path, monkeypatch, score_client):
+    from score_league import score_league
+
+    monkeypatch.chdir(tmp_path)
+    client = score_client
+    cfg = _scored_league.configuration()
+
+    score_league(client, cfg, broadcast=False)
+    assert not (tmp_path / "archive").exists()  # Only archived when asked to
+
+    # Scoring a season that has not changed archives nothing new
+    for _ in range(3):
+        score_league(client, cfg, broadcast=False, archive_dir=tmp_path / "archive")
+    archive = SeasonArchive(tmp_path / "archive")
+    assert len(archive.seasons(superseded=True)) == 1
+    assert len(DriverCareers(tmp_path / "archive")) == len(cfg.fetch_and_score_league(client.idc).drivers)
@@ -0,0 +1,79 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+import pytest
+
+from core.event import pull_event
+from core.synthetic import SyntheticDataClient, SyntheticEvent
+
+
+class _FailingDataClient(SyntheticDataClient):
+    """ Loses its connection after pulling a few splits """
+    __slots__ = ["_results_left"]
+
+    def __init__(self, responses, results_left: int):
+        super().__init__(responses)
+        self._results_left = results_left
+
+    def result(self, subsession_id: int, include_licenses: bool = False):
+        if self._results_left == 0:
+            raise ConnectionError("Lost iRacing")
+        self._results_left -= 1
+        return super().result(subsession_id, include_licenses)
+
+
+def test_pull_event_resumes(tmp_path, monkeypatch):
+    generator = SyntheticEvent(num_splits=5, teams_per_split=8, laps=10, seed=3)
+    for directory in ("whole", "resumed"):
+        (tmp_path / directory).mkdir()
+    monkeypatch.chdir(tmp_path / "whole")
+    whole = pull_event(SyntheticDataClient(generator.responses), generator.series_name, generator.year,
+                       detailed_team=True).as_dict()
+
+    monkeypatch.chdir(tmp_path / "resumed")
+    with pytest.raises(ConnectionError):
+        pull_event(_FailingDataClient(generator.responses, 3), generator.series_name, generator.year,
+                   detailed_team=True)
+    splits_directory = tmp_path / "resumed" / "events" / f"{generator.year}_{generator.series_name}_iR" / "splits"
+    assert len(list(splits_directory.glob("*.json"))) == 3
+
+    # Only the splits that were not pulled are pulled
+    event = pull_event(_FailingDataClient(generator.responses, 2), generator.series_name, generator.year,
+                       detailed_team=True)
+    assert event.num_splits == 5
+    assert all(result is None for result in dict.values(event._results))  # Nothing is read until it is used
+    assert event.get_result(2).subsession_id == whole["Results"]["2"]["SubsessionID"]
+    assert sum(result is not None for result in dict.values(event._results)) == 1
+    assert event.as_dict() == whole
+
+
+def test_pull_event_split_without_race(tmp_path, monkeypatch):
+    generator = SyntheticEvent(num_splits=3, teams_per_split=4, laps=5, seed=4)
+    monkeypatch.chdir(tmp_path)
+    idc = SyntheticDataClient(generator.responses)
+    season = idc.result_season_results(5000 + generator.year)["results_list"]
+    weakest = min(season, key=lambda r: r["event_strength_of_field"])["subsession_id"]
+    for ir_event in idc.result(weakest)["session_results"]:
+        ir_event["simsession_type"] = 3  # Not a race
+
+    event = pull_event(idc, generator.series_name, generator.year, detailed_team=True)
+    assert event.num_splits == 2
+    teams_directory = tmp_path / "events" / f"{generator.year}_{generator.series_name}_iR" / "teams"
+    assert not list(teams_directory.glob("*.tmp"))
+
+    # Nothing is pulled again, not even the split without a race
+    event = pull_event(_FailingDataClient(generator.responses, 0), generator.series_name, generator.year,
+                       detailed_team=True)
+    assert event.num_splits == 2
+
+
+def test_pull_event_read_elsewhere(tmp_path, monkeypatch):
+    generator = SyntheticEvent(num_splits=2, teams_per_split=4, laps=5, seed=5)
+    (tmp_path / "pulled").mkdir()
+    monkeypatch.chdir(tmp_path / "pulled")
+    event = pull_event(SyntheticDataClient(generator.responses), generator.series_name, generator.year,
+                       detailed_team=True)
+
+    # Splits are read from where they were pulled to, wherever we are when they are first used
+    monkeypatch.chdir(tmp_path)
+    assert len(event.get_result(1)._teams) == 4
@@ -0,0 +1,207 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+import json
+import pytest
+import requests
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timedelta, timezone
+
+from core import garage61
+from core.garage61 import Garage61Client, Garage61LapStore, TokenBucket
+
+
+class _FakeGarage61:
+    """ Answers lap queries from a list of laps, a page at a time, like Garage61 does """
+
+    def __init__(self, laps: list):
+        self.laps_driven = laps
+        self.calls = []
+
+    def laps(self, cars: list, date_after: datetime, limit: int, offset: int, **kwargs) -> list:
+        self.calls.append({"cars": cars, "date_after": date_after, "offset": offset})
+        after = date_after.astimezone(timezone.utc).replace(tzinfo=None)
+        laps = [lap for lap in self.laps_driven
+                if datetime.strptime(lap["startTime"], '%Y-%m-%dT%H:%M:%SZ') > after]
+        return laps[offset:offset + limit]
+
+    @staticmethod
+    def run_concurrently(fn, calls: list) -> list:
+        return [fn(**kwargs) for kwargs in calls]
+
+
+def _lap(lap_id: int, start: datetime) -> dict:
+    return {"id": str(lap_id), "startTime": start.strftime('%Y-%m-%dT%H:%M:%SZ')}
+
+
+def test_lap_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(garage61, "_max_laps_per_page", 4)
+    session = datetime(2025, 3, 1, 18)  # Naive UTC, like session_window
+    g61 = _FakeGarage61([_lap(i, session + timedelta(minutes=i)) for i in range(10)])
+    store = Garage61LapStore(g61, tmp_path / "laps.json")
+
+    # Every page is pulled, so the watermark is the newest lap, not the last on the first page
+    laps = store.laps("team", 1, [2], session - timedelta(hours=1), datetime.now() + timedelta(days=1))
+    assert [lap["id"] for lap in laps] == [str(i) for i in range(10)]
+    assert [call["offset"] for call in g61.calls] == [0, 4, 8]
+    assert g61.calls[0]["date_after"] == (session - timedelta(hours=1)).replace(tzinfo=timezone.utc)
+
+    # Only laps driven after the watermark are asked for
+    g61.calls.clear()
+    g61.laps_driven.append(_lap(10, session + timedelta(minutes=10)))
+    assert store.sync("team", 1, [2], session - timedelta(hours=1)) == 1
+    assert g61.calls[0]["date_after"] == (session + timedelta(minutes=9)).replace(tzinfo=timezone.utc)
+
+    # A window that closed is frozen, so rescoring a finished season makes no calls at all
+    window = (1, [2], session - timedelta(hours=1), session + timedelta(hours=1))
+    assert len(store.laps_many("team", [window])[0]) == 11
+    store = Garage61LapStore(None, tmp_path / "laps.json")  # Without a client, any call would fail
+    assert len(store.laps_many("team", [window])[0]) == 11
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_lap_store_time_zone(tmp_path, monkeypatch):
+    # Naive times are UTC, wherever the store runs
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    try:
+        session = datetime(2025, 3, 1, 18)
+        g61 = _FakeGarage61([])
+        store = Garage61LapStore(g61, tmp_path / "laps.json")
+        store.sync("team", 1, [2], session)
+        assert Garage61Client._create_payload(date_after=g61.calls[0]["date_after"]) == \
+            {"date_after": "2025-03-01T18:00:00Z"}
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+
+class _Clock:
+    """ Stands in for the time module, sleeping only moves the clock """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+        self._lock = threading.Lock()
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        with self._lock:
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+
+def _response(status_code: int, body=None, headers: dict = None) -> requests.Response:
+    r = requests.Response()
+    r.status_code = status_code
+    r._content = json.dumps(body).encode("utf-8")
+    r._content_consumed = True
+    r.headers.update(headers or {})
+    r.url = "https://garage61.net/api/v1/test"
+    return r
+
+
+class _Session:
+    """ Answers requests with the given responses (or exceptions), in order, or with respond(url) """
+
+    def __init__(self, responses: list = None, respond=None):
+        self.responses = list(responses or [])
+        self.respond = respond
+        self.urls = []
+        self._lock = threading.Lock()
+
+    def get(self, url: str, headers: dict, timeout: float, stream: bool = False):
+        with self._lock:
+            self.urls.append(url)
+            if self.respond is not None:
+                return self.respond(url)
+            response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.fixture
+def clock(monkeypatch) -> _Clock:
+    clock = _Clock()
+    monkeypatch.setattr(garage61, "time", clock)
+    return clock
+
+
+def _client(tmp_path, monkeypatch, session: _Session, **kwargs) -> Garage61Client:
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "g61.json").write_text(json.dumps({"cars": [], "tracks": []}))  # Or the client asks Garage61
+    g61 = Garage61Client("token", **kwargs)
+    g61._session = session
+    g61.use_garage61_ids(True)
+    return g61
+
+
+def test_token_bucket(clock):
+    bucket = TokenBucket(rate=2.0, capacity=3)
+    for _ in range(3):
+        bucket.acquire()  # The burst
+    assert clock.sleeps == []
+    bucket.acquire()
+    assert clock.now == pytest.approx(0.5)
+    clock.now += 10  # Tokens build up to the capacity, no more
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.now == pytest.approx(10.5)
+    bucket.acquire()
+    assert clock.now == pytest.approx(11.0)
+
+
+def test_request_retries(tmp_path, monkeypatch, clock):
+    with pytest.raises(ValueError):
+        Garage61Client("token", max_retries=-1)
+
+    # Throttled and server errors are retried with exponential backoff, or as long as Garage61 asks
+    session = _Session([_response(500), requests.ConnectionError("reset"), _response(429, headers={"Retry-After": "5"}),
+                        _response(200, {"id": 1})])
+    g61 = _client(tmp_path, monkeypatch, session, burst=10, backoff_s=1.0)
+    assert g61.me() == {"id": 1}
+    assert clock.sleeps == [1.0, 2.0, 5.0]
+
+    # Until we run out of retries
+    clock.sleeps.clear()
+    g61 = _client(tmp_path, monkeypatch, _Session([_response(503), _response(503)]), max_retries=1, burst=10)
+    with pytest.raises(requests.HTTPError):
+        g61.me()
+    assert clock.sleeps == [1.0]
+
+    # Any other error is raised right away, not returned as the resource
+    clock.sleeps.clear()
+    session = _Session([_response(404, {"error": "not found"})])
+    g61 = _client(tmp_path, monkeypatch, session, burst=10)
+    with pytest.raises(requests.HTTPError):
+        g61.me()
+    assert len(session.urls) == 1 and clock.sleeps == []
+
+
+def test_lap_store_laps_many(tmp_path, monkeypatch, clock):
+    def respond(url: str):
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+        track = query["tracks"][0]
+        return _response(200, {"items": [{"id": f"{track}-{i}", "startTime": "2025-03-01T18:00:00Z"}
+                                         for i in range(int(track))]})
+
+    session = _Session(respond=respond)
+    g61 = _client(tmp_path, monkeypatch, session, max_concurrency=3)
+    store = Garage61LapStore(g61, tmp_path / "laps.json")
+    start = datetime(2025, 3, 1)
+    queries = [(track, [7], start, start + timedelta(days=1)) for track in (3, 1, 2)]
+
+    # Every query is pulled (concurrently), and answered in the order asked
+    laps = store.laps_many("team", queries)
+    assert [[lap["id"] for lap in track_laps] for track_laps in laps] == \
+        [["3-0", "3-1", "3-2"], ["1-0"], ["2-0", "2-1"]]
+    assert len(session.urls) == 3
+
+    # The windows closed, so asking again pulls nothing
+    assert store.laps_many("team", queries) == laps
+    assert len(session.urls) == 3
@@ -0,0 +1,45 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+# Keep our command lines quick to start, heavy dependencies are imported where they are first used
+# See what an import costs with
+#   python -X importtime -c "import score_league"
+
+import subprocess
+import sys
+
+from pathlib import Path
+
+import pytest
+
+_root = Path(__file__).parent.parent
+# Seconds importing score_league may take, it was over a second when everything was imported up front
+_budget_s = 0.6
+_deferred = ["numpy", "pandas", "dataframe_image", "matplotlib", "trueskill", "gspread", "iracingdataapi"]
+
+
+def _python(code: str, *args) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *args, "-c", code], cwd=_root, capture_output=True, text=True, check=True)
+
+
+def _import_time_s(module: str) -> float:
+    """ Cumulative seconds python -X importtime reports for importing a module """
+    for line in _python(f"import {module}", "-X", "importtime").stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = [f.strip() for f in line.removeprefix("import time:").split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1e6
+    raise RuntimeError(f"No import time reported for {module}")
+
+
+@pytest.mark.parametrize("module", ["score_league"])
+def test_import_time(module):
+    # Best of a few, so a busy machine does not fail us
+    import_time_s = min(_import_time_s(module) for _ in range(3))
+    assert import_time_s < _budget_s, f"Importing {module} took {import_time_s:.3f}s"
+
+
+@pytest.mark.parametrize("module", ["score_league"])
+def test_heavy_imports_deferred(module):
+    loaded = _python(f"import sys, {module}; print(' '.join(sys.modules))").stdout.split()
+    assert [m for m in _deferred if m in loaded] == []
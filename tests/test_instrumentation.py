@@ -0,0 +1,32 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+import json
+
+from core import instrumentation
+
+
+def test_flush(tmp_path):
+    trace_filename = tmp_path / "logs" / "daemon.trace.json"
+    instrumentation.reset()
+    instrumentation.start(trace_filename, "daemon")
+    try:
+        for poll in (1, 2):
+            with instrumentation.span("daemon.poll", poll=poll):
+                instrumentation.cache("iracing.results", hit=poll == 2)
+            instrumentation.flush()
+
+            # Every poll writes its own trace, and nothing recorded is kept past it
+            with open(trace_filename, 'r', encoding="utf-8") as fp:
+                trace = json.load(fp)
+            assert [s["attrs"]["poll"] for s in trace["spans"]] == [poll]
+            assert trace["summary"]["caches"]["iracing.results"]["hits"] == (poll == 2)
+            assert instrumentation.summarize()["spans"] == {}
+    finally:
+        instrumentation.start(None)
+        instrumentation.reset()
+
+    # Without a trace to write, flushing just starts recording anew
+    instrumentation.count("laps")
+    instrumentation.flush()
+    assert instrumentation.summarize()["counters"] == {}
@@ -0,0 +1,236 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+import argparse
+import numpy as np
+import pytest
+
+from pathlib import Path
+
+from core import league as league_module
+from core.catalog import LeagueCatalog
+from core.clients import CachingDataClient, CheckpointDataClient
+from core.league import LapConditions, LapConditionsIndex, LeagueConfiguration, LeagueMain, LeagueWatcher
+from core.synthetic import SyntheticDataClient, SyntheticLeague
+
+
+class _CountingClient(SyntheticDataClient):
+
+    def __init__(self, responses):
+        super().__init__(responses)
+        self.calls = []
+
+    def league_seasons(self, league_id: int, retired: bool = False):
+        self.calls.append("seasons")
+        return super().league_seasons(league_id, retired)
+
+    def league_season_sessions(self, league_id: int, season_id: int, results_only: bool = False):
+        self.calls.append(season_id)
+        return super().league_season_sessions(league_id, season_id, results_only)
+
+
+def test_league_catalog(tmp_path):
+    league = SyntheticLeague(num_drivers=8, num_seasons=3, num_races=4, laps=3, seed=3)
+    season_ids = [league.league_id * 100 + season for season in range(1, 4)]
+    idc = _CountingClient(league.responses)
+
+    catalog = LeagueCatalog(tmp_path)
+    tracks = LeagueConfiguration.fetch_track_count(idc, league.league_id, catalog)
+    assert sum(track["count"] for track in tracks.values()) == 12
+    assert idc.calls == ["seasons"] + season_ids
+
+    # Every call refreshes, so a long running process sees new seasons, only pulling the active season's sessions
+    idc.calls.clear()
+    assert LeagueConfiguration.fetch_track_count(idc, league.league_id, catalog) == tracks
+    assert idc.calls == ["seasons", season_ids[-1]]
+
+    # Season names only need the season list
+    idc.calls.clear()
+    names = LeagueConfiguration.fetch_all_season_names(idc, league.league_id)
+    assert names == [league.season_name(season) for season in range(1, 4)]
+    assert idc.calls == ["seasons"]
+
+    # The next run only pulls the sessions of the active (last) season
+    idc.calls.clear()
+    catalog = LeagueCatalog(tmp_path)
+    assert LeagueConfiguration.fetch_track_count(idc, league.league_id, catalog) == tracks
+    assert idc.calls == ["seasons", season_ids[-1]]
+
+
+def _g61_lap(air_temp_c: float, wind_m_per_s: float = 2.0, rel_humidity: float = 0.5, wetness: int = 0) -> dict:
+    return {"airTemp": air_temp_c, "windVel": wind_m_per_s, "relativeHumidity": rel_humidity,
+            "trackWetness": wetness, "clouds": 1}
+
+
+def test_lap_conditions_index():
+    # Laps are bucketed by quantized conditions
+    assert LapConditions.from_g61_lap(_g61_lap(20.0)).key == LapConditions.from_g61_lap(_g61_lap(20.49)).key
+    assert LapConditions.from_g61_lap(_g61_lap(19.99)).key != LapConditions.from_g61_lap(_g61_lap(20.0)).key
+    assert LapConditions.from_g61_lap(_g61_lap(20.0, wetness=1)).key[3] is False
+
+    # Laps across a bucket edge are found, right up to the tolerance
+    session = LapConditions(20.0, 2.0, 0.5, True, 1)
+    index = LapConditionsIndex([_g61_lap(19.951), _g61_lap(19.95), _g61_lap(20.0499), _g61_lap(20.051),
+                                _g61_lap(20.0, wetness=1)])
+    assert [lap["airTemp"] for lap in index.matching(session)] == [19.951, 20.0499]
+    # And the laps that were close, but not close enough, with what did not match (the wet lap is not close)
+    assert [(lap["airTemp"], mismatches) for lap, mismatches in index.rejected(session)] == \
+        [(19.95, ["Failed Air Temp. Expected: 20.0, Lap 19.95"]),
+         (20.051, ["Failed Air Temp. Expected: 20.0, Lap 20.051"])]
+    wet = LapConditions.from_g61_lap(_g61_lap(20.0, wind_m_per_s=3.0, wetness=1))
+    assert session.mismatches(wet) == ["Failed wetness. Expected: dry, Lap wet", "Failed Wind. Expected: 2.0, Lap 3.0"]
+    assert len(index.matching(LapConditions(20.0, 2.0, 0.5, None, 1))) == 3  # Any wetness
+
+    # The same laps a scan of every lap finds
+    rng = np.random.default_rng(1)
+    laps = [_g61_lap(float(t), float(w), float(h), int(wet)) for t, w, h, wet in
+            zip(rng.uniform(19.8, 20.2, 2000), rng.uniform(1.99, 2.01, 2000), rng.uniform(0.499, 0.501, 2000),
+                rng.integers(0, 2, 2000))]
+    index = LapConditionsIndex(laps)
+    for session in (LapConditions(20.0, 2.0, 0.5, True, 1), LapConditions(19.9, 2.004, 0.5, None, 1)):
+        expected = [lap for lap in laps if session.matches(LapConditions.from_g61_lap(lap))]
+        assert expected and index.matching(session) == expected
+
+
+def test_league_watcher():
+    league = SyntheticLeague(num_drivers=12, num_races=4, laps=5, seed=2)
+    cfg = league.configuration()
+    idc = CachingDataClient(SyntheticDataClient(league.responses))
+    season_id = next(s["season_id"] for s in idc.league_seasons(league.league_id)["seasons"]
+                     if s["season_name"] == cfg.season)
+    last_session = idc.league_season_sessions(league.league_id, season_id)["sessions"][-1]
+    subsession_id = last_session.pop("subsession_id")  # The last race has not run yet
+
+    watcher = LeagueWatcher([cfg])
+    assert watcher.poll(idc) == [cfg]  # Everything is scored on the first poll
+    assert watcher.poll(idc) == [cfg]  # Until it is committed
+    watcher.commit()
+    assert watcher.poll(idc) == []
+    last_session["subsession_id"] = 1  # Running, no results yet
+    assert watcher.poll(idc) == []
+    last_session["subsession_id"] = subsession_id
+    assert watcher.poll(idc) == [cfg]
+    watcher.commit({(cfg.iracing_id, cfg.season)})  # It failed to score
+    assert watcher.poll(idc) == [cfg]
+    watcher.commit()
+    assert watcher.poll(idc) == []
+
+    # Scoring uses the results the watcher pulled
+    lg = cfg.fetch_and_score_league(idc)
+    assert len(lg.races) == 4
+    assert len(idc._results) == 4
+
+
+def test_league_main_watch():
+    league = SyntheticLeague(num_drivers=8, num_races=3, laps=3, seed=5)
+    main = LeagueMain.__new__(LeagueMain)  # Without parsing arguments
+    main.configs = [league.configuration()]
+    main._poll_interval_s = 0
+    main._idc = SyntheticDataClient(league.responses)
+
+    caches = []
+    main.watch(lambda cfg: caches.append(main.idc) or cfg, polls=3)
+    assert len(caches) == 1  # Scored on the first poll only, nothing completed since
+    assert isinstance(main.idc, CachingDataClient) and main.idc is not caches[0]
+    assert len(main.idc._results) == 0  # Completed races are not pulled (or kept) again
+    assert main.idc.client is caches[0].client
+
+
+def test_league_main_archive_dir():
+    parser = argparse.ArgumentParser()
+    LeagueMain.__new__(LeagueMain).add_args(parser)
+    # Seasons are archived where DriverCareers looks by default, unless we say otherwise
+    assert parser.parse_args([]).archive_dir == Path("./archive")
+    assert parser.parse_args(["-arc", "elsewhere"]).archive_dir == Path("elsewhere")
+
+
+class _FlakyClient(SyntheticDataClient):
+    """ Cannot look up the seasons of the leagues in failing """
+
+    def __init__(self, responses):
+        super().__init__(responses)
+        self.failing = set()
+
+    def league_seasons(self, league_id: int, retired: bool = False):
+        if league_id in self.failing:
+            raise ConnectionError("iRacing is having a bad night")
+        return super().league_seasons(league_id, retired)
+
+
+def test_league_main_watch_failures(monkeypatch):
+    a = SyntheticLeague(league_id=1000, name="A", num_drivers=6, num_races=3, laps=3, seed=7)
+    b = SyntheticLeague(league_id=2000, name="B", num_drivers=6, num_races=3, laps=3, seed=8)
+    responses = a.responses
+    responses.update(b.responses)
+    idc = _FlakyClient(responses)
+    season_id = idc.league_seasons(a.league_id)["seasons"][-1]["season_id"]
+    last_session = idc.league_season_sessions(a.league_id, season_id)["sessions"][-1]
+    subsession_id = last_session.pop("subsession_id")  # The last race of A has not run yet
+
+    main = LeagueMain.__new__(LeagueMain)  # Without parsing arguments
+    main.configs = [a.configuration(), b.configuration()]
+    main._poll_interval_s = 0
+    main._idc = idc
+
+    def before_poll_2():
+        # A's race completes, but the poll fails after looking at A
+        last_session["subsession_id"] = subsession_id
+        idc.failing.add(b.league_id)
+
+    def before_poll_3():
+        idc.failing.clear()
+
+    steps = iter([before_poll_2, before_poll_3, lambda: None, lambda: None])
+    monkeypatch.setattr(league_module.time, "sleep", lambda seconds: next(steps)())
+
+    scored = []
+    failures = ["A"]  # A fails to score the first time it is scored after its race completed
+
+    def score(cfg):
+        scored.append(cfg.name)
+        if len(scored) > 2 and cfg.name in failures:
+            failures.remove(cfg.name)
+            return None
+        return cfg
+
+    main.watch(score, polls=5)
+    # Both on the first poll, nothing on the failed poll, A once it completed and again when that failed
+    assert scored == ["A", "B", "A", "A"]
+
+
+_checkpoint_league = SyntheticLeague(num_drivers=10, num_races=5, laps=4, seed=6)
+
+
+@pytest.mark.parametrize("failing_client", [(_checkpoint_league, 3)], indirect=True)
+def test_checkpoint_data_client(tmp_path, failing_client):
+    cfg = _checkpoint_league.configuration()
+    expected = cfg.fetch_and_score_league(SyntheticDataClient(_checkpoint_league.responses)).as_dict()
+
+    # The pull fails part way through, keeping what it pulled
+    idc = failing_client
+    with pytest.raises(ConnectionError):
+        cfg.fetch_and_score_league(CheckpointDataClient(idc, tmp_path))
+    pulled = list(idc.results)
+    assert len(pulled) == 3
+    assert all((tmp_path / str(subsession_id) / "result.json").exists() for subsession_id in pulled)
+
+    # Running again only pulls the missing races, and scores the same season
+    idc.fail_after = None
+    idc.results.clear()
+    lg = cfg.fetch_and_score_league(CheckpointDataClient(idc, tmp_path))
+    assert len(idc.results) == 2 and not set(idc.results) & set(pulled)
+    assert lg.as_dict() == expected
+
+    # A result that did not come back is not kept, it is asked for again
+    class _NotReadyClient:
+        def __init__(self):
+            self.calls = 0
+
+        def result(self, subsession_id: int, include_licenses: bool = False):
+            self.calls += 1
+            return None
+
+    idc = _NotReadyClient()
+    checkpoint = CheckpointDataClient(idc, tmp_path)
+    assert checkpoint.result(1) is None and checkpoint.result(1) is None
+    assert idc.calls == 2 and not (tmp_path / "1").exists()
@@ -0,0 +1,59 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+from core.objects import LeagueResult, Race
+
+
+def _race(finish_positions: dict) -> Race:
+    race = Race(1, "2024-01-09", "Lime Rock Park", 1)
+    for cust_id, finish_position in finish_positions.items():
+        race.add_result(cust_id)._finish_position = finish_position
+    return race
+
+
+def _order(race: Race) -> list:
+    return [cust_id for cust_id, result in race.get_results()]
+
+
+def test_race_get_results():
+    race = _race({10: 3, 11: 1, 12: 2})
+    assert _order(race) == [11, 12, 10]
+
+    # A finish position changing (ex. a penalty) re-sorts
+    race.get_result(10)._finish_position = 1
+    race.get_result(11)._finish_position = 3
+    assert _order(race) == [10, 12, 11]
+
+    # As does a new car
+    race.add_result(13)._finish_position = 4
+    assert _order(race) == [10, 12, 11, 13]
+
+
+def test_race_get_results_keeps_every_car():
+    # Gaps, duplicates and cars without a finish position are all kept
+    race = _race({10: 5, 11: 2, 12: 2, 13: 0, 14: 1})
+    assert _order(race) == [14, 11, 12, 10, 13]
+
+
+def test_league_result_get_cust_id():
+    lg = LeagueResult()
+    lg.add_member(1, "Alex Arber2")
+    lg.add_member(2, "Alex Arber")
+    lg.add_member(3, "Bobby Cal")
+    lg.add_member(4, "Bobby Cal")  # The first member with a name wins
+    assert lg.get_cust_id("Alex Arber2") == 1
+    assert lg.get_cust_id("Bobby Cal") == 3
+    assert lg.get_cust_id("Casey Dor") is None
+
+    # An exact name beats one that only matches without its digits, even one added before it
+    assert lg.get_cust_id("Alex Arber", clean_nums=True) == 2
+    lg.add_member(5, "Dale Fen77")
+    assert lg.get_cust_id("Dale Fen") is None
+    assert lg.get_cust_id("Dale Fen", clean_nums=True) == 5
+
+    # Aliases (ex. Garage61 names) resolve to member names, but never over a member's own name
+    lg.add_aliases({"Casey D": "Bobby Cal", "Alex Arber2": "Bobby Cal", "Dale F": "Dale Fen"})
+    assert lg.get_cust_id("Casey D") == 3
+    assert lg.get_cust_id("Alex Arber2") == 1
+    assert lg.get_cust_id("Dale F") is None
+    assert lg.get_cust_id("Dale F", clean_nums=True) == 5
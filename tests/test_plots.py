@@ -0,0 +1,47 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+from pathlib import Path
+
+from core.plots import downsample_positions, get_lap_positions, plot_event_splits, plot_position_changes
+
+
+def _png_size(filename: Path) -> tuple[int, int]:
+    with open(filename, 'rb') as fp:
+        header = fp.read(24)
+    return int.from_bytes(header[16:20], "big"), int.from_bytes(header[20:24], "big")
+
+
+def test_plot_position_changes(tmp_path, scored_season):
+    race = max(scored_season.races.values(), key=lambda r: r.grid_size)
+    car_positions = get_lap_positions(scored_season, race.number)
+    filename = plot_position_changes(car_positions, tmp_path / "race.png", figsize=(16, 8))
+    width, height = _png_size(filename)
+    # Wide enough for every lap's label, plus 5 inch margins, at 100 dpi
+    max_laps = max(len(positions) for num, positions in car_positions)
+    assert height == 800 and 1000 + 15 * max_laps < width < 1000 + 40 * max_laps
+
+
+def test_downsample_positions():
+    car_positions = [("7", [(0, 3), (1, 3), (2, 3), (3, 2), (4, 2), (5, 2), (6, 1), (6, 2)]),
+                     ("", [(0, 1), (1, 1), (2, 1)]),
+                     ("9", [(0, 2), (1, 1), (2, 1), (3, 3), (4, 3), (5, 3), (6, 3)])]
+    assert downsample_positions(car_positions) == [
+        ("7", [(0, 3), (2, 3), (3, 2), (5, 2), (6, 1), (6, 2)]),
+        ("", [(0, 1), (2, 1)]),
+        ("9", [(0, 2), (1, 1), (2, 1), (3, 3), (6, 3)])]
+
+
+def test_plot_event_splits(tmp_path, monkeypatch, synthetic_event):
+    monkeypatch.chdir(tmp_path)
+    Path("./events").mkdir()
+    category = next(iter(synthetic_event.get_result(1)._teams.values())).category
+    filenames = plot_event_splits(synthetic_event, [(1, category), (2, category)], max_workers=2)
+    assert [f.name for f in filenames] == [f"{synthetic_event.year}_{synthetic_event.name}_Split_{split}_{category}.png"
+                                           for split in (1, 2)]
+    assert all(f.exists() for f in filenames)
+
+    # Level of detail plots are bounded, whatever the length of the race
+    filenames = plot_event_splits(synthetic_event, [(1, category)], max_workers=1, lod=True, suffix=".svg")
+    with open(filenames[0], encoding="utf-8") as fp:
+        assert 'width="2880pt"' in fp.read(1000)  # 40 inches
@@ -0,0 +1,143 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+import json
+import pytest
+
+from core.objects import Driver
+from core.ratings import load_season, rating_store_filename, RatingStore, rebuild_leagues, season_start
+from core.synthetic import SyntheticDataClient, SyntheticLeague
+
+
+def _write_seasons(league: SyntheticLeague, out_dir) -> list:
+    idc = SyntheticDataClient(league.responses)
+    filenames = []
+    for season in range(1, league.num_seasons + 1):
+        cfg = league.configuration(season=season)
+        filename = out_dir / f"{cfg.name} {cfg.season}.json"
+        with open(filename, 'w', encoding="utf-8") as fp:
+            json.dump(cfg.fetch_and_score_league(idc).as_dict(), fp)
+        filenames.append(filename)
+    return filenames
+
+
+def test_rating_store(tmp_path):
+    league = SyntheticLeague(num_drivers=16, num_seasons=2, num_races=5, laps=3, churn=0.2, seed=4)
+    idc = SyntheticDataClient(league.responses)
+    seasons = [league.configuration(season=season).fetch_and_score_league(idc) for season in (1, 2)]
+
+    rebuilt = RatingStore()
+    for season, lg in enumerate(seasons, 1):
+        assert rebuilt.add_season(f"Season {season}", lg) == 5
+    assert rebuilt.add_season("Season 2", seasons[1]) == 0  # Nothing new
+
+    # Adding to a saved store gives the same ratings as rating everything at once
+    store = RatingStore(tmp_path / "ratings.npz")
+    store.add_season("Season 1", seasons[0])
+    store.save()
+    store = RatingStore(tmp_path / "ratings.npz")
+    assert store.seasons == ["Season 1"]
+    store.add_season("Season 2", seasons[1])
+    assert store.table() == rebuilt.table()
+
+    table = store.table()
+    assert [row["league_rank"] for row in table] == list(range(1, len(table) + 1))
+    trimmed = store.table(sigma_threshold=5.0)
+    assert all(row["sigma"] <= 5.0 for row in trimmed) and len(trimmed) < len(table)
+    current = store.table(cust_ids=store.season_drivers("Season 2"))
+    assert {row["cust_id"] for row in current} == set(seasons[1].drivers.keys())
+    assert sorted(row["season_rank"] for row in current) == list(range(1, len(current) + 1))
+
+
+def test_rebuild_leagues(tmp_path):
+    leagues = []
+    for league_id in (1, 2):
+        league = SyntheticLeague(league_id=league_id, name=f"League {league_id}", num_drivers=12, num_seasons=2,
+                                 num_races=4, laps=3, seed=league_id)
+        leagues.append({"name": league.name,
+                        "season_filenames": _write_seasons(league, tmp_path),
+                        "ratings_dir": tmp_path / "ratings"})
+
+    # Seasons are loaded without their laps
+    season = load_season(leagues[0]["season_filenames"][0])
+    assert all(len(result.laps) == 0 for race in season.races.values() for result in race.grid.values())
+
+    rebuilt = rebuild_leagues(leagues, max_workers=2)
+    assert [r["races"] for r in rebuilt] == [8, 8]
+    assert (tmp_path / "ratings" / "League 2" / "League 2 Current Ratings.txt").exists()
+    # Nothing changed, so nothing is rated (or even read)
+    assert [r["races"] for r in rebuild_leagues(leagues, max_workers=1)] == [0, 0]
+
+    store = RatingStore()
+    for filename in leagues[0]["season_filenames"]:
+        store.add_season_file(filename)
+    assert store.table() == RatingStore(rating_store_filename("League 1", leagues[0]["ratings_dir"])).table()
+
+
+_scored_league = SyntheticLeague(num_drivers=12, num_seasons=2, num_races=4, laps=3, churn=0.2, seed=5)
+
+
+@pytest.mark.parametrize("score_client", [_scored_league], indirect=True)
+def test_score_league_ratings(tmp_path, monkeypatch, score_client):
+    from score_league import score_league
+
+    monkeypatch.chdir(tmp_path)
+    league = _scored_league
+    client = score_client
+    cfgs = [league.configuration(season=season) for season in (1, 2)]
+
+    score_league(client, cfgs[0], broadcast=False)
+    season1 = load_season(tmp_path / "results" / f"{cfgs[0].name} {cfgs[0].season}.json")
+    alone = {cust_id: driver.mu for cust_id, driver in season1.drivers.items()}
+    store = RatingStore(rating_store_filename(league.name, tmp_path / "ratings"))
+    assert store.seasons == [f"{cfgs[0].name} {cfgs[0].season}"]
+
+    # Season 2 starts from the ratings drivers finished season 1 with, not the default
+    import trueskill
+    rated = []
+    rate = trueskill.rate
+    monkeypatch.setattr(trueskill, "rate", lambda ratings, *args: rated.append(list(ratings)) or rate(ratings, *args))
+    score_league(client, cfgs[1], broadcast=False)
+    monkeypatch.setattr(trueskill, "rate", rate)
+    season2 = load_season(tmp_path / "results" / f"{cfgs[1].name} {cfgs[1].season}.json")
+    returning = [cust_id for cust_id in season2.drivers if cust_id in store]
+    assert returning
+    starts = sorted((rating.mu, rating.sigma) for (rating,) in rated[0])
+    newcomer = Driver(0)  # Drivers new to the league start from the Driver default
+    expected = sorted([store.rating(cust_id) for cust_id in returning] +
+                      [(newcomer.mu, newcomer.sigma)] * (len(season2.drivers) - len(returning)))
+    assert starts == expected
+    assert all(store.rating(cust_id) != (newcomer.mu, newcomer.sigma) for cust_id in returning)
+
+    # Scoring season 2 again still starts it from season 1, not from itself
+    score_league(client, cfgs[1], broadcast=False)
+    again = load_season(tmp_path / "results" / f"{cfgs[1].name} {cfgs[1].season}.json")
+    assert all(again.drivers[cust_id].mu == season2.drivers[cust_id].mu for cust_id in returning)
+    assert RatingStore(rating_store_filename(league.name, tmp_path / "ratings")).seasons == \
+        [f"{cfg.name} {cfg.season}" for cfg in cfgs]
+
+    # Scoring an earlier season after a later one never starts it from the later one
+    (tmp_path / "ratings").rename(tmp_path / "later")
+    score_league(client, cfgs[1], broadcast=False)
+    score_league(client, cfgs[0], broadcast=False)
+    season1 = load_season(tmp_path / "results" / f"{cfgs[0].name} {cfgs[0].season}.json")
+    assert {cust_id: driver.mu for cust_id, driver in season1.drivers.items()} == alone
+
+
+def test_rating_store_before():
+    league = SyntheticLeague(num_drivers=8, num_seasons=3, num_races=3, laps=3, seed=9)
+    idc = SyntheticDataClient(league.responses)
+    seasons = [league.configuration(season=season).fetch_and_score_league(idc) for season in (1, 2, 3)]
+    names = [f"{league.name} {league.season_name(season)}" for season in (1, 2, 3)]
+    store = RatingStore()
+    for name, lg in zip(names[1:], seasons[1:]):
+        store.add_season(name, lg)
+
+    # Seasons in the store start from the seasons added before them
+    assert store.before(names[1]).seasons == []
+    assert store.before(names[2]).seasons == [names[1]]
+    # Seasons that are not, from the seasons that started before them
+    assert store.before(names[0], season_start(seasons[0])).seasons == []
+    assert store.before(names[0], season_start(seasons[0])).num_rows == 0
+    later = store.before("Next Season", "9999-01-01")
+    assert later.seasons == names[1:] and later.num_rows == store.num_rows
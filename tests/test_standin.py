@@ -0,0 +1,53 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+import argparse
+import json
+import pytest
+
+from core.clients import ClientMain, data_client
+from core.standin import DataApiStandIn
+from core.synthetic import SyntheticDataClient, SyntheticLeague
+
+
+def _client_main(ir_base_url: str, record_dir, tmp_path) -> ClientMain:
+    main = ClientMain.__new__(ClientMain)  # Without parsing arguments
+    main._idc = None
+    main._name = "standin"
+    # No credentials at all, a stand-in does not need them
+    main.process_args(argparse.Namespace(profile=False,
+                                         credentials=tmp_path / "credentials.json",
+                                         google_credentials=tmp_path / "google.svc.credentials.json",
+                                         ir_base_url=ir_base_url,
+                                         record_dir=record_dir))
+    return main
+
+
+def test_standin(tmp_path):
+    from iracingdataapi.exceptions import AccessTokenInvalid
+
+    league = SyntheticLeague(num_drivers=8, num_races=3, laps=5, seed=4)
+    league.responses.save(tmp_path / "standin")
+    cfg = league.configuration()
+    expected = cfg.fetch_and_score_league(SyntheticDataClient(league.responses)).as_dict()
+
+    # Each data request answers with a link, lap charts in chunks, and some are rate limited (until now, so the
+    # client retries right away)
+    with DataApiStandIn(tmp_path / "standin", chunk_size=4, rate_limit_probability=0.3, rate_limit_reset_s=0,
+                        access_token="stand-in", seed=2) as standin:
+        main = _client_main(standin.url + "/", tmp_path / "recorded", tmp_path)
+        assert cfg.fetch_and_score_league(main.idc).as_dict() == expected
+        assert standin.counts["/data/results/lap_chart_data"] == 3
+        assert standin.num_rate_limited > 0
+
+        # Any other token is not valid
+        with pytest.raises(AccessTokenInvalid):
+            data_client("expired", standin.url).league_get(league.league_id)
+
+    # What was pulled was recorded as the stand-in serves it, lap charts whole
+    recorded = sorted(f.relative_to(tmp_path / "recorded") for f in (tmp_path / "recorded").rglob("*.json"))
+    assert sum(1 for f in recorded if f.parts[:2] == ("results", "lap_chart_data")) == 3
+    for filename in recorded:
+        with open(tmp_path / "recorded" / filename, 'r', encoding="utf-8") as fp:
+            with open(tmp_path / "standin" / filename, 'r', encoding="utf-8") as src:
+                assert json.load(fp) == json.load(src)
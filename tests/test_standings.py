@@ -0,0 +1,37 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+import csv
+import json
+
+from core.standings import export_standings, split_name, StandingsFormat
+
+
+def test_split_name():
+    assert split_name("John Smith2") == ("John", "Smith")
+    assert split_name("John Q 3 Smith") == ("John", "Smith")
+    assert split_name("Smith 42") == ("Smith", "Smith")
+    assert split_name("42") == ("", "")
+
+
+def test_export_standings(tmp_path, scored_season):
+    groups = sorted({driver.group for driver in scored_season.drivers.values()})
+    filenames = export_standings(scored_season, groups, tmp_path, "Synthetic", list(StandingsFormat))
+    assert len(filenames) == 2 * len(groups)
+    assert not list(tmp_path.glob("*.tmp"))
+
+    num_races = scored_season.num_races_run()
+    for group in groups:
+        num_drivers = sum(1 for driver in scored_season.drivers.values() if driver.group == group)
+        with open(tmp_path / f"Synthetic {group} [r={num_races}].csv", newline='', encoding="utf-8") as fp:
+            rows = list(csv.reader(fp))
+        assert rows[0][0] == "First name"
+        assert len(rows) == num_drivers + 1
+        points = [int(row[-1]) for row in rows[1:]]
+        assert points == sorted(points, reverse=True)
+
+        with open(tmp_path / f"Synthetic {group}.json", encoding="utf-8") as fp:
+            standings = json.load(fp)
+        assert standings["races"] == num_races
+        assert [s["points"] for s in standings["standings"]] == points
+        assert [s["cust_id"] for s in standings["standings"]] == [int(row[5]) for row in rows[1:]]
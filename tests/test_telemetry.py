@@ -0,0 +1,87 @@
+# Distributed under the Apache License, Version 2.0.
+# See accompanying NOTICE file for details.
+
+import math
+import numpy as np
+import pytest
+
+from core.telemetry import fastest_clean_lap_ids, fetch_all_lap_telemetry, parse_telemetry_csv, read_lap_telemetry
+
+
+def test_parse_telemetry_csv():
+    lines = ["Speed,Throttle,InPit",
+             "10.5,0.25,false",
+             "",  # Blank
+             "11.0,0.5",  # Truncated
+             "11.5,,True",
+             "12.0,1.0,true"]
+    channels = parse_telemetry_csv(lines)
+    assert list(channels.keys()) == ["Speed", "Throttle", "InPit"]
+    assert channels["Speed"].tolist() == [10.5, 11.5, 12.0]
+    assert channels["InPit"].tolist() == [0.0, 1.0, 1.0]
+    assert channels["Throttle"][0] == 0.25 and math.isnan(channels["Throttle"][1])
+    assert all(column.dtype == np.float64 for column in channels.values())
+    assert parse_telemetry_csv([]) == {}
+
+
+class _FakeGarage61:
+    """ Streams made up telemetry for each lap, failing on the laps it is told to """
+
+    def __init__(self, failing: set = None):
+        self.failing = set(failing or [])
+        self.pulled = []
+
+    def lap_csv_lines(self, lap_id: str):
+        self.pulled.append(lap_id)
+        yield "Speed,Lap"
+        for i in range(5):
+            if i == 3 and lap_id in self.failing:
+                raise ConnectionError(f"Lost lap {lap_id}")  # Part way through the lap
+            yield f"{10 * int(lap_id) + i},{lap_id}"
+
+    @staticmethod
+    def run_concurrently(fn, calls: list) -> list:
+        return [fn(**kwargs) for kwargs in calls]
+
+
+def test_fetch_all_lap_telemetry(tmp_path):
+    lap_ids = ["1", "2", "3"]
+
+    # An interrupted run keeps the laps it finished, and never leaves a partial lap behind
+    g61 = _FakeGarage61(failing={"2"})
+    with pytest.raises(ConnectionError):
+        fetch_all_lap_telemetry(g61, lap_ids, tmp_path)
+    assert sorted(f.name for f in tmp_path.iterdir()) == ["1.npz"]
+
+    # Running again only pulls the laps that are missing
+    g61 = _FakeGarage61()
+    filenames = fetch_all_lap_telemetry(g61, lap_ids, tmp_path)
+    assert g61.pulled == ["2", "3"]
+    assert list(filenames.keys()) == lap_ids
+    channels = dict(read_lap_telemetry(filenames["2"]))
+    assert channels["Speed"].tolist() == [20, 21, 22, 23, 24]
+    assert list(dict(read_lap_telemetry(filenames["3"], ["Lap"])).keys()) == ["Lap"]
+
+    # A lap asked for more than once is only downloaded once
+    g61 = _FakeGarage61()
+    assert list(fetch_all_lap_telemetry(g61, ["4", "4", "1"], tmp_path).keys()) == ["4", "1"]
+    assert g61.pulled == ["4"]
+    lap_ids.append("4")
+
+    # And once every lap is there, nothing at all
+    g61 = _FakeGarage61()
+    assert list(fetch_all_lap_telemetry(g61, lap_ids, tmp_path).keys()) == lap_ids
+    assert g61.pulled == []
+
+
+def test_fastest_clean_lap_ids():
+    def g61_lap(lap_id: str, slug: str, lap_time: float, **flags) -> dict:
+        lap = {"id": lap_id, "driver": {"slug": slug}, "lapTime": lap_time, "clean": True}
+        for flag in ["offtrack", "discontinuity", "joker", "incomplete", "pitlane", "pitIn", "pitOut"]:
+            lap[flag] = flags.get(flag, False)
+        return lap
+
+    laps = [g61_lap("1", "ann", 60.0), g61_lap("2", "ann", 59.0, offtrack=True), g61_lap("3", "ann", 59.5),
+            g61_lap("4", "bob", 58.0, pitOut=True), g61_lap("5", "bob", 61.0)]
+    laps.append({**g61_lap("6", "bob", 57.0), "clean": False})
+    assert fastest_clean_lap_ids(laps) == {"ann": "3", "bob": "5"}